@@ -11,10 +11,11 @@ import sys
 import time
 
 from astropy.coordinates import SkyCoord
-from pyrap.tables import table
 
 sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
 from oxkat import config as cfg
+from oxkat.ms_catalogue import get_catalogue
+from oxkat.ms_flags import antenna_flag_percentages
 
 
 bands = [(815e6,1080e6,'UHF'),
@@ -60,76 +61,67 @@ def calcsep(ra0,dec0,ra1,dec1):
     return sep.value
 
 
-def get_refant(master_ms,field_id):
+def get_refant(master_ms,cat,field_id):
 
-    """ Sorts a list of antennas in order of increasing flagged percentages based on field_id """
+    """ Ranks the antennas in order of increasing flagged percentage for field_id,
+    from a single pass through the FLAG column. Antennas in CAL_1GC_REF_POOL come
+    first, followed by the rest of the array, and antennas that are 80% or more
+    flagged are left out.
+    """
 
     mylogger = logging.getLogger(__name__) 
 
-    ant_names = get_antnames(master_ms)
-    main_tab = table(master_ms,ack='False')
-    
+    ant_names = get_antnames(cat)
     ref_pool = cfg.CAL_1GC_REF_POOL
-    
-    pc_list = []
-    idx_list = []
-
-    main_tab = table(master_ms,ack=False)
-    field_id = int(field_id)
-    for i in range(0,len(ref_pool)):
-        ant = ref_pool[i]
-        if ant in ant_names:
-            idx = ant_names.index(ant)
-            mytaql = 'ANTENNA1=={idx} || ANTENNA2=={idx} && FIELD_ID=={field_id}'.format(**locals())
-            sub_tab = main_tab.query(query=mytaql)
-            flags = sub_tab.getcol('FLAG')
-            vals,counts = numpy.unique(flags,return_counts=True)
-            if len(vals) == 1 and vals == True:
-                flag_pc = 100.0
-            elif len(vals) == 1 and vals == False:
-                flag_pc = 0.0
-            else:
-                flag_pc = 100.*round(float(counts[1])/float(numpy.sum(counts)),8)
-            if flag_pc < 80.0:
-                pc_list.append(flag_pc)
-                idx_list.append(str(idx))
-            mylogger.info('Antenna '+str(idx)+':'+ant+' is '+str(round(flag_pc,2))+chr(37)+' flagged')
-    pc_list = numpy.array(pc_list)
-    idx_list = numpy.array(idx_list)
 
-    ref_idx = idx_list[numpy.where(pc_list==(numpy.min(pc_list)))][0]
+    flag_pcs = antenna_flag_percentages(master_ms,field_id)
+
+    pool_list = []
+    other_list = []
+    for idx in range(0,len(ant_names)):
+        flag_pc = flag_pcs[idx]
+        if numpy.isnan(flag_pc):
+            continue
+        in_pool = ant_names[idx] in ref_pool
+        if in_pool:
+            mylogger.info('Antenna '+str(idx)+':'+ant_names[idx]+' is '+str(round(flag_pc,2))+chr(37)+' flagged (reference pool)')
+        else:
+            mylogger.info('Antenna '+str(idx)+':'+ant_names[idx]+' is '+str(round(flag_pc,2))+chr(37)+' flagged')
+        if flag_pc < 80.0:
+            if in_pool:
+                pool_list.append((flag_pc,idx))
+            else:
+                other_list.append((flag_pc,idx))
 
-    ranked_list = [x for _,x in sorted(zip(pc_list,idx_list))]
+    ranked_list = [str(idx) for _,idx in sorted(pool_list)+sorted(other_list)]
+    if len(ranked_list) == 0:
+        mylogger.info('All antennas are at least 80'+chr(37)+' flagged, using the least flagged antenna')
+        ranked_list = [str(int(numpy.nanargmin(flag_pcs)))]
     ranked_list = ','.join(ranked_list)
 
     return ranked_list
 
 
-def get_nchan(master_ms):
+def get_nchan(cat):
 
-    """ Returns the number of channels in master_ms.
+    """ Returns the number of channels in the MS.
     Only works for data with a single SPW
     """
 
-    spw_table = table(master_ms+'/SPECTRAL_WINDOW',ack=False)
-    nchan = spw_table.getcol('NUM_CHAN')[0]
-    spw_table.close()
+    nchan = cat['spw']['num_chan'][0]
     return nchan
 
 
-def get_band(master_ms):
+def get_band(cat):
 
     """ Returns the minimum and maxmium frequency
     and band estimate.
     """
 
-    spw_table = table(master_ms+'/SPECTRAL_WINDOW',ack=False)
-    chans = spw_table.getcol('CHAN_FREQ')[0]
-    min_freq = chans[0]
-    max_freq = chans[-1]
+    min_freq = cat['spw']['freq_first'][0]
+    max_freq = cat['spw']['freq_last'][0]
     mid_freq = numpy.mean((min_freq,max_freq))
     bw = max_freq - min_freq
-    spw_table.close()
 
     f0s = []
     for band in bands:
@@ -142,32 +134,35 @@ def get_band(master_ms):
     return min_freq,mid_freq,max_freq,bw,band
 
 
-def get_antnames(master_ms):
+def get_antnames(cat):
 
-    """ Returns a list of the antenna names in master_ms """
+    """ Returns a list of the antenna names in the MS """
 
-    ant_tab = table(master_ms+'/ANTENNA',ack=False)
-    ant_names = ant_tab.getcol('NAME')
-    ant_names = [a.lower() for a in ant_names]
-    ant_tab.close()
+    ant_names = [a.lower() for a in cat['antenna']['name']]
     return ant_names
 
 
-def get_fields(master_ms):
+def get_fields(cat):
 
     """ Returns lists of directions, names and integer source IDs
-    from the FIELD table of master_ms
+    from the FIELD table of the MS
     """
 
-    field_tab = table(master_ms+'/FIELD',ack=False)
-    field_dirs = field_tab.getcol('REFERENCE_DIR')*180.0/numpy.pi
-    field_names = field_tab.getcol('NAME')
-    field_ids = field_tab.getcol('SOURCE_ID')
-    field_tab.close()
+    field_dirs = numpy.array(cat['field']['reference_dir'])*180.0/numpy.pi
+    field_names = cat['field']['name']
+    field_ids = numpy.array(cat['field']['source_id'])
     return field_dirs,field_names,field_ids
 
 
-def get_states(master_ms,
+def get_field_states(cat,field_id):
+
+    """ Returns the STATE_IDs of the main table rows with FIELD_ID = field_id """
+
+    field_states = cat['scans']['field_states']
+    return field_states[field_states[:,0] == int(field_id),1]
+
+
+def get_states(cat,
                 primary_intent,
                 secondary_intent,
                 target_intent):
@@ -177,9 +172,7 @@ def get_states(master_ms,
     table, along with any UNKNOWN states.
     """
 
-    state_tab = table(master_ms+'/STATE',ack=False)
-    modes = state_tab.getcol('OBS_MODE')
-    state_tab.close()
+    modes = cat['state']['obs_mode']
 
     for i in range(0,len(modes)):
         if modes[i] == target_intent:
@@ -194,93 +187,81 @@ def get_states(master_ms,
     return primary_state, secondary_state, target_state, unknown_state
 
 
-def get_primary_candidates(master_ms,
+def get_primary_candidates(cat,
                 primary_state,
                 unknown_state,
                 field_dirs,
                 field_names,
                 field_ids):
 
-    """ Automatically identify primary calibrator candidates from master_ms """
+    """ Automatically identify primary calibrator candidates from the MS """
 
     candidate_ids = []
     candidate_names = []
     candidate_dirs = []
 
-    main_tab = table(master_ms,ack=False)
     for i in range(0,len(field_ids)):
         field_dir = field_dirs[i]
         field_name = field_names[i]
         field_id = field_ids[i]
-        sub_tab = main_tab.query(query='FIELD_ID=='+str(field_id))
-        states = numpy.unique(sub_tab.getcol('STATE_ID'))
+        states = get_field_states(cat,field_id)
         for state in states:
             if state == primary_state or state == unknown_state:
                 candidate_dirs.append(field_dir)
                 candidate_names.append(field_name)
                 candidate_ids.append(str(field_id))
-        sub_tab.close()
-    main_tab.close()
 
     return candidate_dirs, candidate_names, candidate_ids
 
 
-def get_secondaries(master_ms,
+def get_secondaries(cat,
                 secondary_state,
                 field_dirs,
                 field_names,
                 field_ids):
 
-    """ Automatically identify secondary calibrators from master_ms """
+    """ Automatically identify secondary calibrators from the MS """
 
     secondary_ids = []
     secondary_names = []
     secondary_dirs = []
 
-    main_tab = table(master_ms,ack=False)
     for i in range(0,len(field_ids)):
         field_dir = field_dirs[i]
         field_name = field_names[i]
         field_id = field_ids[i]
-        sub_tab = main_tab.query(query='FIELD_ID=='+str(field_id))
-        states = numpy.unique(sub_tab.getcol('STATE_ID'))
+        states = get_field_states(cat,field_id)
         for state in states:
             if state == secondary_state:
                 secondary_dirs.append(field_dir[0].tolist())
                 secondary_names.append(field_name)
                 secondary_ids.append(str(field_id))
-        sub_tab.close()
-    main_tab.close()
 
     return secondary_dirs, secondary_names, secondary_ids
 
 
-def get_targets(master_ms,
+def get_targets(cat,
                 target_state,
                 field_dirs,
                 field_names,
                 field_ids):
 
-    """ Automatically identify secondary calibrators from master_ms"""
+    """ Automatically identify secondary calibrators from the MS"""
 
     target_ids = []
     target_names = []
     target_dirs = []
 
-    main_tab = table(master_ms,ack=False)
     for i in range(0,len(field_ids)):
         field_dir = field_dirs[i]
         field_name = field_names[i]
         field_id = field_ids[i]
-        sub_tab = main_tab.query(query='FIELD_ID=='+str(field_id))
-        states = numpy.unique(sub_tab.getcol('STATE_ID'))
+        states = get_field_states(cat,field_id)
         for state in states:
             if state == target_state:
                 target_dirs.append(field_dir[0].tolist())
                 target_names.append(field_name)
                 target_ids.append(str(field_id))
-        sub_tab.close()
-    main_tab.close()
 
     return target_dirs, target_names, target_ids
 
@@ -380,6 +361,8 @@ def main():
 
     mylogger.info('Examining '+master_ms)
 
+    cat = get_catalogue(master_ms)
+
     outfile = 'project_info.json'
 
 
@@ -401,14 +384,14 @@ def main():
     #
     # FIELD INFO
 
-    field_dirs, field_names, field_ids = get_fields(master_ms)
+    field_dirs, field_names, field_ids = get_fields(cat)
 
 
     # ------------------------------------------------------------------------------
     #
     # NUMBER OF CHANNELS
 
-    nchan = get_nchan(master_ms)
+    nchan = get_nchan(cat)
     mylogger.info('MS has '+str(nchan)+' channels')
 
 
@@ -416,7 +399,7 @@ def main():
     #
     # DEDUCE THE BAND
 
-    min_freq,mid_freq,max_freq,bw,band = get_band(master_ms)
+    min_freq,mid_freq,max_freq,bw,band = get_band(cat)
     mylogger.info('Minimum frequency is '+str(min_freq/1e6)+' MHz')
     mylogger.info('Maximum frequency is '+str(max_freq/1e6)+' MHz')
     mylogger.info('Central frequency is '+str(mid_freq/1e6)+' MHz')
@@ -428,7 +411,7 @@ def main():
     #
     # STATE IDs
 
-    primary_state, secondary_state, target_state, unknown_state = get_states(master_ms,
+    primary_state, secondary_state, target_state, unknown_state = get_states(cat,
                                                             CAL_1GC_PRIMARY_INTENT,
                                                             CAL_1GC_SECONDARY_INTENT,
                                                             CAL_1GC_TARGET_INTENT)
@@ -443,7 +426,7 @@ def main():
         candidate_names = [field_names[int(i)] for i in candidate_ids]
         candidate_dirs = [field_dirs[int(i)] for i in candidate_ids]
     else:
-        candidate_dirs, candidate_names, candidate_ids = get_primary_candidates(master_ms,
+        candidate_dirs, candidate_names, candidate_ids = get_primary_candidates(cat,
                                                             primary_state,
                                                             unknown_state,
                                                             field_dirs,
@@ -463,7 +446,7 @@ def main():
     # REFERENCE ANTENNAS
 
     if CAL_1GC_REF_ANT == 'auto':
-        ref_ant = get_refant(master_ms,primary_id)
+        ref_ant = get_refant(master_ms,cat,primary_id)
         mylogger.info('Ranked reference antenna ordering: '+str(ref_ant))
     else:
         ref_ant = CAL_1GC_REF_ANT
@@ -480,7 +463,7 @@ def main():
         secondary_names = [field_names[i] for i in secondary_ids]
         secondary_dirs = [field_dirs[i] for i in secondary_ids]
     else:
-        secondary_dirs, secondary_names, secondary_ids = get_secondaries(master_ms,
+        secondary_dirs, secondary_names, secondary_ids = get_secondaries(cat,
                                                             secondary_state,
                                                             field_dirs,
                                                             field_names,
@@ -496,7 +479,7 @@ def main():
         target_names = [field_names[i] for i in target_ids]
         target_dirs = [field_dirs[i][0] for i in target_ids]
     else:
-        target_dirs, target_names, target_ids = get_targets(master_ms,
+        target_dirs, target_names, target_ids = get_targets(cat,
                                                             target_state,
                                                             field_dirs,
                                                             field_names,
@@ -3,159 +3,46 @@
 
 
 import glob
-import numpy
-import shutil
-from astropy import wcs
-from astropy.io import fits
+import os.path as o
+import sys
+from multiprocessing import Pool
 from optparse import OptionParser
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.fits_io import get_header, get_image, flush_fits, create_fits
+from oxkat.regions import process_region_file, circles_to_pixels, region_mask
 
 
 # ---------------------------------------------------------------------------------------
 
 
-def hms2deg(hms,delimiter=':'):
-
-    """ 
-    Right ascention string in hms to float in decimal degrees
-    """
-
-    h,m,s = hms.split(delimiter)
-    h = float(h)
-    m = float(m)
-    s = float(s)
-    deg = 15.0*(h+(m/60.0)+(s/3600.0))
-    return deg
-
-
-def dms2deg(dms,delimiter=':'):
-
-    """
-    Declination string in dms to float in decimal degrees
-    """
-
-    d,m,s = dms.split(delimiter)
-    if d[0] == '-':
-        decsign = -1.0
-        d = float(d[1:])
-    elif d[0] == '+':
-        decsign = 1.0
-        d = float(d[1:])
-    else:
-        decsign = 1.0
-        d = float(d)
-    m = float(m)
-    s = float(s)
-    deg = decsign*(d+(m/60.0)+(s/3600.0))
-
-    return deg
-
-
-def radius2deg(radius):
-
-    """
-    String with arcsec or arcmin unit to decimal degrees
-    """
-
-    if radius[-1] == '"':
-        radius = float(radius[:-1])/3600.0
-    elif radius[-1] == "'":
-        radius = float(radius[:-1])/60.0
-    else:
-        radius = float(radius)
-
-    return radius
-
-
-def process_region_file(region_file):
-
-    """
-    Extract RA,dec,radius as floats in degrees
-    from a DS9 region file containing circles
-    """
-
-    circles = []
-
-    f = open(region_file,'r')
-    line = f.readline()
-    while line:
-        if line[0:6] == 'circle':
-            line = line.replace(' ','')
-            line = line.rstrip('\n').replace('(',' ').replace(')',' ')
-            ra,dec,radius = line.split()[1].split(',')
-            if ':' in  ra:
-                ra = hms2deg(ra)
-            else:
-                ra = float(ra)
-            if ':' in dec:
-                dec = dms2deg(dec)
-            else:
-                dec = float(dec)
-            radius = radius2deg(radius)
-            circles.append((ra,dec,radius))
-        line = f.readline()
-    f.close()
-
-    return circles
-
-
-def get_image(fits_file):
-
-    """
-    Get the image data from a FITS file
-    """
-
-    input_hdu = fits.open(fits_file)[0]
-    if len(input_hdu.data.shape) == 2:
-        image = numpy.array(input_hdu.data[:,:])
-    elif len(input_hdu.data.shape) == 3:
-        image = numpy.array(input_hdu.data[0,:,:])
-    else:
-        image = numpy.array(input_hdu.data[0,0,:,:])
-
-    return image
-
-
-def flush_fits(image,fits_file):
+def fmt(xx):
+    return str(round(xx,5))
 
-    """
-    Write 2D numpy array image to fits_file
-    """
 
-    f = fits.open(fits_file,mode='update')
-    input_hdu = f[0]
-    if len(input_hdu.data.shape) == 2:
-        input_hdu.data[:,:] =image
-    elif len(input_hdu.data.shape) == 3:
-        input_hdu.data[0,:,:] = image
-    else:
-        input_hdu.data[0,0,:,:] = image
-    f.flush()
+def spacer():
+    print('--------------|---------------------------------------------')
 
 
-def apply_circle(image,xpix,ypix,rpix):
+def split_model(fits_file,circles,dir1_fits,subtract_fits=''):
 
     """
-    Apply a circle with values of 1, of radius rpix to xpix,ypix in image array
+    Write the parts of model image fits_file inside and (optionally)
+    outside the region to new images
     """
 
-    xg,yg = numpy.mgrid[int(xpix-rpix):int(xpix+rpix)+1,int(ypix-rpix):int(ypix+rpix)+1]
-    xg = xg.ravel()
-    yg = yg.ravel()
+    img = get_image(fits_file)
+    mask = region_mask(get_header(fits_file),circles)
 
-    for i,j in zip(xg,yg):
-        sep = ((i-xpix)**2.0 + (j-ypix)**2.0)**0.5
-        if sep < rpix:
-            image[j,i] = 1.0
+    print('Writing       : '+dir1_fits)
+    create_fits(fits_file,dir1_fits)
+    flush_fits(img*mask,dir1_fits)
 
-    return image
+    if subtract_fits != '':
+        print('Writing       : '+subtract_fits)
+        create_fits(fits_file,subtract_fits)
+        flush_fits(img*(~mask),subtract_fits)
 
-
-def fmt(xx):
-    return str(round(xx,5))
-
-
-def spacer():
-    print('--------------|---------------------------------------------')
+    return fits_file
 
 
 # ---------------------------------------------------------------------------------------
@@ -167,10 +54,12 @@ def main():
     parser.add_option('--region', dest = 'region_file', help = 'DS9 region file')
     parser.add_option('--prefix', dest = 'model_pattern', help = 'wsclean image prefix')
     parser.add_option('--subtract', dest = 'subtract', help = 'Produce model image with components within region subtracted (default = False)', action = 'store_true', default = False)
+    parser.add_option('--ncpu', dest = 'ncpu', help = 'Number of model images to process in parallel (default = 8)', default = 8)
     (options,args) = parser.parse_args()
     region_file = options.region_file
     model_pattern = options.model_pattern
     subtract = options.subtract
+    ncpu = int(options.ncpu)
 
     circles = process_region_file(region_file)
     suffix = region_file.split('/')[-1].split('.')[0]
@@ -183,51 +72,36 @@ def main():
 
     model_list = sorted(glob.glob(model_pattern+'-0*model*fits'))
 
-    for fits_file in model_list:
-
-        print('Reading       : '+fits_file)
+    if len(model_list) > 0:
+        pixels = circles_to_pixels(get_header(model_list[0]),circles)
+        for circle,pixel in zip(circles,pixels):
+            print('Masking       : sky '+fmt(circle[0])+' '+fmt(circle[1])+' '+fmt(circle[2]))
+            print('              : pixel '+fmt(pixel[0])+' '+fmt(pixel[1])+' '+fmt(pixel[2]))
+        spacer()
 
+    # Build the mask for each distinct geometry here, so that forked
+    # workers inherit it rather than rebuilding it per plane
+    jobs = []
+    for fits_file in model_list:
+        region_mask(get_header(fits_file),circles)
         dir1_fits = fits_file.replace(model_pattern,model_pattern+'-'+suffix)
-
         if subtract:
             subtract_fits = fits_file.replace(model_pattern,model_pattern+'-'+suffix+'-subtracted')
+        else:
+            subtract_fits = ''
+        jobs.append((fits_file,circles,dir1_fits,subtract_fits))
 
-        img = get_image(fits_file)
-        mask = img*0.0
-
-        hdulist = fits.open(fits_file)
-        w = wcs.WCS(hdulist[0].header)
-        ref_pix1 = hdulist[0].header['CRPIX1']
-        ref_pix2 = hdulist[0].header['CRPIX2']
-        pixscale = hdulist[0].header['CDELT2']
-
-        for circle in circles:
-            ra = circle[0]
-            dec = circle[1]
-            coord = (ra,dec,0,0)
-            pixels = w.wcs_world2pix([coord],0)
-            radius = circle[2]
-            xpix = pixels[0][0]
-            ypix = pixels[0][1]
-            rpix = radius/pixscale
-            print('Masking       : sky '+fmt(ra)+' '+fmt(dec)+' '+fmt(radius))
-            print('              : pixel '+fmt(xpix)+' '+fmt(ypix)+' '+fmt(rpix))
-            mask = apply_circle(mask,xpix,ypix,rpix)
-
-        dir1 = img*mask
-
-        print('Writing       : '+dir1_fits)
-        shutil.copyfile(fits_file,dir1_fits)
-        flush_fits(dir1,dir1_fits)
-
-        if subtract:
-            subt = img*(1.0-mask)
-            print('Writing       : '+subtract_fits)
-            shutil.copyfile(fits_file,subtract_fits)
-            flush_fits(subt,subtract_fits)
+    print('Splitting     : '+str(len(jobs))+' model images with '+str(ncpu)+' process(es)')
+    spacer()
 
+    if ncpu > 1 and len(jobs) > 1:
+        with Pool(processes=min(ncpu,len(jobs))) as pool:
+            pool.starmap(split_model,jobs)
+    else:
+        for job in jobs:
+            split_model(*job)
 
-        spacer()
+    spacer()
 
 
 if __name__ == '__main__':
@@ -32,10 +32,12 @@ OXKAT = CWD+'/oxkat'
 DATA = CWD+'/data'
 TOOLS = CWD+'/tools'
 
+FLAGSTATS = CWD+'/FLAGSTATS'
 GAINPLOTS = CWD+'/GAINPLOTS'
 GAINTABLES = CWD+'/GAINTABLES'
 IMAGES = CWD+'/IMAGES'
 LOGS = CWD+'/LOGS'
+MARKERS = CWD+'/MARKERS'
 SCRIPTS = CWD+'/SCRIPTS'
 VISPLOTS = CWD+'/VISPLOTS'
 
@@ -74,6 +76,106 @@ TRICOLOUR_PATTERN = 'oxkat-0.41'
 WSCLEAN_PATTERN = 'oxkat-0.41'
 
 
+# ------------------------------------------------------------------------
+#
+# Local execution settings (infrastructure = node)
+#
+
+NODE_PARALLEL = False # Set to True to run independent steps concurrently via oxkat/local_executor.py
+NODE_NCPU = 0         # CPU budget shared by concurrent steps (0 = all CPUs on the node)
+NODE_MEM = 0          # Memory budget in GB shared by concurrent steps (0 = all memory on the node)
+                      # Each step requests the CPUS and MEM of its slurm_config
+
+
+# ------------------------------------------------------------------------
+#
+# Resumable runs and result cache
+#
+
+RESUME = False        # Leave out steps whose completion marker in MARKERS is still valid
+                      # Only steps that declare inputs and outputs, and whose parent steps
+                      # are all left out, are eligible. A step is run again if any file of
+                      # its inputs has changed size or modification time since it completed.
+                      # Delete MARKERS to force a full rerun.
+
+USE_CACHE = False     # Run deterministic image-domain steps through oxkat/result_cache.py
+CACHE = CWD+'/CACHE'  # Cache folder, must be on the same filesystem as IMAGES for hard links
+CACHE_QUOTA = 100     # Maximum size of the result cache in GB
+
+
+# ------------------------------------------------------------------------
+#
+# Automatic resource sizing (see oxkat/resources.py)
+#
+
+AUTO_RESOURCES = False          # Size the CPUs, memory and wall time of the imaging, calibration and
+                                # flagging steps from the MS and image dimensions, starting from the
+                                # SLURM_* and PBS_* settings below. CPUs are only ever reduced (and the
+                                # software is told to use that many threads), while memory and wall
+                                # time can be raised up to the limits below.
+AUTO_RESOURCES_HEADROOM = 1.5   # Safety factor applied to the predicted memory and wall time
+AUTO_RESOURCES_MAX_MEM = 480    # Largest memory request in GB that sizing can raise a step to
+AUTO_RESOURCES_MAX_HOURS = 72   # Longest wall time in hours that sizing can raise a step to
+
+
+# ------------------------------------------------------------------------
+#
+# Telemetry
+#
+
+TELEMETRY = False     # Record wall time, CPU use, peak memory and I/O of every step in LOGS/telemetry
+                      # via oxkat/step_telemetry.py, summarise with tools/job_report.py
+
+
+# ------------------------------------------------------------------------
+#
+# Job arrays (infrastructure = idia, hippo or chpc)
+#
+
+JOB_ARRAYS = False    # Submit each step of a per-target recipe as one job array (Slurm --array,
+                      # PBS -J) with a task per target, if all targets have the same chain of steps
+JOB_ARRAY_MAX = 0     # Maximum number of tasks of an array that run at once (0 = no limit, Slurm only)
+
+
+# ------------------------------------------------------------------------
+#
+# Job packing (infrastructure = idia, hippo or chpc)
+#
+
+PACK_JOBS = False     # Run short steps (step['pack'] = True) that follow on from the same jobs as a
+                      # single scheduler job via oxkat/local_executor.py, one queue wait per group
+PACK_MAX_STEPS = 6    # Maximum number of steps in a packed job
+PACK_STEP_HOURS = 1   # Wall time in hours allowed per packed step with no telemetry record (TELEMETRY)
+                      # or sized wall time (AUTO_RESOURCES) to go on
+PACK_MAX_HOURS = 6    # Longest wall time in hours requested for a packed job
+
+
+# ------------------------------------------------------------------------
+#
+# Container warm start (see oxkat/container_stage.py)
+#
+
+STAGE_CONTAINERS = False      # Copy each container image to node-local scratch, once per node,
+                              # and run the steps from the copy
+CONTAINER_SCRATCH = '/tmp'    # Node-local folder for the staged images
+CONTAINER_INSTANCES = False   # Run the steps of a packed job in one long-lived singularity
+                              # instance per image (singularity instance start)
+
+
+# ------------------------------------------------------------------------
+#
+# Node-local MS staging (see oxkat/ms_stage.py)
+#
+
+MS_STAGING = False            # Run I/O-bound steps against copies of their MSs on node-local scratch,
+                              # syncing back only the table files that the step changed
+MS_SCRATCH = '/tmp'           # Node-local folder (e.g. NVMe) for the copies
+MS_STAGE_POLICY = 'io_heavy'  # Steps to stage: 'io_heavy', 'all' or 'none' (see ms_stage_policies in
+                              # oxkat/generate_jobs.py), step['stage_ms'] = True / False overrides it
+MS_STAGE_PROGRAMS = ['wsclean','gocubical','tricolour','copy_MS_column.py','sum_MS_columns.py']
+MS_STAGE_MIN_GB = 10          # Smallest MS (GB on disk) staged by the io_heavy policy
+
+
 # ------------------------------------------------------------------------
 #
 # Slurm resource settings
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import fcntl
+import hashlib
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from optparse import OptionParser
+
+
+# ------------------------------------------------------------------------
+#
+# Container pre-staging and warm start
+#
+#   stage    : copy a container image to node-local scratch and print the
+#              path to run it from. The first job on a node to ask for an
+#              image copies it while holding a lock, jobs that arrive in
+#              the meantime wait for the copy, and later jobs find it in
+#              place, so each image is copied once per node. The original
+#              path is printed if the copy cannot be made, so staging
+#              never fails a step.
+#
+#   instance : start a singularity instance of each image (staged first
+#              if a scratch folder is given), run a command whose steps
+#              address the instances as instance://name, and stop the
+#              instances however the command ends. A run of short steps
+#              then pays for one container start rather than one each.
+#
+# This module only uses the standard library, as it runs outside the
+# containers.
+#
+
+
+def msg(txt):
+    # stdout carries the staged path, so messages go to stderr
+    stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+    sys.stderr.write(stamp+txt+'\n')
+    sys.stderr.flush()
+
+
+def staged_path(image,scratch):
+    # Images with the same name in different folders get different copies
+    tag = hashlib.sha1(os.path.abspath(image).encode()).hexdigest()[0:8]
+    return os.path.join(scratch,'oxkat_containers',tag+'_'+os.path.basename(image))
+
+
+def is_current(image,staged):
+    if not os.path.isfile(staged):
+        return False
+    st0 = os.stat(image)
+    st1 = os.stat(staged)
+    return st0.st_size == st1.st_size and int(st0.st_mtime) == int(st1.st_mtime)
+
+
+def stage(image,scratch):
+
+    """ Copy image to scratch once per node, returns the path to use """
+
+    staged = staged_path(image,scratch)
+    try:
+        if is_current(image,staged):
+            return staged
+        stagedir = os.path.dirname(staged)
+        os.makedirs(stagedir,exist_ok=True)
+        lock = open(staged+'.lock','w')
+        fcntl.flock(lock,fcntl.LOCK_EX)
+        try:
+            if not is_current(image,staged):
+                size = os.path.getsize(image)
+                if shutil.disk_usage(stagedir).free < 1.1*size:
+                    msg('Not enough space in '+stagedir+' to stage '+image)
+                    return image
+                t0 = time.time()
+                tmp_file = staged+'.'+str(os.getpid())+'.tmp'
+                shutil.copy2(image,tmp_file)
+                os.replace(tmp_file,staged)
+                msg('Staged '+image+' to '+staged+' in '+str(round(time.time()-t0,1))+' s')
+        finally:
+            fcntl.flock(lock,fcntl.LOCK_UN)
+            lock.close()
+        return staged
+    except (IOError,OSError) as err:
+        msg('Could not stage '+image+', running it in place: '+str(err))
+        return image
+
+
+def run_in_instances(command,images,names,scratch=''):
+
+    """ Run command with a singularity instance of each image started
+    under the matching name, returns the exit code of the command
+    """
+
+    started = []
+    try:
+        for image,name in zip(images,names):
+            if scratch != '':
+                image = stage(image,scratch)
+            if subprocess.call(['singularity','instance','start',image,name]) != 0:
+                msg('Could not start instance '+name+' of '+image)
+                return 1
+            started.append(name)
+        # The command runs in its own session, and a SIGTERM to this
+        # process (e.g. a cancelled job) is passed on to its process group,
+        # so that the instances are only stopped once the command has exited
+        proc = subprocess.Popen(command,shell=True,executable='/bin/bash',start_new_session=True)
+        def stop(signum,frame):
+            try:
+                os.killpg(proc.pid,signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        signal.signal(signal.SIGTERM,stop)
+        return proc.wait()
+    finally:
+        for name in started:
+            subprocess.call(['singularity','instance','stop',name])
+
+
+def main():
+
+    parser = OptionParser(usage = '%prog stage [options] image\n       %prog instance [options] command')
+    parser.add_option('--scratch', dest = 'scratch', help = 'Node-local folder to stage images to', default = '')
+    parser.add_option('--images', dest = 'images', help = 'Comma-separated list of images to start instances of', default = '')
+    parser.add_option('--names', dest = 'names', help = 'Comma-separated list of instance names, one per image', default = '')
+    (options,args) = parser.parse_args()
+
+    if len(args) != 2 or args[0] not in ['stage','instance']:
+        parser.print_help()
+        sys.exit(1)
+
+    if args[0] == 'stage':
+        if options.scratch == '':
+            print(args[1])
+        else:
+            print(stage(args[1],options.scratch))
+    else:
+        images = [x for x in options.images.split(',') if x != '']
+        names = [x for x in options.names.split(',') if x != '']
+        if len(images) != len(names):
+            parser.print_help()
+            sys.exit(1)
+        # Stop the instances if the job is cancelled
+        signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(1))
+        sys.exit(run_in_instances(args[1],images,names,options.scratch))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import numpy
+import shutil
+from astropy.io import fits
+
+
+# ------------------------------------------------------------------------
+#
+# Shared FITS I/O for the tools and scripts
+#
+# Images are read as memory-mapped views rather than copied into memory,
+# and results are written in place into a single plane of an existing
+# file. Use create_fits to make a new output with the header of an
+# existing image, which only copies its data for multi-plane images.
+#
+
+
+def plane_index(ndim,plane=0,axis=3):
+
+    """ Returns the index that selects a single 2D plane from an
+    ndim data array, with the image plane taken along FITS axis
+    number axis and all other degenerate axes set to zero
+    """
+
+    idx = [0]*(ndim-2)
+    ax = ndim-int(axis)
+    if 0 <= ax < ndim-2:
+        idx[ax] = plane
+    return tuple(idx)+(slice(None),slice(None))
+
+
+def get_header(fitsfile):
+
+    """ Returns the primary header of fitsfile """
+
+    return fits.getheader(fitsfile)
+
+
+def get_nplanes(fitsfile,axis=3):
+
+    """ Returns the number of planes along FITS axis number axis """
+
+    hdr = get_header(fitsfile)
+    if int(axis) <= hdr.get('NAXIS'):
+        nplanes = hdr.get('NAXIS'+str(axis))
+    else:
+        nplanes = 1
+    return nplanes
+
+
+def get_data(fitsfile,mode='readonly'):
+
+    """ Returns the full memory-mapped data array of fitsfile.
+    In readonly mode the map is copy-on-write, so changes made to
+    the array by the caller never reach the file.
+    """
+
+    with fits.open(fitsfile,mode=mode,memmap=True) as hdul:
+        data = hdul[0].data
+    # The map stays open for as long as the array is referenced
+    return data
+
+
+def get_image(fitsfile,plane=0,axis=3):
+
+    """ Returns a memory-mapped (copy-on-write) 2D view of a single
+    plane of fitsfile
+    """
+
+    data = get_data(fitsfile)
+    return data[plane_index(data.ndim,plane,axis)]
+
+
+def flush_fits(newimage,fitsfile,plane=0,axis=3):
+
+    """ Writes 2D array newimage in place into a single plane of fitsfile """
+
+    with fits.open(fitsfile,mode='update',memmap=True) as hdul:
+        data = hdul[0].data
+        data[plane_index(data.ndim,plane,axis)] = newimage
+
+
+def create_fits(template_fits,fitsfile,bitpix=None,copy=True):
+
+    """ Creates fitsfile with the primary header of template_fits. If
+    template_fits has more than one plane and copy is True it is copied,
+    so that planes the caller does not write keep the template data, as
+    with shutil.copyfile. Otherwise the data block is zero-filled by
+    extending the file, without reading any data, which is sparse on
+    filesystems that support it. A new bitpix always gives a zero-filled
+    data block.
+    """
+
+    hdr = get_header(template_fits).copy()
+    shape = [hdr['NAXIS'+str(i)] for i in range(1,hdr['NAXIS']+1)]
+    nplanes = int(numpy.prod(shape[2:]))
+    if copy and nplanes > 1 and (bitpix is None or int(bitpix) == hdr['BITPIX']):
+        shutil.copyfile(template_fits,fitsfile)
+        return
+
+    if bitpix is not None:
+        hdr['BITPIX'] = int(bitpix)
+    if hdr['BITPIX'] < 0:
+        for key in ['BSCALE','BZERO','BLANK']:
+            if key in hdr:
+                del hdr[key]
+
+    nbytes = int(numpy.prod(shape))*abs(hdr['BITPIX'])//8
+    nbytes = int(numpy.ceil(nbytes/2880.0))*2880
+
+    header_str = hdr.tostring()
+    with open(fitsfile,'wb') as f:
+        f.write(header_str.encode('ascii'))
+        if nbytes > 0:
+            f.seek(len(header_str)+nbytes-1)
+            f.write(b'\0')
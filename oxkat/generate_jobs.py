@@ -4,12 +4,19 @@
 
 import glob
 import datetime
+import fnmatch
+import json
+import math
 import time
 import os
 import os.path as o
+import re
+import shlex
 import sys
 sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
 from oxkat import config as cfg
+from oxkat import resources
+from oxkat import step_marker
 
 
 # ------------------------------------------------------------------------
@@ -200,7 +207,11 @@ def job_handler(syscall,
                 slurm_nodelist = cfg.SLURM_NODELIST,
                 slurm_exclude = cfg.SLURM_EXCLUDE,
                 pbs_config = cfg.PBS_DEFAULTS,
-                bind = cfg.BIND):
+                bind = cfg.BIND,
+                cache = None,
+                telemetry = None,
+                marker = '',
+                array = None):
                 # slurm_time=cfg.SLURM_TIME,
                 # slurm_partition=cfg.SLURM_PARTITION,
                 # slurm_ntasks=cfg.SLURM_NTASKS,
@@ -215,6 +226,23 @@ def job_handler(syscall,
                 # pbs_mem=cfg.PBS_MEM):
 
 
+    # cache is an (inputs, outputs) tuple for steps that are run through
+    # the result cache, telemetry is a dict of the step details for
+    # oxkat/step_telemetry.py, and marker is the command that records the
+    # step's completion marker, run only if the step succeeds
+    syscall = wrap_syscall(syscall,cache,telemetry)
+    if marker != '' and infrastructure != 'node':
+        syscall += ' && '+marker
+
+    # array is a list of (step ID, syscall) tuples, one per target, to be
+    # submitted as a single job array in which each task runs the syscall
+    # selected by its array index. Dependencies between arrays are per
+    # task where the scheduler supports it (Slurm aftercorr).
+    if array is not None:
+        dependency_type = 'aftercorr:'
+    else:
+        dependency_type = 'afterok:'
+
     if infrastructure == 'idia' or infrastructure == 'hippo':
 
 
@@ -239,10 +267,22 @@ def job_handler(syscall,
         slurm_runfile = cfg.SCRIPTS+'/slurm_'+jobname+'.sh'
         slurm_logfile = cfg.LOGS+'/slurm_'+jobname+'.log'
 
+        if array is not None:
+            slurm_logfile = cfg.LOGS+'/slurm_'+jobname+'_%a.log'
+            slurm_array = '#SBATCH --array=0-'+str(len(array)-1)
+            if cfg.JOB_ARRAY_MAX > 0:
+                slurm_array += '%'+str(cfg.JOB_ARRAY_MAX)
+            slurm_array += '\n'
+            body = array_case(array,'$SLURM_ARRAY_TASK_ID')
+        else:
+            slurm_array = ''
+            body = [syscall+'\n',
+                'echo "****ELAPSED "$SECONDS" '+jobname+'"\n']
+
         run_command = jobname+"=`sbatch "
         if dependency:
             #run_command += "-d afterok:${"+dependency+"} "
-            run_command += '-d afterok:'+'${'+dependency.replace(':','}:${')+'} '
+            run_command += '-d '+dependency_type+'${'+dependency.replace(':','}:${')+'} '
         run_command += slurm_runfile+" | awk '{print $4}'`"
 
         if cfg.SLURM_NODELIST != '':
@@ -280,9 +320,8 @@ def job_handler(syscall,
             slurm_exclude,
             slurm_account,
             slurm_reservation,
-            'SECONDS=0\n',
-            syscall+'\n',
-            'echo "****ELAPSED "$SECONDS" '+jobname+'"\n'])
+            slurm_array,
+            'SECONDS=0\n']+body)
 #            'sleep 10\n'])
         f.close()
 
@@ -301,9 +340,20 @@ def job_handler(syscall,
         pbs_logfile = cfg.LOGS+'/pbs_'+jobname+'.log'
         pbs_errfile = cfg.LOGS+'/pbs_'+jobname+'.err'
 
+        # PBS dependencies on an array wait for the whole array
+        if array is not None:
+            pbs_logfile = cfg.LOGS+'/pbs_'+jobname+'_^array_index^.log'
+            pbs_errfile = cfg.LOGS+'/pbs_'+jobname+'_^array_index^.err'
+            pbs_array = '#PBS -J 0-'+str(len(array)-1)+'\n'
+            body = array_case(array,'$PBS_ARRAY_INDEX')
+        else:
+            pbs_array = ''
+            body = [syscall+'\n',
+                'echo "****ELAPSED "$SECONDS" "'+jobname+'"\n']
+
         run_command = jobname+"=`qsub "
         if dependency:
-          run_command += "-W depend=afterok:${"+dependency+"} "
+          run_command += '-W depend=afterok:'+'${'+dependency.replace(':','}:${')+'} '
         run_command += pbs_runfile+" | awk '{print $1}'`"
 
         f = open(pbs_runfile,'w')
@@ -314,12 +364,11 @@ def job_handler(syscall,
             '#PBS -l nodes='+pbs_nodes+':ppn='+pbs_ppn+',mem='+pbs_mem+'\n',
             '#PBS -q '+pbs_queue+'\n'
             '#PBS -o '+pbs_logfile+'\n'
-            '#PBS -e '+pbs_errfile+'\n'
+            '#PBS -e '+pbs_errfile+'\n',
+            pbs_array,
             'SECONDS=0\n'
             'module load chpc/singularity\n'
-            'cd '+cfg.CWD+'\n',
-            syscall+'\n',
-            'echo "****ELAPSED "$SECONDS" "'+jobname+'"\n',
+            'cd '+cfg.CWD+'\n']+body+[
             'sleep 10\n'])
         f.close()
 
@@ -329,6 +378,8 @@ def job_handler(syscall,
 
         node_logfile = cfg.LOGS+'/oxk_'+jobname+'.log'
         run_command = syscall+' | tee '+node_logfile
+        if marker != '':
+            run_command += '\nif [ ${PIPESTATUS[0]} -eq 0 ]; then '+marker+'; fi'
         
 
     run_command += '\n'
@@ -336,9 +387,855 @@ def job_handler(syscall,
     return run_command
 
 
-def mem_string_to_gb(mem):
-    headroom = 0.98 # fraction of memory specified in IDIA/CHPC config to convert to absmem (hippo a special case)
+def array_case(array,index_var):
+
+    # Body of a job array script, running one (step ID, syscall) per task
+
+    lines = ['case '+index_var+' in\n']
+    for i in range(0,len(array)):
+        step_id,syscall = array[i]
+        lines.append(str(i)+')\n')
+        lines.append('    '+syscall+'\n')
+        lines.append('    echo "****ELAPSED "$SECONDS" '+step_id+'"\n')
+        lines.append('    ;;\n')
+    lines.append('esac\n')
+    return lines
+
+
+def get_dependencies(step):
+
+    # A step's dependency is None, the index of a single parent step,
+    # or a list of parent indices
+
+    dependency = step['dependency']
+    if dependency is None:
+        return []
+    elif isinstance(dependency,(list,tuple)):
+        return list(dependency)
+    else:
+        return [dependency]
+
+
+def toposort_steps(steps):
+
+    # Order the steps so that every step follows all of its parents
+    # (Kahn's algorithm, ties broken by position in the recipe)
+
+    nsteps = len(steps)
+    children = [[] for i in range(0,nsteps)]
+    indegree = [0]*nsteps
+    for i in range(0,nsteps):
+        for j in get_dependencies(steps[i]):
+            if j < 0 or j >= nsteps or j == i:
+                print(col()+'Step '+steps[i]['id']+' has an invalid dependency: '+str(j))
+                print_spacer()
+                sys.exit()
+            children[j].append(i)
+            indegree[i] += 1
+
+    ready = [i for i in range(0,nsteps) if indegree[i] == 0]
+    order = []
+    while len(ready) > 0:
+        ready.sort()
+        i = ready.pop(0)
+        order.append(i)
+        for k in children[i]:
+            indegree[k] -= 1
+            if indegree[k] == 0:
+                ready.append(k)
+
+    if len(order) != nsteps:
+        cycle = [steps[i]['id'] for i in range(0,nsteps) if i not in order]
+        print(col()+'Circular dependency between steps: '+', '.join(cycle))
+        print_spacer()
+        sys.exit()
+
+    return order
+
+
+def walltime_to_hours(walltime):
+
+    # Convert [D-]HH:MM:SS, HH:MM or MM to hours
+
+    days = 0.0
+    if '-' in walltime:
+        days,walltime = walltime.split('-')
+        days = float(days)
+    parts = [float(x) for x in walltime.split(':')]
+    if len(parts) == 3:
+        hours = parts[0]+(parts[1]/60.0)+(parts[2]/3600.0)
+    elif len(parts) == 2:
+        hours = parts[0]+(parts[1]/60.0)
+    else:
+        hours = parts[0]/60.0
+    return (24.0*days)+hours
+
+
+def step_walltime(step,infrastructure):
+
+    # Requested wall time for a step in hours
+
+    if infrastructure == 'chpc':
+        pbs_config = step.get('pbs_config',cfg.PBS_DEFAULTS)
+        return walltime_to_hours(pbs_config['WALLTIME'])
+    else:
+        slurm_config = step.get('slurm_config',cfg.SLURM_DEFAULTS)
+        return walltime_to_hours(slurm_config['TIME'])
+
+
+def critical_path(steps,infrastructure):
+
+    # Longest chain of dependent steps, weighted by requested wall time
+    # Returns the list of step IDs on the path and its length in hours
+
+    finish = {}
+    parent = {}
+    for i in toposort_steps(steps):
+        start = 0.0
+        parent[i] = None
+        for j in get_dependencies(steps[i]):
+            if finish[j] > start:
+                start = finish[j]
+                parent[i] = j
+        finish[i] = start+step_walltime(steps[i],infrastructure)
+
+    if len(finish) == 0:
+        return [],0.0
+
+    i = max(finish,key=finish.get)
+    total = finish[i]
+    path = []
+    while i is not None:
+        path.insert(0,steps[i]['id'])
+        i = parent[i]
+
+    return path,total
+
+
+def paths_overlap(inputs,outputs):
+
+    # True if any input and output are the same path or glob pattern,
+    # or one pattern matches the other
+
+    for inp in inputs:
+        for outp in outputs:
+            inp = inp.rstrip('/')
+            outp = outp.rstrip('/')
+            if inp == outp or fnmatch.fnmatch(inp,outp) or fnmatch.fnmatch(outp,inp):
+                return True
+    return False
+
+
+def cache_syscall(syscall,inputs,outputs):
+
+    # Wrap a deterministic step in oxkat/result_cache.py, so that its
+    # outputs are restored from the cache if the inputs and the command
+    # are unchanged. Steps that modify their inputs in place are not a
+    # function of their inputs, and are returned unwrapped.
+
+    if paths_overlap(inputs,outputs):
+        print(col('Result cache')+'Not caching in-place step writing '+','.join(outputs))
+        return syscall
+
+    wrapped = 'python3 '+cfg.OXKAT+'/result_cache.py '
+    wrapped += '--cachedir '+cfg.CACHE+' '
+    wrapped += '--quota '+str(cfg.CACHE_QUOTA)+' '
+    if len(inputs) > 0:
+        wrapped += '--inputs '+','.join(inputs)+' '
+    wrapped += '--outputs '+','.join(outputs)+' '
+    wrapped += shlex.quote(syscall)
+    return wrapped
+
+
+def telemetry_syscall(syscall,telemetry):
+
+    # Run a step under oxkat/step_telemetry.py to record its wall time,
+    # CPU use, peak memory and I/O in LOGS/telemetry
+
+    wrapped = 'python3 '+cfg.OXKAT+'/step_telemetry.py '
+    wrapped += '--id '+telemetry['id']+' '
+    wrapped += '--recipe '+telemetry['recipe']+' '
+    wrapped += '--outdir '+cfg.LOGS+'/telemetry '
+    wrapped += '--cpus '+str(telemetry['cpus'])+' '
+    wrapped += '--mem '+str(telemetry['mem'])+' '
+    wrapped += '--hours '+str(telemetry['hours'])+' '
+    wrapped += shlex.quote(syscall)
+    return wrapped
+
+
+def get_telemetry(step,recipe,infrastructure):
+
+    # Step details for the telemetry wrapper, including the resources
+    # requested for it, or None if telemetry is switched off
+
+    if not cfg.TELEMETRY:
+        return None
+    if infrastructure == 'chpc':
+        pbs_config = step.get('pbs_config',cfg.PBS_DEFAULTS)
+        cpus = pbs_config['PPN']
+        mem = mem_string_to_gb(pbs_config['MEM'],headroom=1.0)
+    else:
+        slurm_config = step.get('slurm_config',cfg.SLURM_DEFAULTS)
+        cpus = slurm_config['CPUS']
+        mem = mem_string_to_gb(slurm_config['MEM'],headroom=1.0)
+    return {'id':step['id'],
+        'recipe':recipe,
+        'cpus':cpus,
+        'mem':mem,
+        'hours':round(step_walltime(step,infrastructure),2)}
+
+
+def wrap_syscall(syscall,cache=None,telemetry=None):
+
+    # Apply the result cache and telemetry wrappers to a syscall
+
+    if cache is not None:
+        syscall = cache_syscall(syscall,cache[0],cache[1])
+    if telemetry is not None:
+        syscall = telemetry_syscall(syscall,telemetry)
+    return syscall
+
+
+container_pattern = re.compile(r'singularity exec (\S+\.(?:sif|img))')
+
+
+def container_images(syscall):
+
+    # The container images that a syscall runs
+
+    return sorted(set(container_pattern.findall(syscall)))
+
+
+def warm_syscall(syscall,instances={}):
+
+    # Run the containers in a syscall from the singularity instances given
+    # by instances (a dict of image : instance name), or from copies
+    # staged on node-local scratch by oxkat/container_stage.py
+
+    def replace(match):
+        image = match.group(1)
+        if image in instances:
+            return 'singularity exec instance://'+instances[image]
+        if cfg.STAGE_CONTAINERS:
+            return ('singularity exec $(python3 '+cfg.OXKAT+'/container_stage.py stage --scratch '+
+                        cfg.CONTAINER_SCRATCH+' '+image+')')
+        return match.group(0)
+
+    return container_pattern.sub(replace,syscall)
+
+
+def ms_arguments(syscall):
+
+    # The arguments of a syscall that are Measurement Sets on disk
+
+    mslist = []
+    for token in re.split(r'[\s=\'",]+',syscall):
+        token = token.rstrip('/')
+        if token.endswith('.ms') and token not in mslist and o.isfile(o.join(token,'table.dat')):
+            mslist.append(token)
+    return mslist
+
+
+def policy_io_heavy(step,mslist):
+    # Steps that run one of MS_STAGE_PROGRAMS on at least MS_STAGE_MIN_GB
+    if not any(program in step['syscall'] for program in cfg.MS_STAGE_PROGRAMS):
+        return False
+    disk_gb = sum([resources.ms_dimensions(myms)['disk_gb'] for myms in mslist])
+    return disk_gb >= cfg.MS_STAGE_MIN_GB
+
+
+# Policies for which steps run against node-local copies of their MSs,
+# selected by MS_STAGE_POLICY. Each is called with the step and the MSs
+# in its syscall.
+ms_stage_policies = {
+    'io_heavy': policy_io_heavy,
+    'all': lambda step,mslist: True,
+    'none': lambda step,mslist: False,
+}
+
+
+def stage_syscall(step,syscall):
+
+    # Run syscall through oxkat/ms_stage.py if the staging policy (or
+    # step['stage_ms'], which overrides it) selects the step
+
+    if not cfg.MS_STAGING:
+        return syscall
+    mslist = ms_arguments(step['syscall'])
+    if len(mslist) == 0:
+        return syscall
+    stage = step.get('stage_ms')
+    if stage is None:
+        stage = ms_stage_policies[cfg.MS_STAGE_POLICY](step,mslist)
+    if not stage:
+        return syscall
+    return ('python3 '+cfg.OXKAT+'/ms_stage.py --ms '+','.join(mslist)+' --scratch '+cfg.MS_SCRATCH+' '+
+                shlex.quote(syscall))
+
+
+def step_syscall(step,instances={}):
+
+    # The syscall for a step with its containers warm started and its MSs
+    # staged as configured
+
+    return stage_syscall(step,warm_syscall(step['syscall'],instances))
+
+
+def recipe_name(submit_file):
+
+    # e.g. submit_2GC_jobs.sh -> 2GC
+
+    name = submit_file.split('/')[-1].replace('.sh','')
+    if name.startswith('submit_'):
+        name = name[7:]
+    if name.endswith('_jobs'):
+        name = name[:-5]
+    return name
+
+
+def get_cache(step):
+
+    # (inputs, outputs) for a step that asks to be cached, otherwise None
+
+    if cfg.USE_CACHE and step.get('cache',False) and len(step.get('outputs',[])) > 0:
+        return (step.get('inputs',[]),step['outputs'])
+    return None
+
+
+def marker_command(step):
+
+    # Write the marker spec for a step and return the command that
+    # records its completion, or '' if RESUME is off
+
+    if not cfg.RESUME:
+        return ''
+    spec_file = step_marker.write_spec(cfg.MARKERS,step['id'],step['syscall'],
+                inputs = step.get('inputs',[]),
+                outputs = step.get('outputs',[]),
+                columns = step.get('marker_columns'))
+    return 'python3 '+cfg.OXKAT+'/step_marker.py record '+spec_file
+
+
+def full_syscall(step,recipe,infrastructure,instances={}):
+
+    # The syscall for a step, with its containers warm started and its MSs
+    # staged, run through the result cache and telemetry wrappers as
+    # requested and followed by the recording of its completion marker
+    # if RESUME is on
+
+    if 'members' in step:
+        # A packed step, whose members are already wrapped
+        return step['syscall']
+    syscall = step_syscall(step,instances)
+    syscall = wrap_syscall(syscall,get_cache(step),get_telemetry(step,recipe,infrastructure))
+    marker = marker_command(step)
+    if marker != '':
+        syscall += ' && '+marker
+    return syscall
+
+
+def set_marker_columns(steps):
+
+    # The MS columns that the marker of each step fingerprints: those it
+    # reads (step['input_columns']) less those written by the steps
+    # downstream of it (step['output_columns']), as the recipe's own later
+    # changes to an MS do not make a step that has already read it stale.
+    # Steps that do not declare input_columns fingerprint the whole MS.
+
+    children = [[] for i in range(0,len(steps))]
+    for i in range(0,len(steps)):
+        for j in get_dependencies(steps[i]):
+            children[j].append(i)
+
+    for i in range(0,len(steps)):
+        if 'input_columns' not in steps[i]:
+            continue
+        written = []
+        downstream = list(children[i])
+        seen = []
+        while len(downstream) > 0:
+            k = downstream.pop()
+            if k in seen:
+                continue
+            seen.append(k)
+            written.extend(steps[k].get('output_columns',[]))
+            downstream.extend(children[k])
+        steps[i]['marker_columns'] = [col for col in steps[i]['input_columns'] if col not in written]
+
+
+def prune_completed_steps(steps):
+
+    # Leave out the steps whose completion marker is still valid, as long
+    # as all of their parents are left out too, so that anything downstream
+    # of a step that runs again also runs again. Returns the remaining
+    # steps with their dependencies renumbered, and the IDs left out.
+
+    complete = {}
+    for i in toposort_steps(steps):
+        step = steps[i]
+        complete[i] = (all(complete[j] for j in get_dependencies(step)) and
+                    step_marker.is_complete(cfg.MARKERS,step['id'],step['syscall'],
+                    step.get('inputs',[]),step.get('outputs',[]),step.get('marker_columns')))
+
+    new_index = {}
+    remaining = []
+    for i in range(0,len(steps)):
+        if not complete[i]:
+            new_index[i] = len(remaining)
+            remaining.append(dict(steps[i]))
+
+    for step in remaining:
+        parents = [new_index[j] for j in get_dependencies(step) if j in new_index]
+        if len(parents) == 0:
+            step['dependency'] = None
+        elif len(parents) == 1:
+            step['dependency'] = parents[0]
+        else:
+            step['dependency'] = parents
+
+    done_ids = [steps[i]['id'] for i in range(0,len(steps)) if complete[i]]
+
+    return remaining,done_ids
+
+
+def resume_target_steps(target_steps):
+
+    # Apply prune_completed_steps to every block of a recipe, dropping
+    # blocks that are already complete
+
+    remaining = []
+    for steps,kill_file,targetname in target_steps:
+        steps,done_ids = prune_completed_steps(steps)
+        if len(done_ids) > 0:
+            if targetname != '':
+                print(col('Already complete')+targetname+': '+', '.join(done_ids))
+            else:
+                print(col('Already complete')+', '.join(done_ids))
+        if len(steps) > 0:
+            remaining.append((steps,kill_file,targetname))
+    return remaining
+
+
+def array_names(target_steps):
+
+    # Names for the job arrays of a recipe whose targets all have the same
+    # chain of steps (same step types, dependencies and resources), or
+    # None if the targets cannot be collapsed into arrays. The name of
+    # each array is the step ID without the target code.
+
+    if len(target_steps) < 2:
+        return None
+    reference = target_steps[0][0]
+    names = [step['id'][0:5] for step in reference]
+    if len(set(names)) != len(names):
+        return None
+    for steps,kill_file,targetname in target_steps:
+        if len(steps) != len(reference):
+            return None
+        for step,ref in zip(steps,reference):
+            if (step['id'][0:5] != ref['id'][0:5] or
+                        get_dependencies(step) != get_dependencies(ref) or
+                        step.get('slurm_config') != ref.get('slurm_config') or
+                        step.get('pbs_config') != ref.get('pbs_config')):
+                return None
+    return names
+
+
+def write_array_jobs(f,target_steps,infrastructure,names,recipe):
+
+    # Write one job array per step type, with one task per target, and a
+    # kill file per target that cancels that target's tasks
+
+    reference = target_steps[0][0]
+    ntargets = len(target_steps)
+
+    f.write('\n# Job arrays, task index : target\n')
+    for t in range(0,ntargets):
+        f.write('#   '+str(t)+' : '+target_steps[t][2]+'\n')
+
+    for i in toposort_steps(reference):
+
+        step = reference[i]
+        parents = get_dependencies(step)
+        if len(parents) > 0:
+            dependency = ':'.join([names[j] for j in parents])
+        else:
+            dependency = None
+
+        array = [(steps[i]['id'],full_syscall(steps[i],recipe,infrastructure)) for steps,kill_file,targetname in target_steps]
+
+        run_command = job_handler(syscall = '',
+                        jobname = names[i],
+                        infrastructure = infrastructure,
+                        dependency = dependency,
+                        slurm_config = step.get('slurm_config',cfg.SLURM_DEFAULTS),
+                        pbs_config = step.get('pbs_config',cfg.PBS_DEFAULTS),
+                        array = array)
+
+        f.write('\n# '+names[i]+' for '+str(ntargets)+' targets, e.g. '+step['comment']+'\n')
+        f.write(run_command)
+
+    for t in range(0,ntargets):
+        steps,kill_file,targetname = target_steps[t]
+        f.write('\n# Generate kill script for '+targetname+'\n')
+        if infrastructure == 'idia' or infrastructure == 'hippo':
+            kill = 'echo "scancel '+' '.join(['${'+name+'}_'+str(t) for name in names])+'" > '+kill_file+'\n'
+        else:
+            kill = 'echo "qdel '+' '.join(['${'+name+'/\\[\\]/['+str(t)+']}' for name in names])+'" > '+kill_file+'\n'
+        f.write(kill)
+
+    path,total = critical_path(reference,infrastructure)
+    if len(path) > 0:
+        id_names = dict([(reference[k]['id'],names[k]) for k in range(0,len(reference))])
+        print(col('Critical path')+' > '.join([id_names[x] for x in path]))
+        print(col()+str(round(total,1))+' hours of requested wall time over '+str(len(reference))+' job arrays of '+str(ntargets)+' tasks')
+
+
+def step_cpus_mem(step,infrastructure):
+
+    # Requested CPUs and memory in GB for a step
+
+    if infrastructure == 'chpc':
+        pbs_config = step.get('pbs_config',cfg.PBS_DEFAULTS)
+        return int(pbs_config['PPN']),mem_string_to_gb(pbs_config['MEM'],headroom=1.0)
+    else:
+        slurm_config = step.get('slurm_config',cfg.SLURM_DEFAULTS)
+        return int(slurm_config['CPUS']),mem_string_to_gb(slurm_config['MEM'],headroom=1.0)
+
+
+def dag_step(step,steps,recipe,infrastructure,members=None,instances={}):
+
+    # Entry for a step in a DAG file for oxkat/local_executor.py, where
+    # members (step indices) restricts the dependencies to part of steps
+
+    parents = get_dependencies(step)
+    if members is not None:
+        parents = [j for j in parents if j in members]
+    cpus,mem = step_cpus_mem(step,infrastructure)
+    return {'id':step['id'],
+        'comment':step['comment'],
+        'syscall':full_syscall(step,recipe,infrastructure,instances),
+        'dependencies':[steps[j]['id'] for j in parents],
+        'cpus':cpus,
+        'mem':mem,
+        'logfile':cfg.LOGS+'/oxk_'+step['id']+'.log'}
+
+
+def pack_groups(steps):
+
+    # Group the packable steps of a block (step['pack'] = True) that can
+    # share a scheduler job. In topological order, a step joins an
+    # existing group if it depends on a member of the group or has the
+    # same parents as the group, and all of its parents are either members
+    # or parents of the group. The parents of a group are therefore those
+    # of its first member, which all precede the group, so a packed job
+    # can never depend on itself. Returns a list of lists of step indices.
+
+    groups = []
+    for i in toposort_steps(steps):
+        if not steps[i].get('pack',False):
+            continue
+        parents = set(get_dependencies(steps[i]))
+        target = None
+        for group in groups:
+            members = set(group['members'])
+            if len(members) >= cfg.PACK_MAX_STEPS:
+                continue
+            if parents <= (members | group['parents']) and (len(parents & members) > 0 or parents == group['parents']):
+                target = group
+                break
+        if target is None:
+            groups.append({'members':[i],'parents':parents})
+        else:
+            target['members'].append(i)
+    return [group['members'] for group in groups]
+
+
+def member_hours(step,recipe,infrastructure):
+
+    # Wall time in hours to allow a member of a packed job: the latest
+    # successful telemetry run of the step with AUTO_RESOURCES_HEADROOM,
+    # the sized wall time if AUTO_RESOURCES has set one, otherwise
+    # PACK_STEP_HOURS. Never more than the step's own wall time request.
+
+    requested = step_walltime(step,infrastructure)
+    latest = None
+    for jsonfile in glob.glob(cfg.LOGS+'/telemetry/'+recipe+'_'+step['id']+'_*.json'):
+        try:
+            f = open(jsonfile)
+            record = json.load(f)
+            f.close()
+        except ValueError:
+            continue
+        if record.get('id') != step['id'] or record.get('returncode',1) != 0:
+            continue
+        if latest is None or record['start'] > latest['start']:
+            latest = record
+    if latest is not None:
+        hours = cfg.AUTO_RESOURCES_HEADROOM*latest['wall_s']/3600.0
+    elif step.get('sized',False):
+        hours = requested
+    else:
+        hours = cfg.PACK_STEP_HOURS
+    return min(hours,requested)
+
+
+def packed_step(steps,members,number,recipe,infrastructure):
+
+    # A step that runs the members (step indices) in one job via
+    # oxkat/local_executor.py. It asks for the largest CPU and memory
+    # request of its members and the sum of their member_hours, up to
+    # PACK_MAX_HOURS, and takes its parents from the members' parents
+    # outside the group. With CONTAINER_INSTANCES the members share one
+    # instance of each image.
+
+    order = [i for i in toposort_steps(steps) if i in members]
+    step_id = 'PACK'+str(number)+steps[order[0]]['id'][5:]
+    dag_file = cfg.SCRIPTS+'/pack_'+step_id+'.json'
+
+    images = []
+    if cfg.CONTAINER_INSTANCES:
+        for i in order:
+            images.extend([x for x in container_images(steps[i]['syscall']) if x not in images])
+    names = ['oxk_'+step_id+'_'+str(k) for k in range(0,len(images))]
+    instances = dict(zip(images,names))
+
+    dag_steps = [dag_step(steps[i],steps,recipe,infrastructure,members,instances) for i in order]
+    ncpu = max([x['cpus'] for x in dag_steps])
+    mem = max([x['mem'] for x in dag_steps])
+    hours = sum([member_hours(steps[i],recipe,infrastructure) for i in order])
+    hours = min(hours,cfg.PACK_MAX_HOURS)
+
+    f = open(dag_file,'w')
+    json.dump({'ncpu':ncpu,'mem':mem,'steps':dag_steps},f,indent=1)
+    f.close()
+
+    largest = max(order,key=lambda i: step_cpus_mem(steps[i],infrastructure)[1])
+    slurm_config = dict(steps[largest].get('slurm_config',cfg.SLURM_DEFAULTS))
+    slurm_config['CPUS'] = str(ncpu)
+    slurm_config['MEM'] = str(int(mem))+'GB'
+    slurm_config['TIME'] = hours_to_walltime(hours)
+    pbs_config = dict(steps[largest].get('pbs_config',cfg.PBS_DEFAULTS))
+    pbs_config['PPN'] = str(ncpu)
+    pbs_config['MEM'] = str(int(mem))+'gb'
+    pbs_config['WALLTIME'] = hours_to_walltime(hours)
+
+    parents = []
+    for i in order:
+        for j in get_dependencies(steps[i]):
+            if j not in members and j not in parents:
+                parents.append(j)
+
+    syscall = 'python3 '+cfg.OXKAT+'/local_executor.py '+dag_file
+    if len(images) > 0:
+        scratch = ''
+        if cfg.STAGE_CONTAINERS:
+            scratch = '--scratch '+cfg.CONTAINER_SCRATCH+' '
+        syscall = ('python3 '+cfg.OXKAT+'/container_stage.py instance '+scratch+'--images '+','.join(images)+
+                    ' --names '+','.join(names)+' '+shlex.quote(syscall))
+
+    return {'step':steps[order[0]]['step'],
+        'comment':'Packed job: '+', '.join([steps[i]['id'] for i in order]),
+        'dependency':parents,
+        'id':step_id,
+        'slurm_config':slurm_config,
+        'pbs_config':pbs_config,
+        'members':[steps[i]['id'] for i in order],
+        'syscall':syscall}
+
+
+def pack_steps(steps,recipe,infrastructure):
+
+    # Replace each group of two or more packable steps with a single packed
+    # step, so that a run of short steps costs one queue wait. Each member
+    # keeps its own log, cache, telemetry and completion marker, members
+    # downstream of a failed member are skipped, and the packed job then
+    # exits with an error so that its dependents do not run. Returns the
+    # new steps with their dependencies renumbered.
+
+    groups = [group for group in pack_groups(steps) if len(group) > 1]
+    if len(groups) == 0:
+        return steps
+
+    group_of = {}
+    for g in range(0,len(groups)):
+        for i in groups[g]:
+            group_of[i] = g
+
+    new_index = {}
+    packed = []
+    for i in range(0,len(steps)):
+        if i in group_of:
+            first = min(groups[group_of[i]])
+            if i != first:
+                new_index[i] = new_index[first]
+                continue
+            new_index[i] = len(packed)
+            packed.append(packed_step(steps,groups[group_of[i]],group_of[i]+1,recipe,infrastructure))
+        else:
+            new_index[i] = len(packed)
+            packed.append(dict(steps[i]))
+
+    for step in packed:
+        parents = []
+        for j in get_dependencies(step):
+            if new_index[j] not in parents:
+                parents.append(new_index[j])
+        if len(parents) == 0:
+            step['dependency'] = None
+        elif len(parents) == 1:
+            step['dependency'] = parents[0]
+        else:
+            step['dependency'] = parents
+
+    for step in packed:
+        if 'members' in step:
+            print(col('Packed job')+step['id']+': '+', '.join(step['members']))
+
+    return packed
+
+
+def write_local_dag(submit_file,target_steps):
+
+    # Write the recipe DAG for oxkat/local_executor.py and a run file that
+    # calls it, so that independent steps run concurrently on this node
+
+    dag_file = cfg.SCRIPTS+'/'+submit_file.split('/')[-1].replace('.sh','.json')
+    recipe = recipe_name(submit_file)
+
+    dag_steps = []
+    for steps,kill_file,targetname in target_steps:
+        for i in toposort_steps(steps):
+            dag_steps.append(dag_step(steps[i],steps,recipe,'node'))
+
+        path,total = critical_path(steps,'node')
+        if len(path) > 0:
+            print(col('Critical path')+' > '.join(path))
+
+    f = open(dag_file,'w')
+    json.dump({'ncpu':cfg.NODE_NCPU,'mem':cfg.NODE_MEM,'steps':dag_steps},f,indent=1)
+    f.close()
+
+    f = open(submit_file,'w')
+    f.write('#!/usr/bin/env bash\n')
+    f.write('export SINGULARITY_BINDPATH='+cfg.BINDPATH+'\n')
+    f.write('\n# Run '+str(len(dag_steps))+' steps concurrently within the node CPU / memory budget\n')
+    f.write('python3 '+cfg.OXKAT+'/local_executor.py '+dag_file+'\n')
+    f.close()
+
+    make_executable(submit_file)
+
+    print(col('Local executor')+dag_file)
+
+
+def write_submit_file(submit_file,target_steps,infrastructure):
+
+    # Write the run file and kill file(s) for a recipe
+    # target_steps is a list of (steps, kill_file, targetname) tuples,
+    # with targetname = '' for recipes that do not loop over targets
+
+    if cfg.RESUME:
+        setup_dir(cfg.MARKERS)
+        for steps,kill_file,targetname in target_steps:
+            set_marker_columns(steps)
+        target_steps = resume_target_steps(target_steps)
+
+    if infrastructure == 'node' and cfg.NODE_PARALLEL:
+        write_local_dag(submit_file,target_steps)
+        return
+
+    if infrastructure != 'node' and cfg.PACK_JOBS:
+        recipe = recipe_name(submit_file)
+        target_steps = [(pack_steps(steps,recipe,infrastructure),kill_file,targetname)
+                    for steps,kill_file,targetname in target_steps]
+
+    f = open(submit_file,'w')
+    f.write('#!/usr/bin/env bash\n')
+    f.write('export SINGULARITY_BINDPATH='+cfg.BINDPATH+'\n')
+
+    if infrastructure != 'node' and cfg.JOB_ARRAYS:
+        names = array_names(target_steps)
+        if names is not None:
+            write_array_jobs(f,target_steps,infrastructure,names,recipe_name(submit_file))
+            f.close()
+            make_executable(submit_file)
+            return
+
+    for steps,kill_file,targetname in target_steps:
+
+        id_list = []
+
+        if targetname != '':
+            f.write('\n#---------------------------------------\n')
+            f.write('# '+targetname)
+            f.write('\n#---------------------------------------\n')
+
+        for i in toposort_steps(steps):
+
+            step = steps[i]
+            step_id = step['id']
+            id_list.append(step_id)
+            parents = get_dependencies(step)
+            if len(parents) > 0:
+                dependency = ':'.join([steps[j]['id'] for j in parents])
+            else:
+                dependency = None
+            if 'slurm_config' in step.keys():
+                slurm_config = step['slurm_config']
+            else:
+                slurm_config = cfg.SLURM_DEFAULTS
+            if 'pbs_config' in step.keys():
+                pbs_config = step['pbs_config']
+            else:
+                pbs_config = cfg.PBS_DEFAULTS
+
+            if 'members' in step:
+                run_command = job_handler(syscall = step['syscall'],
+                                jobname = step_id,
+                                infrastructure = infrastructure,
+                                dependency = dependency,
+                                slurm_config = slurm_config,
+                                pbs_config = pbs_config)
+            else:
+                run_command = job_handler(syscall = step_syscall(step),
+                                jobname = step_id,
+                                infrastructure = infrastructure,
+                                dependency = dependency,
+                                slurm_config = slurm_config,
+                                pbs_config = pbs_config,
+                                cache = get_cache(step),
+                                telemetry = get_telemetry(step,recipe_name(submit_file),infrastructure),
+                                marker = marker_command(step))
+
+            f.write('\n# '+step['comment']+'\n')
+            f.write(run_command)
+
+        if infrastructure != 'node':
+            if targetname != '':
+                f.write('\n# Generate kill script for '+targetname+'\n')
+            else:
+                f.write('\n# Generate kill script\n')
+        if infrastructure == 'idia' or infrastructure == 'hippo':
+            kill = 'echo "scancel "$'+'" "$'.join(id_list)+' > '+kill_file+'\n'
+            f.write(kill)
+        elif infrastructure == 'chpc':
+            kill = 'echo "qdel "$'+'" "$'.join(id_list)+' > '+kill_file+'\n'
+            f.write(kill)
+
+        path,total = critical_path(steps,infrastructure)
+        if len(path) > 0:
+            print(col('Critical path')+' > '.join(path))
+            print(col()+str(round(total,1))+' hours of requested wall time over '+str(len(steps))+' jobs')
+
+    f.close()
+
+    make_executable(submit_file)
+
+
+def mem_string_to_gb(mem,headroom=0.98):
+    # headroom = fraction of memory specified in IDIA/CHPC config to convert to absmem (hippo a special case)
     mem = mem.upper().replace('B','')
+    factor = 1e-3 # Slurm's default unit is MB
     if 'M' in mem:
         factor = 1e-3
     if 'G' in mem:
@@ -350,6 +1247,113 @@ def mem_string_to_gb(mem):
     return absmem
 
 
+def hours_to_walltime(hours):
+    return str(int(math.ceil(hours))).zfill(2)+':00:00'
+
+
+def ms_nchan(myms):
+
+    # Number of channels of myms from its metadata catalogue if there is
+    # one (oxkat/ms_catalogue.py), otherwise from project_info.json, as
+    # the target MSs are split from the working MS that was averaged to
+    # PRE_NCHANS. Returns 0 if neither is available.
+
+    cat_file = o.basename(myms.rstrip('/'))+'.catalogue.json'
+    try:
+        if o.isfile(cat_file):
+            with open(cat_file) as f:
+                return int(json.load(f)['spw']['num_chan'][0])
+        if o.isfile('project_info.json'):
+            with open('project_info.json') as f:
+                project_info = json.load(f)
+            nchan = int(project_info['nchan'])
+            if myms.rstrip('/') == project_info.get('master_ms','').rstrip('/'):
+                return nchan
+            return min(nchan,int(cfg.PRE_NCHANS))
+    except (IOError,OSError,KeyError,IndexError,ValueError):
+        pass
+    return 0
+
+
+def size_config(step_type,vis_gb,cpus,mem,hours,npix,nchanout):
+
+    # Sized (cpus, mem, hours) from the configured values of a step. CPUs
+    # are never raised above the configured value, memory and wall time
+    # can be raised up to AUTO_RESOURCES_MAX_MEM and AUTO_RESOURCES_MAX_HOURS
+    # (or the configured value if that is higher). Also returns the
+    # unrounded predictions.
+
+    return resources.size_resources(step_type,vis_gb,
+                max_cpus = cpus,
+                max_mem = max(mem,cfg.AUTO_RESOURCES_MAX_MEM),
+                max_hours = max(hours,cfg.AUTO_RESOURCES_MAX_HOURS),
+                npix = npix,
+                nchanout = nchanout,
+                headroom = cfg.AUTO_RESOURCES_HEADROOM)
+
+
+def right_size(step,step_type,myms,npix=0,nchanout=1):
+
+    # Replace the slurm_config and pbs_config of a step with requests sized
+    # from the dimensions of myms and the image, starting from the configured
+    # values (see size_config). Call this before absmem_helper so that
+    # -abs-mem follows the sized memory, and pass thread_count() to the
+    # software so that it uses the CPUs it is given. Nothing changes if
+    # myms cannot be read, e.g. if it is made by an earlier step.
+
+    if not cfg.AUTO_RESOURCES:
+        return
+    dims = resources.ms_dimensions(myms,nchan=ms_nchan(myms))
+    if dims['vis_gb'] is None:
+        return
+
+    slurm_config = dict(step.get('slurm_config',cfg.SLURM_DEFAULTS))
+    config_mem = mem_string_to_gb(slurm_config['MEM'],headroom=1.0)
+    config_hours = walltime_to_hours(slurm_config['TIME'])
+    (cpus,mem,hours),predicted = size_config(step_type,dims['vis_gb'],
+                int(slurm_config['CPUS']),config_mem,config_hours,npix,nchanout)
+    slurm_config['CPUS'] = str(cpus)
+    slurm_config['MEM'] = str(mem)+'GB'
+    slurm_config['TIME'] = hours_to_walltime(hours)
+    step['slurm_config'] = slurm_config
+
+    pbs_config = dict(step.get('pbs_config',cfg.PBS_DEFAULTS))
+    (pbs_cpus,pbs_mem,pbs_hours),pbs_predicted = size_config(step_type,dims['vis_gb'],
+                int(pbs_config['PPN']),mem_string_to_gb(pbs_config['MEM'],headroom=1.0),
+                walltime_to_hours(pbs_config['WALLTIME']),npix,nchanout)
+    pbs_config['PPN'] = str(pbs_cpus)
+    pbs_config['MEM'] = str(pbs_mem)+'gb'
+    pbs_config['WALLTIME'] = hours_to_walltime(pbs_hours)
+    step['pbs_config'] = pbs_config
+    step['sized'] = True
+
+    print(col('Resources')+step['id']+': '+str(round(dims['vis_gb'],1))+' GB visibilities per column, '+
+                slurm_config['CPUS']+' CPUs, '+slurm_config['MEM']+', '+slurm_config['TIME'])
+
+    if mem > config_mem:
+        print(col()+'Memory raised above the configured '+str(config_mem)+' GB, check that the partition has nodes this large')
+    if hours > config_hours:
+        print(col()+'Wall time raised above the configured '+str(round(config_hours,1))+' hours')
+    if predicted[0] > mem:
+        print(col()+'Predicted memory of '+str(int(predicted[0]))+' GB exceeds AUTO_RESOURCES_MAX_MEM, consider a high memory config')
+    if predicted[1] > hours:
+        print(col()+'Predicted wall time of '+str(round(predicted[1],1))+' hours exceeds AUTO_RESOURCES_MAX_HOURS')
+
+
+def thread_count(step,infrastructure,default=0):
+
+    # Number of threads for the software run by a step: the CPUs that
+    # right_size gave it, or default if it was not sized
+
+    if not step.get('sized',False):
+        return default
+    ncpu = step_cpus_mem(step,infrastructure)[0]
+    if infrastructure == 'hippo':
+        # job_handler limits hippo jobs to 20 CPUs
+        ncpu = min(ncpu,20)
+    return ncpu
+
+
 def absmem_helper(step,infrastructure,absmem):
     if infrastructure == 'chpc':
         config_mem = step['pbs_config']['MEM']
@@ -402,7 +1406,7 @@ def generate_syscall_casa(casascript,casalogfile='',extra_args=''):
     return syscall
 
 
-def generate_syscall_cubical(parset,myms,extra_args=''):
+def generate_syscall_cubical(parset,myms,extra_args='',ncpu=0):
 
     # now = timenow()
     # outname = 'cube_'+prefix+'_'+myms.split('/')[-1]+'_'+now
@@ -420,6 +1424,8 @@ def generate_syscall_cubical(parset,myms,extra_args=''):
 
     syscall = 'gocubical '+parset+' '
     syscall += '--data-ms='+myms+' '
+    if ncpu > 0:
+        syscall += '--dist-ncpu='+str(ncpu)+' '
     if extra_args != '':
         syscall += extra_args
 #        syscall += '--out-name '+outname+' '
@@ -496,7 +1502,8 @@ def generate_syscall_wsclean(mslist,
                           useidg = cfg.WSC_USEIDG,
                           idgmode = cfg.WSC_IDGMODE,
                           paralleldeconvolution = cfg.WSC_PARALLELDECONVOLUTION,
-                          parallelreordering = cfg.WSC_PARALLELREORDERING):
+                          parallelreordering = cfg.WSC_PARALLELREORDERING,
+                          threads = 0):
 
     # Generate system call to run wsclean
 
@@ -517,6 +1524,8 @@ def generate_syscall_wsclean(mslist,
     # -----------
     syscall = 'wsclean '
     syscall += '-log-time '
+    if threads > 0:
+        syscall += '-j '+str(threads)+' '
     if absmem < 0:
         syscall += '-mem '+str(mem)+' '
     else:
@@ -632,12 +1641,15 @@ def generate_syscall_predict(msname,
 #                            cellsize = cfg.WSC_CELLSIZE,
 #                            predictchannels = cfg.WSC_PREDICTCHANNELS,
                             mem = cfg.WSC_MEM,
-                            absmem = cfg.WSC_ABSMEM):
+                            absmem = cfg.WSC_ABSMEM,
+                            threads = 0):
 
     # Generate system call to run wsclean in predict mode
 
     syscall = 'wsclean '
     syscall += '-log-time '
+    if threads > 0:
+        syscall += '-j '+str(threads)+' '
     syscall += '-predict '
     syscall += '-field '+str(field)+' '
     if usewgridder:
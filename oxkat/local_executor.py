@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import json
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+
+# ------------------------------------------------------------------------
+#
+# Run a recipe DAG written by generate_jobs.write_submit_file on a single
+# machine. Steps whose parents have all succeeded are started as soon as
+# their CPU and memory requests fit within the budget, their output is
+# written to the step log and echoed to the terminal with the step ID as
+# a prefix. Descendants of a failed step are skipped, as with afterok.
+#
+
+
+STOP_TIMEOUT = 30    # Seconds that interrupted steps are given to exit before they are killed
+
+
+def msg(txt):
+    stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+    print(stamp+txt,flush=True)
+
+
+def get_total_memory():
+    # Total physical memory in GB
+    return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')/1e9
+
+
+def kill_group(proc,signum):
+    # Signal the process group of a step started with start_new_session
+    try:
+        os.killpg(proc.pid,signum)
+    except ProcessLookupError:
+        pass
+
+
+def stream_output(proc,step_id,logfile,done_q):
+    # Copy the output of a running step to its log and to stdout
+    f = open(logfile,'w')
+    for line in iter(proc.stdout.readline,b''):
+        line = line.decode(errors='replace')
+        f.write(line)
+        f.flush()
+        sys.stdout.write('['+step_id+'] '+line)
+        sys.stdout.flush()
+    f.close()
+    done_q.put((step_id,proc.wait()))
+
+
+def run_dag(steps,ncpu,mem):
+
+    # steps is a list of dicts with keys id, syscall, dependencies, cpus,
+    # mem (GB), logfile and comment, in topological order
+
+    lookup = {}
+    for step in steps:
+        # A step that asks for more than the budget runs on its own
+        step['cpus'] = min(int(step['cpus']),ncpu)
+        step['mem'] = min(float(step['mem']),mem)
+        lookup[step['id']] = step
+
+    pending = [step['id'] for step in steps]
+    running = {}
+    status = {}
+    free_cpu = ncpu
+    free_mem = mem
+    done_q = queue.Queue()
+
+    def stop(signum,frame):
+        # Each step runs in its own session, so signal its whole process
+        # group rather than just the shell, and kill anything that is
+        # still there after STOP_TIMEOUT
+        msg('Interrupted, terminating running steps')
+        for proc in running.values():
+            kill_group(proc,signal.SIGTERM)
+        deadline = time.time()+STOP_TIMEOUT
+        for proc in running.values():
+            try:
+                proc.wait(timeout=max(deadline-time.time(),0.1))
+            except subprocess.TimeoutExpired:
+                kill_group(proc,signal.SIGKILL)
+        sys.exit(1)
+
+    signal.signal(signal.SIGINT,stop)
+    signal.signal(signal.SIGTERM,stop)
+
+    t0 = time.time()
+
+    while len(pending) > 0 or len(running) > 0:
+
+        for step_id in list(pending):
+            step = lookup[step_id]
+            parents = [status.get(x) for x in step['dependencies']]
+            if 'failed' in parents or 'skipped' in parents:
+                msg('Skipping '+step_id+', a parent step did not succeed')
+                status[step_id] = 'skipped'
+                pending.remove(step_id)
+            elif all(x == 'done' for x in parents):
+                if step['cpus'] <= free_cpu and step['mem'] <= free_mem:
+                    msg('Starting '+step_id+' ('+str(step['cpus'])+' CPU, '+str(step['mem'])+' GB) : '+step['comment'])
+                    proc = subprocess.Popen(step['syscall'],shell=True,start_new_session=True,
+                                stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+                    thread = threading.Thread(target=stream_output,args=(proc,step_id,step['logfile'],done_q))
+                    thread.daemon = True
+                    thread.start()
+                    running[step_id] = proc
+                    step['start'] = time.time()
+                    free_cpu -= step['cpus']
+                    free_mem -= step['mem']
+                    pending.remove(step_id)
+
+        if len(running) == 0:
+            if len(pending) > 0:
+                msg('No runnable steps remain: '+', '.join(pending))
+                for step_id in pending:
+                    status[step_id] = 'skipped'
+                pending = []
+            break
+
+        step_id,returncode = done_q.get()
+        step = lookup[step_id]
+        del running[step_id]
+        free_cpu += step['cpus']
+        free_mem += step['mem']
+        elapsed = str(int(time.time()-step['start']))
+        if returncode == 0:
+            status[step_id] = 'done'
+            msg('Finished '+step_id+' in '+elapsed+' s')
+        else:
+            status[step_id] = 'failed'
+            msg('Step '+step_id+' failed with exit code '+str(returncode)+' after '+elapsed+' s, see '+step['logfile'])
+
+    msg('Ran '+str(len(steps))+' steps in '+str(int(time.time()-t0))+' s')
+    for step in steps:
+        msg(step['id'].ljust(12)+status.get(step['id'],'skipped'))
+
+    return all(status.get(step['id']) == 'done' for step in steps)
+
+
+def main():
+
+    if len(sys.argv) != 2:
+        print('Usage: local_executor.py recipe.json')
+        sys.exit(1)
+
+    with open(sys.argv[1]) as f:
+        dag = json.load(f)
+
+    ncpu = int(dag['ncpu'])
+    mem = float(dag['mem'])
+    if ncpu <= 0:
+        ncpu = os.cpu_count()
+    if mem <= 0:
+        mem = get_total_memory()
+
+    msg('Running '+str(len(dag['steps']))+' steps with a budget of '+str(ncpu)+' CPUs and '+str(round(mem,1))+' GB')
+
+    if not run_dag(dag['steps'],ncpu,mem):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    main()
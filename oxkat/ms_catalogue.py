@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import json
+import numpy
+import os
+from pyrap.tables import table
+
+from oxkat import ms_scans
+
+
+# ------------------------------------------------------------------------
+#
+# Metadata catalogue of a Measurement Set, shared by oxkat/1GC_00_setup.py
+# and the tools that summarise an MS (ms_info.py, scan_times.py and
+# find_sun.py)
+#
+# The ANTENNA, FIELD, SPECTRAL_WINDOW and STATE sub-tables are read once,
+# and the main table is summarised in a single chunked pass by
+# oxkat/ms_scans.py. The result is kept in the working folder, next to
+# project_info.json, as
+#
+#   <msname>.catalogue.json : sub-table contents and the MS stamp
+#   <msname>.catalogue.npz  : the scan index arrays
+#
+# The stamp holds the row count and the size and modification time of
+# table.dat for the main table, and the total size and newest
+# modification time of the files of each sub-table. The catalogue is
+# rebuilt if any of these change.
+#
+
+
+subtables = ['ANTENNA','FIELD','SPECTRAL_WINDOW','STATE']
+
+
+def catalogue_names(myms,catdir='.'):
+    stem = os.path.join(catdir,os.path.basename(myms.rstrip('/'))+'.catalogue')
+    return stem+'.json',stem+'.npz'
+
+
+def table_stamp(tabdir):
+    # Total size and newest mtime of the files of a table, not its sub-tables
+    size = 0
+    mtime = 0
+    for entry in os.scandir(tabdir):
+        if entry.is_file():
+            st = entry.stat()
+            size += st.st_size
+            mtime = max(mtime,st.st_mtime_ns)
+    return [size,mtime]
+
+
+def ms_stamp(myms):
+
+    """ Stamp that changes when the MS is modified in a way that affects
+    the catalogue
+    """
+
+    tt = table(myms,ack=False)
+    nrows = tt.nrows()
+    tt.done()
+    st = os.stat(os.path.join(myms,'table.dat'))
+    stamp = {'MAIN':[nrows,st.st_size,st.st_mtime_ns]}
+    for subtable in subtables:
+        if os.path.isdir(os.path.join(myms,subtable)):
+            stamp[subtable] = table_stamp(os.path.join(myms,subtable))
+    return stamp
+
+
+def read_subtables(myms):
+
+    """ Contents of the sub-tables used by the setup and the tools, as
+    JSON-friendly lists
+    """
+
+    cat = {}
+
+    ant_tab = table(myms+'/ANTENNA',ack=False)
+    cat['antenna'] = {'name':list(ant_tab.getcol('NAME')),
+        'position':ant_tab.getcol('POSITION').tolist()}
+    ant_tab.done()
+
+    field_tab = table(myms+'/FIELD',ack=False)
+    cat['field'] = {'name':list(field_tab.getcol('NAME')),
+        'source_id':field_tab.getcol('SOURCE_ID').tolist(),
+        'reference_dir':field_tab.getcol('REFERENCE_DIR').tolist(),
+        'phase_dir':field_tab.getcol('PHASE_DIR').tolist()}
+    field_tab.done()
+
+    # Only the channel range and first channel width of each SPW are kept
+    spw_tab = table(myms+'/SPECTRAL_WINDOW',ack=False)
+    cat['spw'] = {'name':list(spw_tab.getcol('NAME')),
+        'num_chan':spw_tab.getcol('NUM_CHAN').tolist(),
+        'ref_frequency':spw_tab.getcol('REF_FREQUENCY').tolist(),
+        'freq_first':[],
+        'freq_last':[],
+        'chan_width':[]}
+    for i in range(0,spw_tab.nrows()):
+        chan_freq = spw_tab.getcell('CHAN_FREQ',i)
+        cat['spw']['freq_first'].append(float(chan_freq[0]))
+        cat['spw']['freq_last'].append(float(chan_freq[-1]))
+        cat['spw']['chan_width'].append(float(spw_tab.getcell('CHAN_WIDTH',i)[0]))
+    spw_tab.done()
+
+    cat['state'] = {'obs_mode':[]}
+    if os.path.isdir(myms+'/STATE'):
+        state_tab = table(myms+'/STATE',ack=False)
+        if state_tab.nrows() > 0:
+            cat['state']['obs_mode'] = list(state_tab.getcol('OBS_MODE'))
+        state_tab.done()
+
+    return cat
+
+
+def build_catalogue(myms):
+
+    """ Read myms and return its catalogue """
+
+    cat = read_subtables(myms)
+    cat['ms'] = myms
+    cat['stamp'] = ms_stamp(myms)
+    cat['scans'] = ms_scans.build_scan_index(myms)
+    return cat
+
+
+def save_catalogue(cat,catdir='.'):
+    # Not being able to write the catalogue only costs a rebuild next time
+    json_file,npz_file = catalogue_names(cat['ms'],catdir)
+    header = dict([(key,cat[key]) for key in cat if key != 'scans'])
+    try:
+        tmp_file = npz_file+'.'+str(os.getpid())+'.tmp.npz'
+        numpy.savez(tmp_file,**cat['scans'])
+        os.replace(tmp_file,npz_file)
+        tmp_file = json_file+'.'+str(os.getpid())+'.tmp'
+        f = open(tmp_file,'w')
+        json.dump(header,f,indent=1)
+        f.close()
+        os.replace(tmp_file,json_file)
+    except (IOError,OSError):
+        pass
+
+
+def load_catalogue(myms,catdir='.'):
+
+    """ The stored catalogue of myms, or None if there is none or it is
+    out of date
+    """
+
+    json_file,npz_file = catalogue_names(myms,catdir)
+    if not os.path.isfile(json_file) or not os.path.isfile(npz_file):
+        return None
+    try:
+        with open(json_file) as f:
+            cat = json.load(f)
+        data = numpy.load(npz_file)
+        cat['scans'] = dict([(key,data[key]) for key in ms_scans.index_keys])
+        data.close()
+    except (IOError,OSError,KeyError,ValueError):
+        return None
+    if cat.get('stamp') != ms_stamp(myms):
+        return None
+    return cat
+
+
+def get_catalogue(myms,catdir='.',rebuild=False):
+
+    """ Returns the catalogue of myms, building and storing it if needed.
+    The scan index in cat['scans'] includes the derived arrays from
+    oxkat/ms_scans.py (tmean, int0, int1 and mean_exposure).
+    """
+
+    myms = myms.rstrip('/')
+    cat = None
+    if not rebuild:
+        cat = load_catalogue(myms,catdir)
+    if cat is None:
+        cat = build_catalogue(myms)
+        save_catalogue(cat,catdir)
+    cat['scans'] = ms_scans.derive(cat['scans'])
+    return cat
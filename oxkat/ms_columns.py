@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import numpy
+import os
+import sys
+import time
+from pyrap.tables import table
+
+
+# ------------------------------------------------------------------------
+#
+# Chunked column operations on Measurement Sets, shared by
+# tools/copy_MS_column.py and tools/sum_MS_columns.py
+#
+# Rows are selected per spectral window with selectrows on columns read
+# once up front, rather than a TaQL query per SPW, and each chunk is read
+# with getcolnp into a buffer that is allocated once per SPW. The reads and
+# writes are not overlapped with a thread: casacore shares one table object
+# between all of the handles to an MS in a process and is not thread-safe.
+#
+
+
+def get_available_memory():
+
+    """ Returns the available memory in bytes """
+
+    try:
+        f = open('/proc/meminfo','r')
+        for line in f:
+            if line.startswith('MemAvailable:'):
+                f.close()
+                return int(line.split()[1])*1024
+        f.close()
+    except IOError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_AVPHYS_PAGES')
+
+
+def auto_rowchunk(rowbytes,nbuffers,memfrac=0.25,maxrows=2000000):
+
+    """ Number of rows per chunk such that nbuffers column buffers use
+    memfrac of the available memory
+    """
+
+    nrows = int(memfrac*get_available_memory()/(rowbytes*nbuffers))
+    return max(1,min(nrows,maxrows))
+
+
+def select_rows(tt,field=''):
+
+    """ Returns a dict of SPW ID : row numbers, optionally restricted to
+    a single FIELD_ID
+    """
+
+    ddid = tt.getcol('DATA_DESC_ID')
+    selection = numpy.ones(len(ddid),dtype=bool)
+    if field != '':
+        selection = tt.getcol('FIELD_ID') == int(field)
+    spw_rows = {}
+    for spw in numpy.unique(ddid[selection]):
+        spw_rows[spw] = numpy.where(selection & (ddid == spw))[0]
+    return spw_rows
+
+
+def column_op(msname,src,dest,op='copy',field='',rowchunk=0):
+
+    """ Copy (op = 'copy'), add (op = 'add') or subtract (op = 'subtract')
+    column src to / from column dest of msname in chunks of rowchunk rows.
+    rowchunk = 0 picks the chunk size from the available memory.
+    """
+
+    tt = table(msname,readonly=False,ack=False)
+
+    colnames = tt.colnames()
+    if src not in colnames or dest not in colnames:
+        print('One or more requested columns not present in MS')
+        tt.close()
+        sys.exit()
+
+    if field != '':
+        print('Selecting FIELD_ID '+str(field))
+    spw_rows = select_rows(tt,field)
+    print('Spectral windows: '+str([int(spw) for spw in spw_rows]))
+
+    if op == 'copy':
+        print('Copying '+src+' to '+dest)
+    elif op == 'subtract':
+        print('Subtracting '+src+' from '+dest)
+    else:
+        print('Adding '+src+' to '+dest)
+
+    total_rows = 0
+    total_bytes = 0
+    t0 = time.time()
+
+    for spw in spw_rows:
+
+        spw_tab = tt.selectrows(spw_rows[spw])
+        nrows = spw_tab.nrows()
+        cells = [spw_tab.getcell(src,0)]
+        if op != 'copy':
+            cells.append(spw_tab.getcell(dest,0))
+        rowbytes = cells[0].nbytes
+        ncols = len(cells)
+
+        if rowchunk > 0:
+            chunk = min(rowchunk,nrows)
+        else:
+            chunk = min(auto_rowchunk(rowbytes,ncols),nrows)
+        print('SPW '+str(int(spw))+': '+str(nrows)+' rows in chunks of '+str(chunk)+' rows ('+str(round(chunk*rowbytes*ncols/1e9,2))+' GB buffered)')
+
+        buffers = [numpy.empty((chunk,)+cell.shape,dtype=cell.dtype) for cell in cells]
+
+        for start_row in range(0,nrows,chunk):
+            nr = min(chunk,nrows-start_row)
+            print('Processing rows: '+str(start_row)+' to '+str(start_row+nr)+' for SPW '+str(int(spw)))
+            src_data = buffers[0][0:nr]
+            spw_tab.getcolnp(src,src_data,start_row,nr)
+            if op == 'copy':
+                out_data = src_data
+            else:
+                out_data = buffers[1][0:nr]
+                spw_tab.getcolnp(dest,out_data,start_row,nr)
+                if op == 'subtract':
+                    numpy.subtract(out_data,src_data,out=out_data)
+                else:
+                    numpy.add(out_data,src_data,out=out_data)
+            spw_tab.putcol(dest,out_data,start_row,nr)
+            total_rows += nr
+            total_bytes += nr*rowbytes*(ncols+1)
+
+        spw_tab.close()
+
+    tt.close()
+
+    elapsed = max(time.time()-t0,1e-6)
+    print('Processed '+str(total_rows)+' rows in '+str(round(elapsed,1))+' s')
+    print('Throughput: '+str(int(total_rows/elapsed))+' rows/s, '+str(round(total_bytes/elapsed/1e9,3))+' GB/s')
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import json
+import numpy
+import os
+from pyrap.tables import table
+
+from oxkat.ms_columns import auto_rowchunk
+
+
+# ------------------------------------------------------------------------
+#
+# Flag statistics for Measurement Sets and CASA calibration tables
+#
+# The FLAG column is streamed once in chunks of rows (one pass per SPW, as
+# the number of channels can differ between them), and the flagged and
+# total counts of each row are accumulated with numpy.bincount per
+#
+#   antenna  : ANTENNA1 and ANTENNA2 for an MS (a baseline counts towards
+#              both of its antennas, an autocorrelation once), ANTENNA1
+#              only for a caltable, where ANTENNA2 is the reference antenna
+#   baseline : ANTENNA1 x ANTENNA2 (MS only)
+#   channel  : per SPW
+#   scan     : SCAN_NUMBER
+#   field    : FIELD_ID
+#
+# rather than with a query and a full FLAG read per antenna or field. The
+# counts can be written to a compact summary by write_stats:
+#
+#   <name>.flagstats.npz  : all of the counts
+#   <name>.flagstats.json : flagged percentages per antenna, field, scan
+#                           and SPW, by name
+#
+# Tables are opened read-only without read locks, so that the statistics
+# can be gathered while the next step of the recipe writes to the MS.
+#
+
+
+def open_table(tabname):
+    return table(tabname,readonly=True,lockoptions='autonoread',ack=False)
+
+
+def is_caltable(tt):
+    colnames = tt.colnames()
+    return 'CPARAM' in colnames or 'FPARAM' in colnames
+
+
+def accumulate(acc,idx,weights):
+    # bincount into acc, extending it for IDs (e.g. scan numbers) not seen yet
+    counts = numpy.bincount(idx,weights=weights)
+    if len(counts) > len(acc):
+        acc = numpy.concatenate((acc,numpy.zeros(len(counts)-len(acc))))
+    acc[0:len(counts)] += counts
+    return acc
+
+
+def percentage(flagged,total):
+
+    """ Percentage flagged, NaN where there is no data """
+
+    pc = numpy.full(numpy.shape(total),numpy.nan)
+    present = total > 0
+    pc[present] = 100.0*flagged[present]/total[present]
+    return pc
+
+
+def spw_selections(tt,tabname,caltable):
+    # (SPW ID, TaQL condition) for each SPW, or a single entry with no
+    # condition if there is only one
+    if caltable:
+        spw_tab = open_table(tabname+'/SPECTRAL_WINDOW')
+        spw_ids = list(range(0,spw_tab.nrows()))
+        spw_tab.done()
+        conditions = ['SPECTRAL_WINDOW_ID=='+str(spw) for spw in spw_ids]
+    else:
+        dd_tab = open_table(tabname+'/DATA_DESCRIPTION')
+        spw_ids = dd_tab.getcol('SPECTRAL_WINDOW_ID').tolist()
+        dd_tab.done()
+        conditions = ['DATA_DESC_ID=='+str(ddid) for ddid in range(0,len(spw_ids))]
+    if len(spw_ids) == 1:
+        return [(spw_ids[0],'')]
+    return list(zip(spw_ids,conditions))
+
+
+def flag_stats(tabname,field_id=None,rowchunk=0):
+
+    """ Read the FLAG column of an MS or a caltable once and return a
+    dict of the flagged and total counts:
+
+    antenna_flagged, antenna_total : indexed by antenna ID
+    baseline_flagged, baseline_total : [ANTENNA1,ANTENNA2], MS only
+    scan_flagged, scan_total, scans : per scan number in scans
+    field_flagged, field_total, fields : per FIELD_ID in fields
+    spws : SPW IDs, with channel_flagged_<spw> and channel_total_<spw>
+    flagged, total : over the whole table
+    antenna_names, field_names : from the sub-tables
+
+    optionally for a single FIELD_ID. rowchunk = 0 picks the chunk size
+    from the available memory.
+    """
+
+    tabname = tabname.rstrip('/')
+    tt = open_table(tabname)
+    caltable = is_caltable(tt)
+    has_scan = 'SCAN_NUMBER' in tt.colnames()
+
+    ant_tab = open_table(tabname+'/ANTENNA')
+    antenna_names = ant_tab.getcol('NAME')
+    ant_tab.done()
+    nant = len(antenna_names)
+    field_tab = open_table(tabname+'/FIELD')
+    field_names = field_tab.getcol('NAME')
+    field_tab.done()
+
+    stats = {'antenna_flagged':numpy.zeros(nant),
+        'antenna_total':numpy.zeros(nant),
+        'scan_flagged':numpy.zeros(0),
+        'scan_total':numpy.zeros(0),
+        'field_flagged':numpy.zeros(0),
+        'field_total':numpy.zeros(0)}
+    if not caltable:
+        stats['baseline_flagged'] = numpy.zeros(nant*nant)
+        stats['baseline_total'] = numpy.zeros(nant*nant)
+
+    spws = []
+    for spw,condition in spw_selections(tt,tabname,caltable):
+        conditions = [x for x in [condition] if x != '']
+        if field_id is not None:
+            conditions.append('FIELD_ID=='+str(int(field_id)))
+        if len(conditions) > 0:
+            sub_tab = tt.query(query=' && '.join(conditions))
+        else:
+            sub_tab = tt
+        nrows = sub_tab.nrows()
+        if nrows == 0:
+            if sub_tab is not tt:
+                sub_tab.done()
+            continue
+
+        nchan,ncorr = sub_tab.getcell('FLAG',0).shape
+        chan_flagged = numpy.zeros(nchan)
+        chan_total = numpy.zeros(nchan)
+        if rowchunk <= 0:
+            chunk = auto_rowchunk(nchan*ncorr,1)
+        else:
+            chunk = rowchunk
+
+        for start_row in range(0,nrows,chunk):
+            nr = min(chunk,nrows-start_row)
+            flags = sub_tab.getcol('FLAG',start_row,nr)
+            a1 = sub_tab.getcol('ANTENNA1',start_row,nr)
+            a2 = sub_tab.getcol('ANTENNA2',start_row,nr)
+            field = sub_tab.getcol('FIELD_ID',start_row,nr)
+            row_flagged = numpy.count_nonzero(flags.reshape(nr,-1),axis=1).astype(numpy.float64)
+            row_total = numpy.full(nr,float(nchan*ncorr))
+
+            chan_flagged += numpy.count_nonzero(flags,axis=(0,2))
+            chan_total += nr*ncorr
+
+            stats['antenna_flagged'] += numpy.bincount(a1,weights=row_flagged,minlength=nant)[0:nant]
+            stats['antenna_total'] += numpy.bincount(a1,weights=row_total,minlength=nant)[0:nant]
+            if not caltable:
+                cross = a1 != a2
+                stats['antenna_flagged'] += numpy.bincount(a2[cross],weights=row_flagged[cross],minlength=nant)[0:nant]
+                stats['antenna_total'] += numpy.bincount(a2[cross],weights=row_total[cross],minlength=nant)[0:nant]
+                baseline = a1*nant+a2
+                stats['baseline_flagged'] += numpy.bincount(baseline,weights=row_flagged,minlength=nant*nant)[0:nant*nant]
+                stats['baseline_total'] += numpy.bincount(baseline,weights=row_total,minlength=nant*nant)[0:nant*nant]
+
+            if has_scan:
+                scan = sub_tab.getcol('SCAN_NUMBER',start_row,nr)
+                stats['scan_flagged'] = accumulate(stats['scan_flagged'],scan,row_flagged)
+                stats['scan_total'] = accumulate(stats['scan_total'],scan,row_total)
+            stats['field_flagged'] = accumulate(stats['field_flagged'],field,row_flagged)
+            stats['field_total'] = accumulate(stats['field_total'],field,row_total)
+
+        if sub_tab is not tt:
+            sub_tab.done()
+        if spw in spws:
+            # Another DATA_DESC_ID of the same SPW
+            chan_flagged += stats['channel_flagged_'+str(spw)]
+            chan_total += stats['channel_total_'+str(spw)]
+        else:
+            spws.append(spw)
+        stats['channel_flagged_'+str(spw)] = chan_flagged
+        stats['channel_total_'+str(spw)] = chan_total
+    tt.done()
+
+    # Keep only the scans and fields that are present
+    for key,ids in [('scan','scans'),('field','fields')]:
+        present = numpy.where(stats[key+'_total'] > 0)[0]
+        stats[ids] = present
+        stats[key+'_flagged'] = stats[key+'_flagged'][present]
+        stats[key+'_total'] = stats[key+'_total'][present]
+    if not caltable:
+        stats['baseline_flagged'] = stats['baseline_flagged'].reshape(nant,nant)
+        stats['baseline_total'] = stats['baseline_total'].reshape(nant,nant)
+
+    stats['spws'] = numpy.array(spws,dtype=numpy.int64)
+    stats['flagged'] = numpy.array(numpy.sum(stats['field_flagged']))
+    stats['total'] = numpy.array(numpy.sum(stats['field_total']))
+    stats['antenna_names'] = numpy.array(antenna_names,dtype=str)
+    stats['field_names'] = numpy.array(field_names,dtype=str)
+    stats['caltable'] = numpy.array(caltable)
+    return stats
+
+
+def summarise(tabname,stats):
+
+    """ JSON-friendly flagged percentages from the counts of flag_stats """
+
+    def pcs(names,flagged,total):
+        return dict([(str(name),round(float(pc),3)) for name,pc in
+                    zip(names,percentage(flagged,total)) if not numpy.isnan(pc)])
+
+    field_names = [stats['field_names'][i] if i < len(stats['field_names']) else str(i) for i in stats['fields']]
+    spw_pcs = {}
+    for spw in stats['spws']:
+        flagged = float(numpy.sum(stats['channel_flagged_'+str(spw)]))
+        total = float(numpy.sum(stats['channel_total_'+str(spw)]))
+        spw_pcs[str(spw)] = round(100.0*flagged/total,3) if total > 0 else None
+    total = float(stats['total'])
+    return {'table':tabname,
+        'type':'caltable' if bool(stats['caltable']) else 'ms',
+        'flagged_pc':round(100.0*float(stats['flagged'])/total,3) if total > 0 else None,
+        'antennas':pcs(stats['antenna_names'],stats['antenna_flagged'],stats['antenna_total']),
+        'fields':pcs(field_names,stats['field_flagged'],stats['field_total']),
+        'scans':pcs(stats['scans'],stats['scan_flagged'],stats['scan_total']),
+        'spws':spw_pcs}
+
+
+def stats_names(tabname,outdir='.',tag=''):
+    stem = os.path.basename(tabname.rstrip('/'))
+    if tag != '':
+        stem += '_'+tag
+    stem = os.path.join(outdir,stem+'.flagstats')
+    return stem+'.json',stem+'.npz'
+
+
+def write_stats(tabname,stats,outdir='.',tag=''):
+
+    """ Write the counts of flag_stats and their summary, returns the
+    names of the JSON and npz files
+    """
+
+    json_file,npz_file = stats_names(tabname,outdir,tag)
+    tmp_file = npz_file+'.'+str(os.getpid())+'.tmp.npz'
+    numpy.savez_compressed(tmp_file,**stats)
+    os.replace(tmp_file,npz_file)
+    tmp_file = json_file+'.'+str(os.getpid())+'.tmp'
+    f = open(tmp_file,'w')
+    json.dump(summarise(tabname,stats),f,indent=1)
+    f.close()
+    os.replace(tmp_file,json_file)
+    return json_file,npz_file
+
+
+def antenna_flag_counts(myms,field_id=None,rowchunk=0):
+
+    """ Returns arrays of the flagged and total visibility counts per
+    antenna (indexed by antenna ID), optionally for a single FIELD_ID
+    """
+
+    stats = flag_stats(myms,field_id,rowchunk)
+    return stats['antenna_flagged'],stats['antenna_total']
+
+
+def antenna_flag_percentages(myms,field_id=None,rowchunk=0):
+
+    """ Percentage of flagged visibilities per antenna, NaN for antennas
+    with no data
+    """
+
+    flagged,total = antenna_flag_counts(myms,field_id,rowchunk)
+    return percentage(flagged,total)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import numpy
+from pyrap.tables import table
+
+
+# ------------------------------------------------------------------------
+#
+# Per-scan summary of the main table of a Measurement Set, stored in the
+# metadata catalogue (oxkat/ms_catalogue.py)
+#
+# SCAN_NUMBER, TIME, FIELD_ID, STATE_ID, EXPOSURE and the antenna columns
+# are read once, in chunks of rows, rather than with a TaQL query per
+# scan. Within a chunk the rows are sorted by scan and reduced per scan
+# with numpy.unique and ufunc.reduceat, and the chunks are then merged.
+#
+
+
+index_keys = ['scans','field','state','t0','t1','tsum','nrows',
+            'times','antennas','field_states','exposure_sum','total_rows']
+
+
+def reduce_chunk(scan,time,field,state):
+
+    """ Per-scan reductions of one chunk of rows """
+
+    order = numpy.argsort(scan,kind='stable')
+    scan = scan[order]
+    time = time[order]
+    scans,starts,counts = numpy.unique(scan,return_index=True,return_counts=True)
+    return {'scans':scans,
+        'field':numpy.minimum.reduceat(field[order],starts),
+        'state':numpy.minimum.reduceat(state[order],starts),
+        't0':numpy.minimum.reduceat(time,starts),
+        't1':numpy.maximum.reduceat(time,starts),
+        'tsum':numpy.add.reduceat(time,starts),
+        'nrows':counts}
+
+
+def merge_chunks(chunks):
+
+    """ Combine the per-scan reductions of several chunks """
+
+    allscans = numpy.concatenate([chunk['scans'] for chunk in chunks])
+    scans,inverse = numpy.unique(allscans,return_inverse=True)
+    merged = {'scans':scans}
+    for key,func,fill in [('field',numpy.minimum,numpy.iinfo(numpy.int64).max),
+                ('state',numpy.minimum,numpy.iinfo(numpy.int64).max),
+                ('t0',numpy.minimum,numpy.inf),
+                ('t1',numpy.maximum,-numpy.inf),
+                ('tsum',numpy.add,0.0),
+                ('nrows',numpy.add,0)]:
+        values = numpy.concatenate([chunk[key] for chunk in chunks])
+        if key == 'nrows' or key == 'field' or key == 'state':
+            out = numpy.full(len(scans),fill,dtype=numpy.int64)
+        else:
+            out = numpy.full(len(scans),fill,dtype=numpy.float64)
+        func.at(out,inverse,values)
+        merged[key] = out
+    return merged
+
+
+def build_scan_index(myms,rowchunk=5000000):
+
+    """ Read the main table of myms once and return the scan index, a
+    dict of numpy arrays:
+
+    scans, field, state, t0, t1, tsum, nrows : per scan, where field and
+        state are the lowest FIELD_ID and STATE_ID in the scan (state is
+        -1 if there is no STATE_ID column), t0 and t1 the first and last
+        TIME, and tsum the sum of TIME over the nrows rows
+    times : all unique TIME values in the MS
+    antennas : antenna IDs present in the main table
+    field_states : unique (FIELD_ID, STATE_ID) pairs
+    exposure_sum, total_rows : for the mean EXPOSURE
+    """
+
+    tt = table(myms,ack=False)
+    nrows = tt.nrows()
+    has_state = 'STATE_ID' in tt.colnames()
+
+    chunks = []
+    times = []
+    antennas = []
+    field_states = []
+    exposure_sum = 0.0
+    for start_row in range(0,nrows,rowchunk):
+        nr = min(rowchunk,nrows-start_row)
+        scan = tt.getcol('SCAN_NUMBER',start_row,nr).astype(numpy.int64)
+        time = tt.getcol('TIME',start_row,nr)
+        field = tt.getcol('FIELD_ID',start_row,nr).astype(numpy.int64)
+        if has_state:
+            state = tt.getcol('STATE_ID',start_row,nr).astype(numpy.int64)
+        else:
+            state = numpy.full(nr,-1,dtype=numpy.int64)
+        chunks.append(reduce_chunk(scan,time,field,state))
+        field_states.append(numpy.unique(numpy.stack((field,state),axis=1),axis=0))
+        times.append(numpy.unique(time))
+        antennas.append(numpy.unique(tt.getcol('ANTENNA1',start_row,nr)))
+        antennas.append(numpy.unique(tt.getcol('ANTENNA2',start_row,nr)))
+        exposure_sum += float(numpy.sum(tt.getcol('EXPOSURE',start_row,nr)))
+    tt.done()
+
+    index = merge_chunks(chunks)
+    index['times'] = numpy.unique(numpy.concatenate(times))
+    index['antennas'] = numpy.unique(numpy.concatenate(antennas))
+    index['field_states'] = numpy.unique(numpy.concatenate(field_states),axis=0)
+    index['exposure_sum'] = numpy.array(exposure_sum)
+    index['total_rows'] = numpy.array(nrows)
+    return index
+
+
+def derive(index):
+
+    """ Add the derived arrays to an index: tmean, int0 and int1 (the
+    indices of t0 and t1 in times) and the scalar mean_exposure
+    """
+
+    index['tmean'] = index['tsum']/index['nrows']
+    index['int0'] = numpy.searchsorted(index['times'],index['t0'])
+    index['int1'] = numpy.searchsorted(index['times'],index['t1'])
+    index['mean_exposure'] = float(index['exposure_sum'])/max(int(index['total_rows']),1)
+    return index
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from optparse import OptionParser
+
+
+# ------------------------------------------------------------------------
+#
+# Run a step against node-local copies of its Measurement Sets
+#
+#   ms_stage.py --ms a.ms,b.ms --scratch /local 'command'
+#
+# Each MS is copied to a private folder in the scratch area, the command
+# is run with the MS arguments pointing at the copies, and when it
+# succeeds only the table files that it changed, added or removed are
+# synced back. casacore keeps each storage manager (i.e. a column or a
+# group of columns) in its own table.f* file, so a step that writes
+# MODEL_DATA or FLAG only returns those files, and sub-tables that were
+# not touched are left alone. If the step fails nothing is synced back
+# and the shared MS is as it was. The copies are always removed.
+#
+# An MS argument is one that matches the path given to --ms as a whole
+# word (e.g. 'x.ms', '--data-ms=x.ms' or 'x.ms/FIELD', but not the
+# image name 'img_x.ms_datamask'). If the scratch area is too small the
+# command is run against the shared MS.
+#
+# This module only uses the standard library, as it runs outside the
+# containers.
+#
+
+
+def msg(txt):
+    stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+    print(stamp+txt,flush=True)
+
+
+def snapshot(myms):
+    # Size and mtime of every file in an MS, keyed by relative path
+    files = {}
+    for root,dirs,names in os.walk(myms):
+        for name in names:
+            path = os.path.join(root,name)
+            st = os.stat(path)
+            files[os.path.relpath(path,myms)] = (st.st_size,st.st_mtime_ns)
+    return files
+
+
+def dir_size(myms):
+    return sum([x[0] for x in snapshot(myms).values()])
+
+
+def rewrite_command(command,myms,local_ms):
+
+    """ Point the whole-word occurrences of myms in command at local_ms """
+
+    pattern = r'(?<![^\s=\'",])'+re.escape(myms.rstrip('/'))+r'(?=$|[\s\'",/])'
+    return re.sub(pattern,lambda match: local_ms,command)
+
+
+def stage_in(myms,local_ms):
+    t0 = time.time()
+    shutil.copytree(myms,local_ms,symlinks=True)
+    msg('Staged '+myms+' to '+local_ms+' in '+str(round(time.time()-t0,1))+' s')
+    return snapshot(local_ms)
+
+
+def sync_back(local_ms,myms,before):
+
+    """ Copy the files of local_ms that changed since the snapshot
+    before back to myms, and remove those that were deleted
+    """
+
+    after = snapshot(local_ms)
+    changed = [x for x in sorted(after) if before.get(x) != after[x]]
+    removed = [x for x in sorted(before) if x not in after]
+    nbytes = 0
+    for relpath in changed:
+        src = os.path.join(local_ms,relpath)
+        dest = os.path.join(myms,relpath)
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest),exist_ok=True)
+        tmp_file = dest+'.'+str(os.getpid())+'.tmp'
+        shutil.copy2(src,tmp_file)
+        os.replace(tmp_file,dest)
+        nbytes += after[relpath][0]
+    for relpath in removed:
+        dest = os.path.join(myms,relpath)
+        if os.path.isfile(dest):
+            os.remove(dest)
+    msg('Synced '+str(len(changed))+' changed file(s) ('+str(round(nbytes/1e9,2))+' GB) back to '+myms+
+                ', removed '+str(len(removed)))
+
+
+def run_staged(command,mslist,scratch):
+
+    """ Run command against node-local copies of the MSs in mslist,
+    returns the exit code of the command
+    """
+
+    mslist = [myms.rstrip('/') for myms in mslist if os.path.isdir(myms)]
+    if len(mslist) == 0:
+        return subprocess.call(command,shell=True,executable='/bin/bash')
+
+    workdir = os.path.join(scratch,'oxkat_ms_'+str(os.getpid()))
+    try:
+        os.makedirs(workdir,exist_ok=True)
+        need = sum([dir_size(myms) for myms in mslist])
+        free = shutil.disk_usage(workdir).free
+    except OSError as err:
+        msg('Cannot use '+scratch+' ('+str(err)+'), running against the shared MS')
+        return subprocess.call(command,shell=True,executable='/bin/bash')
+
+    if need > 0.9*free:
+        msg('Need '+str(round(need/1e9,1))+' GB but '+scratch+' has '+str(round(free/1e9,1))+
+                    ' GB free, running against the shared MS')
+        shutil.rmtree(workdir,ignore_errors=True)
+        return subprocess.call(command,shell=True,executable='/bin/bash')
+
+    # The scratch area has to be visible inside the containers
+    env = dict(os.environ)
+    bindpath = [x for x in env.get('SINGULARITY_BINDPATH','').split(',') if x != '']
+    env['SINGULARITY_BINDPATH'] = ','.join(bindpath+[scratch])
+
+    try:
+        staged = []
+        for myms in mslist:
+            local_ms = os.path.join(workdir,os.path.basename(myms))
+            before = stage_in(myms,local_ms)
+            staged.append((myms,local_ms,before))
+            command = rewrite_command(command,myms,local_ms)
+        returncode = subprocess.call(command,shell=True,executable='/bin/bash',env=env)
+        if returncode == 0:
+            for myms,local_ms,before in staged:
+                sync_back(local_ms,myms,before)
+        else:
+            msg('Step failed with exit code '+str(returncode)+', not syncing back')
+        return returncode
+    finally:
+        shutil.rmtree(workdir,ignore_errors=True)
+
+
+def main():
+
+    parser = OptionParser(usage = '%prog [options] command')
+    parser.add_option('--ms', dest = 'mslist', help = 'Comma-separated list of MSs to stage', default = '')
+    parser.add_option('--scratch', dest = 'scratch', help = 'Node-local folder for the copies (default = /tmp)', default = '/tmp')
+    (options,args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.print_help()
+        sys.exit(1)
+
+    mslist = [x for x in options.mslist.split(',') if x != '']
+    # Remove the copies if the job is cancelled
+    signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(1))
+    sys.exit(run_staged(args[0],mslist,options.scratch))
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import numpy
+from astropy import wcs
+
+
+# ------------------------------------------------------------------------
+#
+# DS9 region parsing and vectorised circle rasterisation, shared by
+# tools/mask_FITS_with_region.py and 3GC_split_model_images.py
+#
+
+
+def hms2deg(hms,delimiter=':'):
+
+    """
+    Right ascention string in hms to float in decimal degrees
+    """
+
+    h,m,s = hms.split(delimiter)
+    h = float(h)
+    m = float(m)
+    s = float(s)
+    deg = 15.0*(h+(m/60.0)+(s/3600.0))
+    return deg
+
+
+def dms2deg(dms,delimiter=':'):
+
+    """
+    Declination string in dms to float in decimal degrees
+    """
+
+    d,m,s = dms.split(delimiter)
+    if d[0] == '-':
+        decsign = -1.0
+        d = float(d[1:])
+    elif d[0] == '+':
+        decsign = 1.0
+        d = float(d[1:])
+    else:
+        decsign = 1.0
+        d = float(d)
+    m = float(m)
+    s = float(s)
+    deg = decsign*(d+(m/60.0)+(s/3600.0))
+
+    return deg
+
+
+def radius2deg(radius):
+
+    """
+    String with arcsec or arcmin unit to decimal degrees
+    """
+
+    if radius[-1] == '"':
+        radius = float(radius[:-1])/3600.0
+    elif radius[-1] == "'":
+        radius = float(radius[:-1])/60.0
+    else:
+        radius = float(radius)
+
+    return radius
+
+
+def process_region_file(region_file):
+
+    """
+    Extract RA,dec,radius as floats in degrees
+    from a DS9 region file containing circles
+    """
+
+    circles = []
+
+    f = open(region_file,'r')
+    line = f.readline()
+    while line:
+        if line[0:6] == 'circle':
+            line = line.replace(' ','')
+            line = line.rstrip('\n').replace('(',' ').replace(')',' ')
+            ra,dec,radius = line.split()[1].split(',')
+            if ':' in  ra:
+                ra = hms2deg(ra)
+            else:
+                ra = float(ra)
+            if ':' in dec:
+                dec = dms2deg(dec)
+            else:
+                dec = float(dec)
+            radius = radius2deg(radius)
+            circles.append((ra,dec,radius))
+        line = f.readline()
+    f.close()
+
+    return circles
+
+
+def circles_to_pixels(header,circles):
+
+    """
+    Convert a list of (RA,dec,radius) circles in degrees to
+    (xpix,ypix,rpix) using the celestial WCS of header
+    """
+
+    if len(circles) == 0:
+        return []
+    w = wcs.WCS(header).celestial
+    pixscale = abs(header['CDELT2'])
+    circles = numpy.array(circles,dtype=float)
+    xpix,ypix = w.wcs_world2pix(circles[:,0],circles[:,1],0)
+    rpix = circles[:,2]/pixscale
+    return list(zip(xpix,ypix,rpix))
+
+
+def circle_mask(shape,pixels):
+
+    """
+    Boolean mask of the given 2D shape that is True within any of the
+    (xpix,ypix,rpix) circles in pixels. Each circle is only evaluated
+    over its bounding box, clipped to the image edges.
+    """
+
+    ny,nx = shape
+    mask = numpy.zeros((ny,nx),dtype=bool)
+    for xpix,ypix,rpix in pixels:
+        x0 = max(int(numpy.ceil(xpix-rpix)),0)
+        x1 = min(int(numpy.floor(xpix+rpix)),nx-1)
+        y0 = max(int(numpy.ceil(ypix-rpix)),0)
+        y1 = min(int(numpy.floor(ypix+rpix)),ny-1)
+        if x0 > x1 or y0 > y1:
+            continue
+        dx = numpy.arange(x0,x1+1)-xpix
+        dy = numpy.arange(y0,y1+1)-ypix
+        inside = (dy[:,None]**2.0 + dx[None,:]**2.0) < rpix**2.0
+        mask[y0:y1+1,x0:x1+1] |= inside
+    return mask
+
+
+geometry_keys = ['NAXIS1','NAXIS2','CTYPE1','CTYPE2','CRVAL1','CRVAL2',
+            'CRPIX1','CRPIX2','CDELT1','CDELT2']
+
+region_masks = {}
+
+def region_mask(header,circles):
+
+    """
+    Circle mask for the image geometry in header, computed once per
+    distinct geometry and reused for every image that shares it
+    """
+
+    key = tuple([header.get(x) for x in geometry_keys])+tuple(map(tuple,circles))
+    if key not in region_masks:
+        pixels = circles_to_pixels(header,circles)
+        region_masks[key] = circle_mask((header['NAXIS2'],header['NAXIS1']),pixels)
+    return region_masks[key]
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import math
+import os
+import struct
+
+
+# ------------------------------------------------------------------------
+#
+# Resource estimates for the main step types, from the dimensions of the
+# Measurement Set and the image being made
+#
+# The setup scripts run outside the containers, so the MS is inspected
+# without casacore: the row count is read from the header of table.dat,
+# the columns present are found from their descriptions in the same file,
+# and the visibility volume is taken from the row count, the number of
+# channels and the size of the table on disk.
+#
+# The models are first order (a fixed overhead plus terms that scale with
+# the visibility volume per data column and the image size) and their
+# coefficients are deliberately generous. The wall time is modelled as
+# CPU hours shared between the CPUs that the step is given, so a step
+# that is given fewer CPUs is also given longer. Predictions are
+# multiplied by a headroom factor and rounded up to a coarse ladder of
+# values, so that similar targets get identical requests (and can share a
+# job array).
+#
+
+
+# Data-like columns whose presence changes the size of the MS
+data_columns = ['DATA','CORRECTED_DATA','MODEL_DATA','WEIGHT_SPECTRUM','SIGMA_SPECTRUM']
+
+
+# Per step type: fixed memory (GB), GB of memory per GB of visibilities,
+# image-sized buffers for the deconvolution, image-sized buffers per output
+# channel, fixed hours, CPU hours per GB of visibilities, GB of
+# visibilities per CPU and the fewest CPUs to give the step. Step types
+# with vis_cpu = 0 keep their configured CPUs, as their thread count is
+# not set from the syscall.
+models = {
+    'wsclean':   {'mem0':4.0,'mem_vis':0.25,'mem_img':8,'img_chan':3,'time0':0.5,'cpuh_vis':2.4,'vis_cpu':2.0,'min_cpus':8},
+    'predict':   {'mem0':4.0,'mem_vis':0.25,'mem_img':2,'img_chan':1,'time0':0.25,'cpuh_vis':0.8,'vis_cpu':2.0,'min_cpus':4},
+    'ddfacet':   {'mem0':8.0,'mem_vis':0.5,'mem_img':16,'img_chan':3,'time0':1.0,'cpuh_vis':4.8,'vis_cpu':2.0,'min_cpus':8},
+    'killms':    {'mem0':8.0,'mem_vis':0.5,'mem_img':0,'img_chan':0,'time0':1.0,'cpuh_vis':4.8,'vis_cpu':2.0,'min_cpus':8},
+    'cubical':   {'mem0':4.0,'mem_vis':0.5,'mem_img':0,'img_chan':0,'time0':0.5,'cpuh_vis':1.6,'vis_cpu':2.0,'min_cpus':4},
+    'tricolour': {'mem0':4.0,'mem_vis':0.2,'mem_img':0,'img_chan':0,'time0':0.25,'cpuh_vis':0.8,'vis_cpu':0,'min_cpus':0},
+    'casa':      {'mem0':4.0,'mem_vis':0.1,'mem_img':0,'img_chan':0,'time0':0.25,'cpuh_vis':0.8,'vis_cpu':0,'min_cpus':0},
+}
+
+mem_ladder = [8,16,32,64,96,128,192,230,256,384,480,512,768,1024]
+time_ladder = [1,2,3,4,6,8,12,18,24,36,48,72,96,168]
+cpu_ladder = [4,8,16,24,32,48,64,128]
+
+
+def table_nrows(tabledat):
+
+    """ Row count from the header of a casacore table.dat file, or None
+    if the header cannot be read. The file starts with the AipsIO magic
+    number, the object length, the type string 'Table', its version and
+    then the row count (32 bit up to version 2, 64 bit from version 3),
+    all big-endian.
+    """
+
+    try:
+        f = open(tabledat,'rb')
+        header = f.read(64)
+        f.close()
+        magic,length,typelen = struct.unpack('>III',header[0:12])
+        if magic != 0xbebebebe or header[12:12+typelen] != b'Table':
+            return None
+        offset = 12+typelen
+        version = struct.unpack('>I',header[offset:offset+4])[0]
+        offset += 4
+        if version >= 3:
+            nrows = struct.unpack('>Q',header[offset:offset+8])[0]
+        else:
+            nrows = struct.unpack('>I',header[offset:offset+4])[0]
+        return int(nrows)
+    except (IOError,OSError,struct.error):
+        return None
+
+
+def table_columns(tabledat,colnames):
+
+    """ The names in colnames whose column descriptions appear in
+    table.dat, where names are stored as length-prefixed strings
+    """
+
+    f = open(tabledat,'rb')
+    raw = f.read()
+    f.close()
+    present = []
+    for colname in colnames:
+        if struct.pack('>I',len(colname))+colname.encode() in raw:
+            present.append(colname)
+    return present
+
+
+def table_column_managers(tabledat,colnames):
+
+    """ Dict of column name : sequence number of the data manager that
+    stores it, for the names in colnames that can be found in table.dat.
+    Each column is written to the column set as its class version (2),
+    its name as a length-prefixed string, the version of the column data
+    (1) and the data manager sequence number, all big-endian. The data
+    manager with sequence number n keeps its data in table.f<n> and
+    files starting with it (e.g. table.f<n>_TSM0).
+    """
+
+    f = open(tabledat,'rb')
+    raw = f.read()
+    f.close()
+    managers = {}
+    for colname in colnames:
+        pattern = struct.pack('>II',2,len(colname))+colname.encode()+struct.pack('>I',1)
+        offset = raw.rfind(pattern)
+        if offset < 0:
+            continue
+        offset += len(pattern)
+        try:
+            managers[colname] = struct.unpack('>I',raw[offset:offset+4])[0]
+        except struct.error:
+            continue
+    return managers
+
+
+def ms_dimensions(myms,nchan=0,ncorr=4):
+
+    """ Returns a dict with the number of rows, the data-like columns
+    present, the size on disk and the visibility volume of a single
+    complex data column in GB. If nchan is not known it is inferred
+    from the size on disk.
+    """
+
+    tabledat = os.path.join(myms,'table.dat')
+    dims = {'nrows':None,'columns':[],'disk_gb':0.0,'vis_gb':None}
+    if not os.path.isfile(tabledat):
+        return dims
+
+    disk = 0
+    for entry in os.scandir(myms):
+        if entry.is_file():
+            disk += entry.stat().st_size
+    dims['disk_gb'] = disk/1e9
+    dims['nrows'] = table_nrows(tabledat)
+    dims['columns'] = table_columns(tabledat,data_columns)
+
+    # Bytes per visibility summed over the data-like columns (complex
+    # columns 8, float spectra 4) plus the flags (one bit)
+    per_vis = 0.125
+    for colname in dims['columns']:
+        if colname.endswith('SPECTRUM'):
+            per_vis += 4.0
+        else:
+            per_vis += 8.0
+
+    if dims['nrows'] is not None and int(nchan) > 0:
+        dims['vis_gb'] = dims['nrows']*int(nchan)*ncorr*8.0/1e9
+    elif per_vis > 0.125:
+        dims['vis_gb'] = dims['disk_gb']*8.0/per_vis
+
+    return dims
+
+
+def ladder_value(value,ladder,ceiling):
+    for step in ladder:
+        if step >= value:
+            return min(step,ceiling)
+    return ceiling
+
+
+def choose_cpus(step_type,vis_gb,max_cpus):
+
+    """ Number of CPUs for step_type, from the ladder and no more than
+    max_cpus (the configured value)
+    """
+
+    model = models[step_type]
+    if model['vis_cpu'] <= 0:
+        return int(max_cpus)
+    cpus = max(model['min_cpus'],int(math.ceil(vis_gb/model['vis_cpu'])))
+    return ladder_value(cpus,cpu_ladder,int(max_cpus))
+
+
+def estimate(step_type,vis_gb,cpus,npix=0,nchanout=1,headroom=1.5):
+
+    """ Predicted (mem in GB, walltime in hours) for step_type run on
+    cpus CPUs, before rounding or capping
+    """
+
+    model = models[step_type]
+    image_gb = (float(npix)**2.0)*4.0/1e9
+    nbuffers = model['mem_img']+(model['img_chan']*max(1,int(nchanout)))
+    mem = model['mem0']+(model['mem_vis']*vis_gb)+(nbuffers*image_gb)
+    hours = model['time0']+(model['cpuh_vis']*vis_gb/max(1,int(cpus)))
+    return mem*headroom,hours*headroom
+
+
+def size_resources(step_type,vis_gb,max_cpus,max_mem,max_hours,npix=0,nchanout=1,headroom=1.5):
+
+    """ Returns (cpus, mem in GB, walltime in hours) rounded up to the
+    ladders, with no more than max_cpus CPUs and capped at max_mem and
+    max_hours, and the unrounded predictions (mem, hours) for those CPUs
+    """
+
+    cpus = choose_cpus(step_type,vis_gb,max_cpus)
+    mem,hours = estimate(step_type,vis_gb,cpus,npix,nchanout,headroom)
+    return (cpus,ladder_value(mem,mem_ladder,max_mem),ladder_value(hours,time_ladder,max_hours)),(mem,hours)
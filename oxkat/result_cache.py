@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from optparse import OptionParser
+
+
+# ------------------------------------------------------------------------
+#
+# Content-addressed cache for deterministic steps
+#
+# A step that is a pure function of its input files and its command line
+# (e.g. pyMakeMask.py, pbcor_katbeam.py, 3GC_split_model_images.py) is wrapped as
+#
+#   result_cache.py --inputs a.fits,b.reg --outputs c.fits,d.fits 'command'
+#
+# The cache key is the SHA1 of the command and the contents of the inputs.
+# On a hit the outputs are restored from the cache as hard links and the
+# command is not run. On a miss the command is run and its outputs are
+# hard linked into the cache, so storing a result costs no extra space
+# until the outputs are deleted from the working area. Entries are
+# evicted least recently used first when the cache exceeds its quota.
+#
+# A hard link shares its data with the working copy, so an entry whose
+# files have been modified in place since they were stored (detected by
+# size and mtime) is discarded rather than restored. Steps whose outputs
+# are among their inputs (in-place modifiers) are run without the cache.
+#
+# Digests of the inputs are memoised by path, size and mtime in the
+# cache folder, so unchanged inputs are only read once.
+#
+# This module only uses the standard library, as it runs outside the
+# containers.
+#
+
+
+def msg(txt):
+    stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+    print(stamp+txt,flush=True)
+
+
+def expand_paths(paths):
+    # Expand glob patterns, keeping the order in which they were given
+    expanded = []
+    for pattern in paths:
+        matches = sorted(glob.glob(pattern.rstrip('/')))
+        if len(matches) == 0:
+            expanded.append(pattern)
+        expanded.extend(matches)
+    return expanded
+
+
+def file_digest(infile):
+    sha = hashlib.sha1()
+    f = open(infile,'rb')
+    for chunk in iter(lambda: f.read(4194304),b''):
+        sha.update(chunk)
+    f.close()
+    return sha.hexdigest()
+
+
+def path_files(path):
+    # All files belonging to a file or directory input, in a fixed order
+    if os.path.isdir(path):
+        files = []
+        for root,dirs,names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                files.append(os.path.join(root,name))
+        return files
+    return [path]
+
+
+def load_memo(cachedir):
+    memo_file = cachedir+'/digests.json'
+    if os.path.isfile(memo_file):
+        try:
+            with open(memo_file) as f:
+                return json.load(f)
+        except ValueError:
+            pass
+    return {}
+
+
+def save_memo(cachedir,memo):
+    memo_file = cachedir+'/digests.json'
+    tmp_file = memo_file+'.'+str(os.getpid())+'.tmp'
+    f = open(tmp_file,'w')
+    json.dump(memo,f)
+    f.close()
+    os.replace(tmp_file,memo_file)
+
+
+def input_digest(path,memo):
+    # Digest of a file or directory, reusing the memo if the size and
+    # mtime of every file are unchanged
+    sha = hashlib.sha1()
+    for infile in path_files(path):
+        st = os.stat(infile)
+        stamp = [st.st_size,st.st_mtime_ns]
+        absfile = os.path.abspath(infile)
+        if absfile in memo and memo[absfile][0:2] == stamp:
+            digest = memo[absfile][2]
+        else:
+            digest = file_digest(infile)
+            memo[absfile] = stamp+[digest]
+        sha.update(os.path.relpath(infile,path).encode())
+        sha.update(digest.encode())
+    return sha.hexdigest()
+
+
+def cache_key(command,inputs,memo):
+
+    """ SHA1 of the command and the contents of the inputs, or None if
+    an input is missing
+    """
+
+    sha = hashlib.sha1()
+    sha.update(command.encode())
+    for path in expand_paths(inputs):
+        if not os.path.exists(path):
+            return None
+        sha.update(os.path.abspath(path).encode())
+        sha.update(input_digest(path,memo).encode())
+    return sha.hexdigest()
+
+
+def entry_size(entry_dir):
+    size = 0
+    for root,dirs,files in os.walk(entry_dir):
+        for ff in files:
+            size += os.path.getsize(os.path.join(root,ff))
+    return size
+
+
+def link_or_copy(src,dest):
+    # Hard link src to dest, replacing dest atomically. Falls back to a
+    # copy if the two are on different filesystems.
+    tmp = dest+'.'+str(os.getpid())+'.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src,tmp)
+    except OSError:
+        shutil.copy2(src,tmp)
+    os.replace(tmp,dest)
+
+
+def entry_is_intact(manifest,entry_dir):
+    for item in manifest['files']:
+        cached = entry_dir+'/'+item['name']
+        if not os.path.isfile(cached):
+            return False
+        st = os.stat(cached)
+        if st.st_size != item['size'] or st.st_mtime_ns != item['mtime']:
+            return False
+    return True
+
+
+def restore(cachedir,key):
+
+    """ Restore the outputs of a cache entry, returns True on a hit """
+
+    entry_dir = cachedir+'/'+key
+    manifest_file = entry_dir+'/manifest.json'
+    if not os.path.isfile(manifest_file):
+        return False
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    if not entry_is_intact(manifest,entry_dir):
+        msg('Cache entry '+key+' has been modified since it was stored, discarding')
+        shutil.rmtree(entry_dir,ignore_errors=True)
+        return False
+    for item in manifest['files']:
+        dest = item['path']
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest),exist_ok=True)
+        link_or_copy(entry_dir+'/'+item['name'],dest)
+        msg('Restored '+dest)
+    os.utime(manifest_file) # mark as recently used
+    return True
+
+
+def store(cachedir,key,command,outputs):
+
+    """ Hard link the outputs into a new cache entry """
+
+    paths = expand_paths(outputs)
+    files = []
+    for path in paths:
+        if not os.path.exists(path):
+            msg('Output '+path+' was not produced, not caching')
+            return False
+        files.extend(path_files(path))
+
+    entry_dir = cachedir+'/'+key
+    tmp_dir = entry_dir+'.'+str(os.getpid())+'.tmp'
+    shutil.rmtree(tmp_dir,ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    manifest = {'command':command,'created':time.strftime('%Y-%m-%d %H:%M:%S'),'files':[]}
+    for i in range(0,len(files)):
+        name = str(i)+'_'+os.path.basename(files[i])
+        link_or_copy(files[i],tmp_dir+'/'+name)
+        st = os.stat(tmp_dir+'/'+name)
+        manifest['files'].append({'path':os.path.abspath(files[i]),'name':name,
+                'size':st.st_size,'mtime':st.st_mtime_ns})
+    f = open(tmp_dir+'/manifest.json','w')
+    json.dump(manifest,f,indent=1)
+    f.close()
+
+    shutil.rmtree(entry_dir,ignore_errors=True)
+    os.replace(tmp_dir,entry_dir)
+    msg('Cached '+str(len(files))+' output file(s) as '+key)
+    return True
+
+
+def evict(cachedir,quota,keep=''):
+
+    """ Remove least recently used entries until the cache fits in
+    quota GB
+    """
+
+    entries = []
+    for manifest_file in glob.glob(cachedir+'/*/manifest.json'):
+        entry_dir = os.path.dirname(manifest_file)
+        entries.append((os.path.getmtime(manifest_file),entry_dir,entry_size(entry_dir)))
+    entries.sort()
+    total = sum(x[2] for x in entries)
+    for mtime,entry_dir,size in entries:
+        if total <= quota*1e9:
+            break
+        if entry_dir == keep:
+            continue
+        msg('Evicting '+entry_dir+' from result cache')
+        shutil.rmtree(entry_dir,ignore_errors=True)
+        total -= size
+
+
+def run_cached(command,inputs,outputs,cachedir,quota):
+
+    """ Run command through the cache, returns its exit code """
+
+    if len(set(expand_paths(inputs)) & set(expand_paths(outputs))) > 0:
+        msg('Outputs are among the inputs, running without the cache')
+        return subprocess.call(command,shell=True,executable='/bin/bash')
+
+    if not os.path.isdir(cachedir):
+        os.makedirs(cachedir,exist_ok=True)
+
+    memo = load_memo(cachedir)
+    key = cache_key(command,inputs,memo)
+    save_memo(cachedir,memo)
+
+    if key is None:
+        msg('Missing inputs, running without the cache')
+        return subprocess.call(command,shell=True,executable='/bin/bash')
+
+    if restore(cachedir,key):
+        msg('Cache hit for '+key+', not running command')
+        return 0
+
+    msg('Cache miss for '+key+', running command')
+    returncode = subprocess.call(command,shell=True,executable='/bin/bash')
+    if returncode == 0:
+        if store(cachedir,key,command,outputs):
+            evict(cachedir,quota,keep=cachedir+'/'+key)
+    return returncode
+
+
+def main():
+
+    parser = OptionParser(usage = '%prog [options] command')
+    parser.add_option('--inputs', dest = 'inputs', help = 'Comma-separated list of input files, folders or glob patterns', default = '')
+    parser.add_option('--outputs', dest = 'outputs', help = 'Comma-separated list of output files, folders or glob patterns', default = '')
+    parser.add_option('--cachedir', dest = 'cachedir', help = 'Cache folder (default = CACHE)', default = 'CACHE')
+    parser.add_option('--quota', dest = 'quota', help = 'Maximum size of the cache in GB (default = 100)', default = 100)
+    (options,args) = parser.parse_args()
+
+    if len(args) != 1 or options.outputs == '':
+        parser.print_help()
+        sys.exit(1)
+
+    inputs = [x for x in options.inputs.split(',') if x != '']
+    outputs = [x for x in options.outputs.split(',') if x != '']
+
+    returncode = run_cached(args[0],inputs,outputs,options.cachedir,float(options.quota))
+    sys.exit(returncode)
+
+
+if __name__ == '__main__':
+
+    main()
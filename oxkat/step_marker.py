@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import glob
+import hashlib
+import json
+import os
+import os.path as o
+import re
+import sys
+import time
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.resources import table_nrows, table_columns, table_column_managers
+
+
+# ------------------------------------------------------------------------
+#
+# Step completion markers for resumable runs
+#
+# When a job succeeds it records a marker holding its command and the
+# fingerprints of its declared inputs and outputs. When the recipe is
+# regenerated, a step whose marker matches the current command, and whose
+# inputs and outputs still carry the recorded fingerprints, can be left
+# out.
+#
+# Input fingerprints have to see changes to the data (e.g. an MS that was
+# flagged again by an earlier recipe), so they hold the size and
+# modification time of every file that the step reads:
+#
+#   file             : size and modification time
+#   Measurement Set  : the row count and the data manager of each column
+#                      read (from table.dat), the files of the sub-tables
+#                      and the data files of the columns that the step
+#                      reads plus the metadata columns. Lock files and the
+#                      HISTORY sub-table are left out. If the columns are
+#                      not declared or cannot be found in table.dat, every
+#                      data file of the main table is used instead.
+#   other directory  : size and modification time of each file in it
+#
+# generate_jobs passes the columns of step['input_columns'] less those in
+# the step['output_columns'] of the steps downstream of it in the recipe.
+#
+# Output fingerprints only look at structure, so that later steps that
+# work in place on an output (e.g. filling NaNs in model images, or
+# writing a new column of an existing MS) do not invalidate the step
+# that made it:
+#
+#   FITS file        : SHA1 of the header blocks and the file size
+#   Measurement Set  : row count and the names of the sub-tables
+#   other directory  : number of files and their total size
+#   other file       : size and modification time
+#
+# So a step that reads DATA and FLAG is not invalidated when a later step
+# writes CORRECTED_DATA and FLAG or adds MODEL_DATA to the same MS, while
+# flagging the MS again in an earlier recipe does invalidate it.
+#
+# This module only uses the standard library, as the recording is done
+# outside the containers.
+#
+
+
+def msg(txt):
+    stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+    print(stamp+txt)
+
+
+def marker_name(step_id,syscall):
+
+    """ Marker file name for a step, unique to its command """
+
+    digest = hashlib.sha1(syscall.encode()).hexdigest()[0:10]
+    return step_id+'_'+digest
+
+
+def fits_header_hash(fitsfile):
+
+    """ SHA1 of the primary header of fitsfile, read block by block up
+    to the END card
+    """
+
+    sha = hashlib.sha1()
+    f = open(fitsfile,'rb')
+    while True:
+        block = f.read(2880)
+        if len(block) < 2880:
+            break
+        sha.update(block)
+        cards = [block[i:i+80] for i in range(0,2880,80)]
+        if any(card[0:8] == b'END     ' for card in cards):
+            break
+    f.close()
+    return sha.hexdigest()
+
+
+def dir_size(indir):
+
+    """ Returns the number of files in indir and their total size """
+
+    nfiles = 0
+    size = 0
+    for root,dirs,files in os.walk(indir):
+        for ff in files:
+            nfiles += 1
+            size += os.path.getsize(os.path.join(root,ff))
+    return nfiles,size
+
+
+# Columns that every step reading an MS depends on
+metadata_columns = ['TIME','UVW','ANTENNA1','ANTENNA2','FIELD_ID','DATA_DESC_ID','FLAG_ROW']
+
+# Files and sub-tables that do not hold data that steps read
+ignored_files = ['table.lock']
+ignored_subtables = ['HISTORY']
+
+
+def manager_files(path,managers):
+    # Main table data files of the data managers with sequence numbers
+    # in managers, e.g. table.f3, table.f3i and table.f3_TSM0 for 3
+    files = []
+    for name in os.listdir(path):
+        match = re.match(r'table\.f(\d+)',name)
+        if match is not None and int(match.group(1)) in managers:
+            files.append(name)
+    return files
+
+
+def ms_fingerprint(path,columns=None):
+
+    """ Content fingerprint of a Measurement Set for a step that reads
+    columns (None if not declared), see the notes at the top
+    """
+
+    tabledat = os.path.join(path,'table.dat')
+    managers = {}
+    if columns is not None:
+        # Declared columns that the MS does not have are not read
+        columns = table_columns(tabledat,columns)
+        managers = table_column_managers(tabledat,columns+metadata_columns)
+    seqnrs = set(managers.values())
+    mapped = (len(managers) > 0 and all(col in managers for col in columns) and
+                all(len(manager_files(path,[seqnr])) > 0 for seqnr in seqnrs))
+
+    files = {}
+    for root,dirs,names in os.walk(path):
+        relroot = os.path.relpath(root,path)
+        if relroot.split(os.sep)[0] in ignored_subtables:
+            continue
+        if relroot == '.':
+            if mapped:
+                names = manager_files(path,seqnrs)
+            else:
+                names = [name for name in names if name.startswith('table.f')]
+        for name in names:
+            if name in ignored_files:
+                continue
+            st = os.stat(os.path.join(root,name))
+            files[os.path.normpath(os.path.join(relroot,name))] = [st.st_size,st.st_mtime_ns]
+    return {'nrows':table_nrows(tabledat),'columns':managers if mapped else {},'files':files}
+
+
+def content_fingerprint(path,columns=None):
+
+    """ Size and modification time of path, or of every file below it
+    if it is a directory (for an MS only those that a step reading
+    columns depends on, all of them if columns is None), None if missing
+    """
+
+    if os.path.isdir(path):
+        if os.path.isfile(os.path.join(path,'table.dat')):
+            return ms_fingerprint(path,columns)
+        files = {}
+        for root,dirs,names in os.walk(path):
+            for name in names:
+                if name in ignored_files:
+                    continue
+                st = os.stat(os.path.join(root,name))
+                files[os.path.relpath(os.path.join(root,name),path)] = [st.st_size,st.st_mtime_ns]
+        return files
+    elif os.path.isfile(path):
+        st = os.stat(path)
+        return {'size':st.st_size,'mtime':st.st_mtime_ns}
+    return None
+
+
+def fingerprint(path):
+
+    """ Structural fingerprint of a single file or directory, None if
+    missing
+    """
+
+    if os.path.isdir(path):
+        if os.path.isfile(os.path.join(path,'table.dat')):
+            subtables = [name for name in os.listdir(path) if os.path.isdir(os.path.join(path,name))]
+            return {'nrows':table_nrows(os.path.join(path,'table.dat')),'subtables':sorted(subtables)}
+        else:
+            nfiles,size = dir_size(path)
+            return {'nfiles':nfiles,'size':size}
+    elif os.path.isfile(path):
+        if path.lower().endswith('.fits'):
+            return {'header':fits_header_hash(path),'size':os.path.getsize(path)}
+        else:
+            return {'size':os.path.getsize(path),'mtime':int(os.path.getmtime(path))}
+    return None
+
+
+def fingerprint_paths(paths,content=False,columns=None):
+
+    """ Dict of path : fingerprint, with glob patterns expanded.
+    A pattern or path that matches nothing maps to None. content = True
+    gives the content fingerprints used for inputs, for which columns
+    are the MS columns that the step reads.
+    """
+
+    prints = {}
+    for pattern in paths:
+        matches = sorted(glob.glob(pattern.rstrip('/')))
+        if len(matches) == 0:
+            prints[pattern] = None
+        for path in matches:
+            if content:
+                prints[path] = content_fingerprint(path,columns)
+            else:
+                prints[path] = fingerprint(path)
+    return prints
+
+
+def write_spec(markers_dir,step_id,syscall,inputs=[],outputs=[],columns=None):
+
+    """ Write the spec for a step's marker at setup time, returns the
+    spec file name for the job to pass to record
+    """
+
+    name = marker_name(step_id,syscall)
+    spec_file = markers_dir+'/'+name+'.spec.json'
+    spec = {'id':step_id,
+        'syscall':syscall,
+        'inputs':list(inputs),
+        'outputs':list(outputs),
+        'columns':columns,
+        'marker':markers_dir+'/'+name+'.json'}
+    f = open(spec_file,'w')
+    json.dump(spec,f,indent=1)
+    f.close()
+    return spec_file
+
+
+def record(spec_file):
+
+    """ Record the completion marker described by spec_file """
+
+    with open(spec_file) as f:
+        spec = json.load(f)
+
+    marker = {'id':spec['id'],
+        'syscall':spec['syscall'],
+        'completed':time.strftime('%Y-%m-%d %H:%M:%S'),
+        'inputs':fingerprint_paths(spec['inputs'],content=True,columns=spec.get('columns')),
+        'outputs':fingerprint_paths(spec['outputs'])}
+
+    missing = [x for x in marker['outputs'] if marker['outputs'][x] is None]
+    if len(missing) > 0:
+        msg('Not recording completion of '+spec['id']+', missing outputs: '+', '.join(missing))
+        return False
+
+    tmp_file = spec['marker']+'.tmp'
+    f = open(tmp_file,'w')
+    json.dump(marker,f,indent=1)
+    f.close()
+    os.replace(tmp_file,spec['marker'])
+    msg('Recorded completion of '+spec['id']+' in '+spec['marker'])
+    return True
+
+
+def is_complete(markers_dir,step_id,syscall,inputs,outputs,columns=None):
+
+    """ True if the step has a marker for its current command, and all of
+    its inputs and outputs still match the recorded fingerprints. Steps
+    that declare no inputs or no outputs are never considered complete,
+    as a change to the data they work on could not be seen. columns are
+    the MS columns that the step reads, None if not declared.
+    """
+
+    if len(inputs) == 0 or len(outputs) == 0:
+        return False
+    marker_file = markers_dir+'/'+marker_name(step_id,syscall)+'.json'
+    if not os.path.isfile(marker_file):
+        return False
+    try:
+        with open(marker_file) as f:
+            marker = json.load(f)
+    except ValueError:
+        return False
+    if marker.get('syscall') != syscall:
+        return False
+    current = fingerprint_paths(inputs,content=True,columns=columns)
+    if None in current.values() or current != marker.get('inputs'):
+        return False
+    current = fingerprint_paths(outputs)
+    if None in current.values():
+        return False
+    return current == marker.get('outputs')
+
+
+def main():
+
+    if len(sys.argv) != 3 or sys.argv[1] != 'record':
+        print('Usage: step_marker.py record spec.json')
+        sys.exit(1)
+
+    # A marker that cannot be recorded only means the step will be run
+    # again next time, so this never fails the job
+    record(sys.argv[2])
+
+
+if __name__ == '__main__':
+
+    main()
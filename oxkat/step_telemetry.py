@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from optparse import OptionParser
+
+
+# ------------------------------------------------------------------------
+#
+# Run a step and record its resource usage
+#
+# The command is run in a shell and, once it has finished, the following
+# are written to a JSON file in the output folder, along with the
+# resources that were requested for the step:
+#
+#   wall time       : elapsed seconds
+#   CPU time        : user + system seconds of all descendant processes
+#   peak RSS        : largest resident set of any descendant process
+#   bytes read /    : storage I/O of all descendant processes, from
+#   written           /proc/self/io (reaped children are accumulated
+#                     into their parent), or from the block counts of
+#                     getrusage where /proc is not available
+#
+# Processes started inside singularity containers are descendants of
+# this one, so they are included. tools/job_report.py aggregates the
+# records.
+#
+# This module only uses the standard library, as it runs outside the
+# containers.
+#
+
+
+def read_proc_io():
+    io = {}
+    try:
+        f = open('/proc/self/io','r')
+        for line in f:
+            key,value = line.split(':')
+            io[key.strip()] = int(value)
+        f.close()
+    except (IOError,OSError,ValueError):
+        pass
+    return io
+
+
+def allocated_cpus():
+    # CPUs given to the job by the scheduler, or the CPUs on the machine
+    for env in ['SLURM_CPUS_PER_TASK','PBS_NUM_PPN','NCPUS']:
+        if os.environ.get(env,'').isdigit():
+            return int(os.environ[env])
+    if hasattr(os,'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
+def run_step(command,step_id,recipe,outdir,req_cpus=0,req_mem=0.0,req_hours=0.0):
+
+    """ Run command and write its telemetry record, returns the exit
+    code of the command
+    """
+
+    io0 = read_proc_io()
+    t0 = time.time()
+    returncode = subprocess.call(command,shell=True,executable='/bin/bash')
+    wall = time.time()-t0
+    io1 = read_proc_io()
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    cpus = allocated_cpus()
+    cpu_time = usage.ru_utime+usage.ru_stime
+    if 'read_bytes' in io1:
+        read_bytes = io1['read_bytes']-io0.get('read_bytes',0)
+        write_bytes = io1['write_bytes']-io0.get('write_bytes',0)
+    else:
+        read_bytes = usage.ru_inblock*512
+        write_bytes = usage.ru_oublock*512
+
+    record = {'id':step_id,
+        'recipe':recipe,
+        'host':os.uname()[1],
+        'job':os.environ.get('SLURM_JOB_ID',os.environ.get('PBS_JOBID','')),
+        'start':time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(t0)),
+        'returncode':returncode,
+        'wall_s':round(wall,1),
+        'cpu_s':round(cpu_time,1),
+        'cpus':cpus,
+        'cpu_util':round(cpu_time/max(wall*cpus,1e-6),3),
+        'peak_rss_gb':round(usage.ru_maxrss*1024/1e9,3),
+        'read_gb':round(read_bytes/1e9,3),
+        'write_gb':round(write_bytes/1e9,3),
+        'req_cpus':int(req_cpus),
+        'req_mem_gb':float(req_mem),
+        'req_hours':float(req_hours)}
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir,exist_ok=True)
+    outfile = outdir+'/'+recipe+'_'+step_id+'_'+time.strftime('%Y%m%d-%H%M%S',time.localtime(t0))+'.json'
+    f = open(outfile,'w')
+    json.dump(record,f,indent=1)
+    f.close()
+
+    print('****TELEMETRY '+step_id+' wall '+str(record['wall_s'])+' s, CPU '+str(int(100*record['cpu_util']))+
+                '%, peak RSS '+str(record['peak_rss_gb'])+' GB, read '+str(record['read_gb'])+' GB, written '+
+                str(record['write_gb'])+' GB',flush=True)
+
+    return returncode
+
+
+def main():
+
+    parser = OptionParser(usage = '%prog [options] command')
+    parser.add_option('--id', dest = 'step_id', help = 'Step ID', default = 'step')
+    parser.add_option('--recipe', dest = 'recipe', help = 'Recipe name', default = 'recipe')
+    parser.add_option('--outdir', dest = 'outdir', help = 'Folder for the telemetry records (default = LOGS/telemetry)', default = 'LOGS/telemetry')
+    parser.add_option('--cpus', dest = 'cpus', help = 'Requested CPUs', default = 0)
+    parser.add_option('--mem', dest = 'mem', help = 'Requested memory in GB', default = 0)
+    parser.add_option('--hours', dest = 'hours', help = 'Requested wall time in hours', default = 0)
+    (options,args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.print_help()
+        sys.exit(1)
+
+    returncode = run_step(args[0],options.step_id,options.recipe,options.outdir,
+                options.cpus,float(options.mem),float(options.hours))
+    sys.exit(returncode)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -89,53 +89,7 @@ def main():
     submit_file = 'submit_info_job.sh'
     kill_file = cfg.SCRIPTS+'/kill_info_job.sh'
 
-    f = open(submit_file,'w')
-    f.write('#!/usr/bin/env bash\n')
-    f.write('export SINGULARITY_BINDPATH='+cfg.BINDPATH+'\n')
-
-    id_list = []
-
-    for step in steps:
-
-        step_id = step['id']
-        id_list.append(step_id)
-        if step['dependency'] is not None:
-            dependency = steps[step['dependency']]['id']
-        else:
-            dependency = None
-        syscall = step['syscall']
-        if 'slurm_config' in step.keys():
-            slurm_config = step['slurm_config']
-        else:
-            slurm_config = cfg.SLURM_DEFAULTS
-        if 'pbs_config' in step.keys():
-            pbs_config = step['pbs_config']
-        else:
-            pbs_config = cfg.PBS_DEFAULTS
-        comment = step['comment']
-
-        run_command = gen.job_handler(syscall = syscall,
-                        jobname = step_id,
-                        infrastructure = INFRASTRUCTURE,
-                        dependency = dependency,
-                        slurm_config = slurm_config,
-                        pbs_config = pbs_config)
-
-
-        f.write('\n# '+comment+'\n')
-        f.write(run_command)
-
-
-    if INFRASTRUCTURE == 'idia' or INFRASTRUCTURE == 'hippo':
-        kill = '\necho "scancel "$'+'" "$'.join(id_list)+' > '+kill_file+'\n'
-        f.write(kill)
-    elif INFRASTRUCTURE == 'chpc':
-        kill = '\necho "qdel "$'+'" "$'.join(id_list)+' > '+kill_file+'\n'
-        f.write(kill)
-    
-    f.close()
-
-    gen.make_executable(submit_file)
+    gen.write_submit_file(submit_file,[(steps,kill_file,'')],INFRASTRUCTURE)
 
     gen.print_spacer()
     print(gen.col('Run file')+submit_file)
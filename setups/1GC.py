@@ -34,6 +34,7 @@ def main():
     # ------------------------------------------------------------------------------
 
 
+    gen.setup_dir(cfg.FLAGSTATS)
     gen.setup_dir(cfg.LOGS)
     gen.setup_dir(cfg.SCRIPTS)
     gen.setup_dir(cfg.GAINTABLES)
@@ -103,6 +104,17 @@ def main():
 
     step = {}
     step['step'] = 3
+    step['comment'] = 'Flag statistics of all fields after auto-flagging the calibrators'
+    step['dependency'] = 2
+    step['id'] = 'FSTAT'+code
+    syscall = CONTAINER_RUNNER+OWLCAT_CONTAINER+' ' if USE_SINGULARITY else ''
+    syscall += 'python3 '+cfg.TOOLS+'/flag_stats.py --outdir '+cfg.FLAGSTATS+' --tag autoflag '+myms
+    step['syscall'] = syscall
+    steps.append(step)
+
+
+    step = {}
+    step['step'] = 4
     step['comment'] = 'Generate reference calibration solutions and apply to target(s)'
     step['dependency'] = 2
     step['id'] = 'CL1GC'+code
@@ -113,9 +125,9 @@ def main():
 
 
     step = {}
-    step['step'] = 4
+    step['step'] = 5
     step['comment'] = 'Plot the gain solutions'
-    step['dependency'] = 3
+    step['dependency'] = 4
     step['id'] = 'PLTAB'+code
     syscall = CONTAINER_RUNNER+RAGAVI_CONTAINER+' ' if USE_SINGULARITY else ''
     syscall += 'python3 '+cfg.OXKAT+'/PLOT_gaintables.py cal_1GC_*'
@@ -124,9 +136,9 @@ def main():
 
 
     step = {}
-    step['step'] = 5
+    step['step'] = 6
     step['comment'] = 'Split the corrected target data'
-    step['dependency'] = 3
+    step['dependency'] = 4
     step['id'] = 'SPTRG'+code
     syscall = CONTAINER_RUNNER+CASA_CONTAINER+' ' if USE_SINGULARITY else ''
     syscall += gen.generate_syscall_casa(casascript=cfg.OXKAT+'/1GC_09_casa_split_targets.py')
@@ -135,9 +147,9 @@ def main():
 
 
     step = {}
-    step['step'] = 6
+    step['step'] = 7
     step['comment'] = 'Plot the corrected calibrator visibilities'
-    step['dependency'] = 5
+    step['dependency'] = 6
     step['id'] = 'PLVIS'+code
     syscall = CONTAINER_RUNNER+SHADEMS_CONTAINER+' ' if USE_SINGULARITY else ''
     syscall += 'python3 '+cfg.OXKAT+'/1GC_10_plot_visibilities.py'
@@ -155,53 +167,7 @@ def main():
     submit_file = 'submit_1GC_jobs.sh'
     kill_file = cfg.SCRIPTS+'/kill_1GC_jobs.sh'
 
-    f = open(submit_file,'w')
-    f.write('#!/usr/bin/env bash\n')
-    f.write('export SINGULARITY_BINDPATH='+cfg.BINDPATH+'\n')
-
-    id_list = []
-
-    for step in steps:
-
-        step_id = step['id']
-        id_list.append(step_id)
-        if step['dependency'] is not None:
-            dependency = steps[step['dependency']]['id']
-        else:
-            dependency = None
-        syscall = step['syscall']
-        if 'slurm_config' in step.keys():
-            slurm_config = step['slurm_config']
-        else:
-            slurm_config = cfg.SLURM_DEFAULTS
-        if 'pbs_config' in step.keys():
-            pbs_config = step['pbs_config']
-        else:
-            pbs_config = cfg.PBS_DEFAULTS
-        comment = step['comment']
-
-        run_command = gen.job_handler(syscall = syscall,
-                        jobname = step_id,
-                        infrastructure = INFRASTRUCTURE,
-                        dependency = dependency,
-                        slurm_config = slurm_config,
-                        pbs_config = pbs_config)
-
-
-        f.write('\n# '+comment+'\n')
-        f.write(run_command)
-
-
-    if INFRASTRUCTURE == 'idia' or INFRASTRUCTURE == 'hippo':
-        kill = '\necho "scancel "$'+'" "$'.join(id_list)+' > '+kill_file+'\n'
-        f.write(kill)
-    elif INFRASTRUCTURE == 'chpc':
-        kill = '\necho "qdel "$'+'" "$'.join(id_list)+' > '+kill_file+'\n'
-        f.write(kill)
-    
-    f.close()
-
-    gen.make_executable(submit_file)
+    gen.write_submit_file(submit_file,[(steps,kill_file,'')],INFRASTRUCTURE)
 
     gen.print_spacer()
     print(gen.col('Run file')+submit_file)
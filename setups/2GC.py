@@ -137,8 +137,13 @@ def main():
             step['comment'] = 'Run wsclean, masked deconvolution of the DATA column of '+myms
             step['dependency'] = None
             step['id'] = 'WSDMA'+code
+            step['inputs'] = [myms]
+            step['outputs'] = [data_img_prefix+'-MFS-image.fits']
+            step['input_columns'] = ['DATA','FLAG','WEIGHT_SPECTRUM']
+            step['output_columns'] = ['MODEL_DATA']
             step['slurm_config'] = cfg.SLURM_WSCLEAN
             step['pbs_config'] = cfg.PBS_WSCLEAN
+            gen.right_size(step,'wsclean',myms,npix=cfg.WSC_IMSIZE,nchanout=cfg.WSC_CHANNELSOUT)
             absmem = gen.absmem_helper(step,INFRASTRUCTURE,cfg.WSC_ABSMEM)
             syscall = CONTAINER_RUNNER+WSCLEAN_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += gen.generate_syscall_wsclean(mslist = [myms],
@@ -146,7 +151,8 @@ def main():
                         datacol = 'DATA',
                         mask = mask,
                         automask = automask,
-                        absmem = absmem)
+                        absmem = absmem,
+                        threads = gen.thread_count(step,INFRASTRUCTURE))
             step['syscall'] = syscall
             steps.append(step)
 
@@ -156,6 +162,10 @@ def main():
             step['comment'] = 'Apply primary beam correction to '+targetname+' 1GC image'
             step['dependency'] = 0
             step['id'] = 'PBCO1'+code
+            step['inputs'] = [data_img_prefix+'-MFS-image.fits']
+            step['outputs'] = [data_img_prefix+'-MFS-image.pbcor.fits',data_img_prefix+'-MFS-image.pb.fits',data_img_prefix+'-MFS-image.wt.fits']
+            step['cache'] = True
+            step['pack'] = True
             syscall = CONTAINER_RUNNER+ASTROPY_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += 'python3 '+TOOLS+'/pbcor_katbeam.py --band '+band[0]+' '+data_img_prefix+'-MFS-image.fits'
             step['syscall'] = syscall
@@ -167,12 +177,18 @@ def main():
             step['comment'] = 'Run CubiCal with f-slope solver'
             step['dependency'] = 0
             step['id'] = 'CL2GC'+code
+            step['inputs'] = [myms]
+            step['outputs'] = [k_outdir]
+            step['input_columns'] = ['DATA','MODEL_DATA','FLAG','WEIGHT_SPECTRUM']
+            step['output_columns'] = ['CORRECTED_DATA','FLAG','BITFLAG']
             step['slurm_config'] = cfg.SLURM_WSCLEAN
             step['pbs_config'] = cfg.PBS_WSCLEAN
+            gen.right_size(step,'cubical',myms)
             syscall = CONTAINER_RUNNER+CUBICAL_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += gen.generate_syscall_cubical(parset = cfg.CAL_2GC_DELAYCAL_PARSET,
                     myms = myms,
-                    extra_args = '--out-dir '+k_outdir+' --out-name '+k_outname+' --k-save-to '+k_saveto)
+                    extra_args = '--out-dir '+k_outdir+' --out-name '+k_outname+' --k-save-to '+k_saveto,
+                    ncpu = gen.thread_count(step,INFRASTRUCTURE))
             step['syscall'] = syscall
             steps.append(step)
 
@@ -182,8 +198,13 @@ def main():
             step['comment'] = 'Run wsclean, masked deconvolution of the CORRECTED_DATA column of '+myms
             step['dependency'] = 2
             step['id'] = 'WSCMA'+code
+            step['inputs'] = [myms]
+            step['outputs'] = [corr_img_prefix+'-MFS-image.fits']
+            step['input_columns'] = ['CORRECTED_DATA','FLAG','WEIGHT_SPECTRUM']
+            step['output_columns'] = ['MODEL_DATA']
             step['slurm_config'] = cfg.SLURM_WSCLEAN
             step['pbs_config'] = cfg.PBS_WSCLEAN
+            gen.right_size(step,'wsclean',myms,npix=cfg.WSC_IMSIZE,nchanout=cfg.WSC_CHANNELSOUT)
             absmem = gen.absmem_helper(step,INFRASTRUCTURE,cfg.WSC_ABSMEM)
             syscall = CONTAINER_RUNNER+WSCLEAN_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += gen.generate_syscall_wsclean(mslist=[myms],
@@ -191,7 +212,8 @@ def main():
                         datacol = 'CORRECTED_DATA',
                         mask = mask,
                         automask = automask,
-                        absmem = absmem)
+                        absmem = absmem,
+                        threads = gen.thread_count(step,INFRASTRUCTURE))
             step['syscall'] = syscall
             steps.append(step)
 
@@ -201,6 +223,10 @@ def main():
             step['comment'] = 'Refine the cleaning mask for '+targetname+', crop for use with DDFacet'
             step['dependency'] = 3
             step['id'] = 'MASK1'+code
+            step['inputs'] = [corr_img_prefix+'-MFS-image.fits']
+            step['outputs'] = [corr_img_prefix+'-MFS-image.mask1.fits',corr_img_prefix+'-MFS-image.mask1.zoom'+str(cfg.DDF_NPIX)+'.fits']
+            step['cache'] = True
+            step['pack'] = True
             syscall = CONTAINER_RUNNER+OWLCAT_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += gen.generate_syscall_makemask(restoredimage = corr_img_prefix+'-MFS-image.fits',
                                     outfile = corr_img_prefix+'-MFS-image.mask1.fits',
@@ -215,6 +241,10 @@ def main():
             step['comment'] = 'Apply primary beam correction to '+targetname+' 2GC image'
             step['dependency'] = 3
             step['id'] = 'PBCO2'+code
+            step['inputs'] = [corr_img_prefix+'-MFS-image.fits']
+            step['outputs'] = [corr_img_prefix+'-MFS-image.pbcor.fits',corr_img_prefix+'-MFS-image.pb.fits',corr_img_prefix+'-MFS-image.wt.fits']
+            step['cache'] = True
+            step['pack'] = True
             syscall = CONTAINER_RUNNER+ASTROPY_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += 'python3 '+TOOLS+'/pbcor_katbeam.py --band '+band[0]+' '+corr_img_prefix+'-MFS-image.fits'
             step['syscall'] = syscall
@@ -235,63 +265,7 @@ def main():
 
     submit_file = 'submit_2GC_jobs.sh'
 
-    f = open(submit_file,'w')
-    f.write('#!/usr/bin/env bash\n')
-    f.write('export SINGULARITY_BINDPATH='+cfg.BINDPATH+'\n')
-
-    for content in target_steps:  
-        steps = content[0]
-        kill_file = content[1]
-        targetname = content[2]
-        id_list = []
-
-        f.write('\n#---------------------------------------\n')
-        f.write('# '+targetname)
-        f.write('\n#---------------------------------------\n')
-
-        for step in steps:
-
-            step_id = step['id']
-            id_list.append(step_id)
-            if step['dependency'] is not None:
-                dependency = steps[step['dependency']]['id']
-            else:
-                dependency = None
-            syscall = step['syscall']
-            if 'slurm_config' in step.keys():
-                slurm_config = step['slurm_config']
-            else:
-                slurm_config = cfg.SLURM_DEFAULTS
-            if 'pbs_config' in step.keys():
-                pbs_config = step['pbs_config']
-            else:
-                pbs_config = cfg.PBS_DEFAULTS
-            comment = step['comment']
-
-            run_command = gen.job_handler(syscall = syscall,
-                            jobname = step_id,
-                            infrastructure = INFRASTRUCTURE,
-                            dependency = dependency,
-                            slurm_config = slurm_config,
-                            pbs_config = pbs_config)
-
-
-            f.write('\n# '+comment+'\n')
-            f.write(run_command)
-
-        if INFRASTRUCTURE != 'node':
-            f.write('\n# Generate kill script for '+targetname+'\n')
-        if INFRASTRUCTURE == 'idia' or INFRASTRUCTURE == 'hippo':
-            kill = 'echo "scancel "$'+'" "$'.join(id_list)+' > '+kill_file+'\n'
-            f.write(kill)
-        elif INFRASTRUCTURE == 'chpc':
-            kill = 'echo "qdel "$'+'" "$'.join(id_list)+' > '+kill_file+'\n'
-            f.write(kill)
-
-        
-    f.close()
-
-    gen.make_executable(submit_file)
+    gen.write_submit_file(submit_file,target_steps,INFRASTRUCTURE)
 
     gen.print_spacer()
     print(gen.col('Run file')+submit_file)
@@ -157,12 +157,16 @@ def main():
             step['comment'] = 'Run DDFacet, masked deconvolution of CORRECTED_DATA column of '+myms
             step['dependency'] = None
             step['id'] = 'DDCMA'+code
+            step['inputs'] = [myms]
+            step['outputs'] = [ddf_img_prefix+'.app.restored.fits',ddf_img_prefix+'.DicoModel']
+            step['input_columns'] = ['CORRECTED_DATA','FLAG','WEIGHT_SPECTRUM']
             step['slurm_config'] = cfg.SLURM_HIGHMEM
             step['pbs_config'] = cfg.PBS_WSCLEAN
+            gen.right_size(step,'ddfacet',myms,npix=cfg.DDF_NPIX,nchanout=cfg.DDF_NBAND)
             syscall = CONTAINER_RUNNER+DDFACET_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += gen.generate_syscall_ddfacet(mspattern=myms,
                         imgname=ddf_img_prefix,
-                        ncpu=myNCPU,
+                        ncpu=gen.thread_count(step,INFRASTRUCTURE,myNCPU),
                         mask=mask,
                         sparsification='50,20,5,2')
             step['syscall'] = syscall
@@ -172,8 +176,12 @@ def main():
             step = {}
             step['step'] = 1
             step['comment'] = 'Convert the DS9 region into a numpy file that killMS will recognise'
-            step['dependency'] = 0
+            step['dependency'] = None
             step['id'] = 'RG2NP'+code
+            step['inputs'] = [CAL_3GC_FACET_REGION]
+            step['outputs'] = [CAL_3GC_FACET_REGION+'.npy']
+            step['cache'] = True
+            step['pack'] = True
             syscall = CONTAINER_RUNNER+DDFACET_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += 'python3 '+TOOLS+'/reg2npy.py '+CAL_3GC_FACET_REGION
             step['syscall'] = syscall
@@ -183,15 +191,16 @@ def main():
             step = {}
             step['step'] = 2
             step['comment'] = 'Run killMS'
-            step['dependency'] = 1
+            step['dependency'] = [0,1]
             step['id'] = 'KILMS'+code
             step['slurm_config'] = cfg.SLURM_HIGHMEM
             step['slurm_exclude'] = 'highmem-003' 
             step['pbs_config'] = cfg.PBS_WSCLEAN
+            gen.right_size(step,'killms',myms)
             syscall = CONTAINER_RUNNER+KILLMS_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += gen.generate_syscall_killms(myms=myms,
                         baseimg=ddf_img_prefix,
-                        ncpu=myNCPU,
+                        ncpu=gen.thread_count(step,INFRASTRUCTURE,myNCPU),
                         outsols='killms-'+cfg.KMS_SOLVERTYPE,
                         nodesfile=CAL_3GC_FACET_REGION+'.npy')
             step['syscall'] = syscall
@@ -214,13 +223,17 @@ def main():
             step['comment'] = 'Run DDFacet on CORRECTED_DATA of '+myms+', applying killMS solutions'
             step['dependency'] = 2
             step['id'] = 'DDKMA'+code
+            step['inputs'] = [myms]
+            step['outputs'] = [kms_img_prefix+'.app.restored.fits']
+            step['input_columns'] = ['CORRECTED_DATA','FLAG','WEIGHT_SPECTRUM']
             step['slurm_config'] = cfg.SLURM_HIGHMEM
             step['pbs_config'] = cfg.PBS_WSCLEAN
+            gen.right_size(step,'ddfacet',myms,npix=cfg.DDF_NPIX,nchanout=cfg.DDF_NBAND)
             syscall = CONTAINER_RUNNER+DDFACET_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += gen.generate_syscall_ddfacet(mspattern=myms,
                         imgname=kms_img_prefix,
                         chunkhours=1,
-                        ncpu=myNCPU,
+                        ncpu=gen.thread_count(step,INFRASTRUCTURE,myNCPU),
                         initdicomodel=ddf_img_prefix+'.DicoModel',
                         hogbom_maxmajoriter=0,
                         hogbom_maxminoriter=1000,
@@ -235,6 +248,10 @@ def main():
             step['comment'] = 'Apply primary beam correction to '+targetname+' 2GC DDFacet image'
             step['dependency'] = 0
             step['id'] = 'PBCO1'+code
+            step['inputs'] = [ddf_img_prefix+'.app.restored.fits']
+            step['outputs'] = [ddf_img_prefix+'.app.restored.pbcor.fits',ddf_img_prefix+'.app.restored.pb.fits',ddf_img_prefix+'.app.restored.wt.fits']
+            step['cache'] = True
+            step['pack'] = True
             syscall = CONTAINER_RUNNER+ASTROPY_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += 'python3 '+TOOLS+'/pbcor_katbeam.py --band '+band[0]+' --freqaxis 4 '+ddf_img_prefix+'.app.restored.fits'
             step['syscall'] = syscall
@@ -246,6 +263,10 @@ def main():
             step['comment'] = 'Apply primary beam correction to '+targetname+' 3GC DDFacet image'
             step['dependency'] = 4
             step['id'] = 'PBCO2'+code
+            step['inputs'] = [kms_img_prefix+'.app.restored.fits']
+            step['outputs'] = [kms_img_prefix+'.app.restored.pbcor.fits',kms_img_prefix+'.app.restored.pb.fits',kms_img_prefix+'.app.restored.wt.fits']
+            step['cache'] = True
+            step['pack'] = True
             syscall = CONTAINER_RUNNER+ASTROPY_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += 'python3 '+TOOLS+'/pbcor_katbeam.py --band '+band[0]+' --freqaxis 4 '+kms_img_prefix+'.app.restored.fits'
             step['syscall'] = syscall
@@ -265,63 +286,7 @@ def main():
 
     submit_file = 'submit_3GC_facet_jobs.sh'
 
-    f = open(submit_file,'w')
-    f.write('#!/usr/bin/env bash\n')
-    f.write('export SINGULARITY_BINDPATH='+cfg.BINDPATH+'\n')
-
-    for content in target_steps:  
-        steps = content[0]
-        kill_file = content[1]
-        targetname = content[2]
-        id_list = []
-
-        f.write('\n#---------------------------------------\n')
-        f.write('# '+targetname)
-        f.write('\n#---------------------------------------\n')
-
-        for step in steps:
-
-            step_id = step['id']
-            id_list.append(step_id)
-            if step['dependency'] is not None:
-                dependency = steps[step['dependency']]['id']
-            else:
-                dependency = None
-            syscall = step['syscall']
-            if 'slurm_config' in step.keys():
-                slurm_config = step['slurm_config']
-            else:
-                slurm_config = cfg.SLURM_DEFAULTS
-            if 'pbs_config' in step.keys():
-                pbs_config = step['pbs_config']
-            else:
-                pbs_config = cfg.PBS_DEFAULTS
-            comment = step['comment']
-
-            run_command = gen.job_handler(syscall = syscall,
-                            jobname = step_id,
-                            infrastructure = INFRASTRUCTURE,
-                            dependency = dependency,
-                            slurm_config = slurm_config,
-                            pbs_config = pbs_config)
-
-
-            f.write('\n# '+comment+'\n')
-            f.write(run_command)
-
-        if INFRASTRUCTURE != 'node':
-            f.write('\n# Generate kill script for '+targetname+'\n')
-        if INFRASTRUCTURE == 'idia' or INFRASTRUCTURE == 'hippo':
-            kill = 'echo "scancel "$'+'" "$'.join(id_list)+' > '+kill_file+'\n'
-            f.write(kill)
-        elif INFRASTRUCTURE == 'chpc':
-            kill = 'echo "qdel "$'+'" "$'.join(id_list)+' > '+kill_file+'\n'
-            f.write(kill)
-
-        
-    f.close()
-
-    gen.make_executable(submit_file)
+    gen.write_submit_file(submit_file,target_steps,INFRASTRUCTURE)
 
     gen.print_spacer()
     print(gen.col('Run file')+submit_file)
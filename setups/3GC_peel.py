@@ -154,8 +154,13 @@ def main():
             step['comment'] = 'Run masked wsclean, high freq/angular resolution, on CORRECTED_DATA column of '+myms
             step['dependency'] = None
             step['id'] = 'WSDMA'+code
+            step['inputs'] = [myms]
+            step['outputs'] = [prepeel_img_prefix+'-MFS-image.fits',prepeel_img_prefix+'-0*-model.fits']
+            step['input_columns'] = ['CORRECTED_DATA','FLAG','WEIGHT_SPECTRUM']
+            step['output_columns'] = ['MODEL_DATA']
             step['slurm_config'] = cfg.SLURM_EXTRALONG
             step['pbs_config'] = cfg.PBS_EXTRALONG
+            gen.right_size(step,'wsclean',myms,npix=cfg.WSC_IMSIZE,nchanout=cfg.CAL_3GC_PEEL_NCHAN)
             absmem = gen.absmem_helper(step,INFRASTRUCTURE,cfg.WSC_ABSMEM)
             syscall = CONTAINER_RUNNER+WSCLEAN_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += gen.generate_syscall_wsclean(mslist = [myms],
@@ -168,7 +173,8 @@ def main():
                         localrms = False,
                         nomodel = True,
                         mask = mask,
-                        absmem = absmem)
+                        absmem = absmem,
+                        threads = gen.thread_count(step,INFRASTRUCTURE))
             step['syscall'] = syscall
             steps.append(step)
 
@@ -178,6 +184,9 @@ def main():
             step['comment'] = 'Fix any NaN values in blanked wsclean sub-band models'
             step['dependency'] = 0
             step['id'] = 'FXNAN'+code
+            step['inputs'] = [prepeel_img_prefix+'-0*-model.fits']
+            step['outputs'] = [prepeel_img_prefix+'-0*-model.fits']
+            step['pack'] = True
             syscall = CONTAINER_RUNNER+CUBICAL_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += 'python3 '+TOOLS+'/fix_nan_models.py '+prepeel_img_prefix+'-0'
             step['syscall'] = syscall
@@ -189,6 +198,10 @@ def main():
             step['comment'] = 'Extract problem source defined by region into a separate set of model images'
             step['dependency'] = 1
             step['id'] = 'IMSPL'+code
+            step['inputs'] = [CAL_3GC_PEEL_REGION,prepeel_img_prefix+'-0*-model.fits']
+            step['outputs'] = [dir1_img_prefix+'-0*-model.fits']
+            step['cache'] = True
+            step['pack'] = True
             syscall = CONTAINER_RUNNER+CUBICAL_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += 'python3 '+OXKAT+'/3GC_split_model_images.py '
             syscall += '--region '+CAL_3GC_PEEL_REGION+' '
@@ -199,23 +212,10 @@ def main():
 
             step = {}
             step['step'] = 3
-            step['comment'] = 'Predict problem source visibilities into MODEL_DATA column of '+myms
-            step['dependency'] = 2
-            step['id'] = 'WS1PR'+code
-            step['slurm_config'] = cfg.SLURM_WSCLEAN
-            step['pbs_config'] = cfg.PBS_WSCLEAN
-            absmem = gen.absmem_helper(step,INFRASTRUCTURE,cfg.WSC_ABSMEM)
-            syscall = CONTAINER_RUNNER+WSCLEAN_CONTAINER+' ' if USE_SINGULARITY else ''
-            syscall += gen.generate_syscall_predict(msname = myms, imgbase = dir1_img_prefix, chanout = cfg.CAL_3GC_PEEL_NCHAN, absmem = absmem)
-            step['syscall'] = syscall
-            steps.append(step)
-
-
-            step = {}
-            step['step'] = 4
             step['comment'] = 'Add '+cfg.CAL_3GC_PEEL_DIR1COLNAME+' column to '+myms
-            step['dependency'] = 3
+            step['dependency'] = 0
             step['id'] = 'ADDIR'+code
+            step['output_columns'] = [cfg.CAL_3GC_PEEL_DIR1COLNAME]
             syscall = CONTAINER_RUNNER+CUBICAL_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += 'python3 '+TOOLS+'/add_MS_column.py '
             syscall += '--colname '+cfg.CAL_3GC_PEEL_DIR1COLNAME+' '
@@ -224,11 +224,28 @@ def main():
             steps.append(step)
 
 
+            step = {}
+            step['step'] = 4
+            step['comment'] = 'Predict problem source visibilities into MODEL_DATA column of '+myms
+            step['dependency'] = [2,3]
+            step['id'] = 'WS1PR'+code
+            step['output_columns'] = ['MODEL_DATA']
+            step['slurm_config'] = cfg.SLURM_WSCLEAN
+            step['pbs_config'] = cfg.PBS_WSCLEAN
+            gen.right_size(step,'predict',myms,npix=cfg.WSC_IMSIZE,nchanout=cfg.CAL_3GC_PEEL_NCHAN)
+            absmem = gen.absmem_helper(step,INFRASTRUCTURE,cfg.WSC_ABSMEM)
+            syscall = CONTAINER_RUNNER+WSCLEAN_CONTAINER+' ' if USE_SINGULARITY else ''
+            syscall += gen.generate_syscall_predict(msname = myms, imgbase = dir1_img_prefix, chanout = cfg.CAL_3GC_PEEL_NCHAN, absmem = absmem, threads = gen.thread_count(step,INFRASTRUCTURE))
+            step['syscall'] = syscall
+            steps.append(step)
+
+
             step = {}
             step['step'] = 5
             step['comment'] = 'Copy MODEL_DATA to '+cfg.CAL_3GC_PEEL_DIR1COLNAME
             step['dependency'] = 4
             step['id'] = 'CPMOD'+code
+            step['output_columns'] = [cfg.CAL_3GC_PEEL_DIR1COLNAME]
             syscall = CONTAINER_RUNNER+CUBICAL_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += 'python3 '+TOOLS+'/copy_MS_column.py '
             syscall += '--fromcol MODEL_DATA '
@@ -243,11 +260,13 @@ def main():
             step['comment'] = 'Predict full sky model visibilities into MODEL_DATA column of '+myms
             step['dependency'] = 5
             step['id'] = 'WS2PR'+code
+            step['output_columns'] = ['MODEL_DATA']
             step['slurm_config'] = cfg.SLURM_WSCLEAN
             step['pbs_config'] = cfg.PBS_WSCLEAN
+            gen.right_size(step,'predict',myms,npix=cfg.WSC_IMSIZE,nchanout=cfg.CAL_3GC_PEEL_NCHAN)
             absmem = gen.absmem_helper(step,INFRASTRUCTURE,cfg.WSC_ABSMEM)
             syscall = CONTAINER_RUNNER+WSCLEAN_CONTAINER+' ' if USE_SINGULARITY else ''
-            syscall += gen.generate_syscall_predict(msname = myms, imgbase = prepeel_img_prefix, chanout = cfg.CAL_3GC_PEEL_NCHAN, absmem = absmem)
+            syscall += gen.generate_syscall_predict(msname = myms, imgbase = prepeel_img_prefix, chanout = cfg.CAL_3GC_PEEL_NCHAN, absmem = absmem, threads = gen.thread_count(step,INFRASTRUCTURE))
             step['syscall'] = syscall
             steps.append(step)
 
@@ -257,6 +276,7 @@ def main():
             step['comment'] = 'Copy CORRECTED_DATA to DATA'
             step['dependency'] = 6
             step['id'] = 'CPCOR'+code
+            step['output_columns'] = ['DATA']
             syscall = CONTAINER_RUNNER+CUBICAL_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += 'python3 '+TOOLS+'/copy_MS_column.py '
             syscall += '--fromcol CORRECTED_DATA '
@@ -271,10 +291,12 @@ def main():
             step['comment'] = 'Run CubiCal to solve for G (full model) and dE (problem source), peel out problem source'
             step['dependency'] = 7
             step['id'] = 'CL3GC'+code
+            step['output_columns'] = ['CORRECTED_DATA','FLAG','BITFLAG']
             step['slurm_config'] = cfg.SLURM_WSCLEAN
             step['pbs_config'] = cfg.PBS_WSCLEAN
+            gen.right_size(step,'cubical',myms)
             syscall = CONTAINER_RUNNER+CUBICAL_CONTAINER+' ' if USE_SINGULARITY else ''
-            syscall += gen.generate_syscall_cubical(parset=cfg.CAL_3GC_PEEL_PARSET, myms=myms, extra_args='--out-name '+outname+' --out-dir '+outdir)
+            syscall += gen.generate_syscall_cubical(parset=cfg.CAL_3GC_PEEL_PARSET, myms=myms, extra_args='--out-name '+outname+' --out-dir '+outdir, ncpu=gen.thread_count(step,INFRASTRUCTURE))
             step['syscall'] = syscall
             steps.append(step)
 
@@ -291,63 +313,7 @@ def main():
 
     submit_file = 'submit_3GC_peel_jobs.sh'
 
-    f = open(submit_file,'w')
-    f.write('#!/usr/bin/env bash\n')
-    f.write('export SINGULARITY_BINDPATH='+cfg.BINDPATH+'\n')
-
-    for content in target_steps:  
-        steps = content[0]
-        kill_file = content[1]
-        targetname = content[2]
-        id_list = []
-
-        f.write('\n#---------------------------------------\n')
-        f.write('# '+targetname)
-        f.write('\n#---------------------------------------\n')
-
-        for step in steps:
-
-            step_id = step['id']
-            id_list.append(step_id)
-            if step['dependency'] is not None:
-                dependency = steps[step['dependency']]['id']
-            else:
-                dependency = None
-            syscall = step['syscall']
-            if 'slurm_config' in step.keys():
-                slurm_config = step['slurm_config']
-            else:
-                slurm_config = cfg.SLURM_DEFAULTS
-            if 'pbs_config' in step.keys():
-                pbs_config = step['pbs_config']
-            else:
-                pbs_config = cfg.PBS_DEFAULTS
-            comment = step['comment']
-
-            run_command = gen.job_handler(syscall = syscall,
-                            jobname = step_id,
-                            infrastructure = INFRASTRUCTURE,
-                            dependency = dependency,
-                            slurm_config = slurm_config,
-                            pbs_config = pbs_config)
-
-
-            f.write('\n# '+comment+'\n')
-            f.write(run_command)
-
-        if INFRASTRUCTURE != 'node':
-            f.write('\n# Generate kill script for '+targetname+'\n')
-        if INFRASTRUCTURE == 'idia' or INFRASTRUCTURE == 'hippo':
-            kill = 'echo "scancel "$'+'" "$'.join(id_list)+' > '+kill_file+'\n'
-            f.write(kill)
-        elif INFRASTRUCTURE == 'chpc':
-            kill = 'echo "qdel "$'+'" "$'.join(id_list)+' > '+kill_file+'\n'
-            f.write(kill)
-
-        
-    f.close()
-
-    gen.make_executable(submit_file)
+    gen.write_submit_file(submit_file,target_steps,INFRASTRUCTURE)
 
     gen.print_spacer()
     print(gen.col('Run file')+submit_file)
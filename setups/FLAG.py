@@ -37,6 +37,7 @@ def main():
 
 
     gen.setup_dir(IMAGES)
+    gen.setup_dir(cfg.FLAGSTATS)
     gen.setup_dir(cfg.LOGS)
     gen.setup_dir(cfg.SCRIPTS)
 
@@ -50,6 +51,7 @@ def main():
 
     ASTROPY_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.ASTROPY_PATTERN,USE_SINGULARITY)
     CASA_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.CASA_PATTERN,USE_SINGULARITY)
+    OWLCAT_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.OWLCAT_PATTERN,USE_SINGULARITY)
     TRICOLOUR_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.TRICOLOUR_PATTERN,USE_SINGULARITY)
     WSCLEAN_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.WSCLEAN_PATTERN,USE_SINGULARITY)
 
@@ -119,6 +121,7 @@ def main():
             step['id'] = 'TRIC0'+code
             step['slurm_config'] = cfg.SLURM_TRICOLOUR
             step['pbs_config'] = cfg.PBS_TRICOLOUR
+            gen.right_size(step,'tricolour',myms)
             syscall = CONTAINER_RUNNER+TRICOLOUR_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += gen.generate_syscall_tricolour(myms = myms,
                         config = DATA+'/tricolour/target_flagging_1_narrow.yaml',
@@ -131,11 +134,23 @@ def main():
 
             step = {}
             step['step'] = 1
+            step['comment'] = 'Flag statistics of '+myms+' after Tricolour'
+            step['dependency'] = 0
+            step['id'] = 'FSTAT'+code
+            syscall = CONTAINER_RUNNER+OWLCAT_CONTAINER+' ' if USE_SINGULARITY else ''
+            syscall += 'python3 '+TOOLS+'/flag_stats.py --outdir '+cfg.FLAGSTATS+' --tag tricolour '+myms
+            step['syscall'] = syscall
+            steps.append(step)
+
+
+            step = {}
+            step['step'] = 2
             step['comment'] = 'Blind wsclean on DATA column of '+myms
             step['dependency'] = 0
             step['id'] = 'WSDBL'+code
             step['slurm_config'] = cfg.SLURM_WSCLEAN
             step['pbs_config'] = cfg.PBS_WSCLEAN
+            gen.right_size(step,'wsclean',myms,npix=cfg.WSC_IMSIZE,nchanout=cfg.WSC_CHANNELSOUT)
             absmem = gen.absmem_helper(step,INFRASTRUCTURE,cfg.WSC_ABSMEM)
             syscall = CONTAINER_RUNNER+WSCLEAN_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += gen.generate_syscall_wsclean(mslist = [myms],
@@ -146,16 +161,21 @@ def main():
                         autothreshold = False,
                         localrms = False,
                         mask = False,
-                        absmem = absmem)
+                        absmem = absmem,
+                        threads = gen.thread_count(step,INFRASTRUCTURE))
             step['syscall'] = syscall
             steps.append(step)
 
 
             step = {}
-            step['step'] = 2
+            step['step'] = 3
             step['comment'] = 'Make initial cleaning mask for '+targetname
-            step['dependency'] = 1
+            step['dependency'] = 2
             step['id'] = 'MASK0'+code
+            step['inputs'] = [img_prefix+'-MFS-image.fits']
+            step['outputs'] = [img_prefix+'-MFS-image.mask0.fits']
+            step['cache'] = True
+            step['pack'] = True
             syscall = CONTAINER_RUNNER+ASTROPY_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += gen.generate_syscall_makemask(restoredimage = img_prefix+'-MFS-image.fits',
                         outfile = img_prefix+'-MFS-image.mask0.fits',
@@ -165,10 +185,14 @@ def main():
 
 
             step = {}
-            step['step'] = 3
+            step['step'] = 4
             step['comment'] = 'Apply primary beam correction to '+targetname+' image'
-            step['dependency'] = 1
+            step['dependency'] = 2
             step['id'] = 'PBCOR'+code
+            step['inputs'] = [img_prefix+'-MFS-image.fits']
+            step['outputs'] = [img_prefix+'-MFS-image.pbcor.fits',img_prefix+'-MFS-image.pb.fits',img_prefix+'-MFS-image.wt.fits']
+            step['cache'] = True
+            step['pack'] = True
             syscall = CONTAINER_RUNNER+ASTROPY_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += 'python3 '+TOOLS+'/pbcor_katbeam.py --band '+band[0]+' '+img_prefix+'-MFS-image.fits'
             step['syscall'] = syscall
@@ -177,9 +201,9 @@ def main():
 
             if cfg.SAVE_FLAGS:
                 step = {}
-                step['step'] = 4
+                step['step'] = 5
                 step['comment'] = 'Backup flag table for '+myms
-                step['dependency'] = 1
+                step['dependency'] = 2
                 step['id'] = 'SAVFG'+code
                 syscall = CONTAINER_RUNNER+CASA_CONTAINER+' ' if USE_SINGULARITY else ''
                 syscall += 'casa -c '+OXKAT+'/FLAG_casa_backup_flag_table.py --nologger --log2term --nogui '
@@ -200,63 +224,7 @@ def main():
 
     submit_file = 'submit_flag_jobs.sh'
 
-    f = open(submit_file,'w')
-    f.write('#!/usr/bin/env bash\n')
-    f.write('export SINGULARITY_BINDPATH='+cfg.BINDPATH+'\n')
-
-    for content in target_steps:  
-        steps = content[0]
-        kill_file = content[1]
-        targetname = content[2]
-        id_list = []
-
-        f.write('\n#---------------------------------------\n')
-        f.write('# '+targetname)
-        f.write('\n#---------------------------------------\n')
-
-        for step in steps:
-
-            step_id = step['id']
-            id_list.append(step_id)
-            if step['dependency'] is not None:
-                dependency = steps[step['dependency']]['id']
-            else:
-                dependency = None
-            syscall = step['syscall']
-            if 'slurm_config' in step.keys():
-                slurm_config = step['slurm_config']
-            else:
-                slurm_config = cfg.SLURM_DEFAULTS
-            if 'pbs_config' in step.keys():
-                pbs_config = step['pbs_config']
-            else:
-                pbs_config = cfg.PBS_DEFAULTS
-            comment = step['comment']
-
-            run_command = gen.job_handler(syscall = syscall,
-                            jobname = step_id,
-                            infrastructure = INFRASTRUCTURE,
-                            dependency = dependency,
-                            slurm_config = slurm_config,
-                            pbs_config = pbs_config)
-
-
-            f.write('\n# '+comment+'\n')
-            f.write(run_command)
-
-        if INFRASTRUCTURE != 'node':
-            f.write('\n# Generate kill script for '+targetname+'\n')
-        if INFRASTRUCTURE == 'idia' or INFRASTRUCTURE == 'hippo':
-            kill = 'echo "scancel "$'+'" "$'.join(id_list)+' > '+kill_file+'\n'
-            f.write(kill)
-        elif INFRASTRUCTURE == 'chpc':
-            kill = 'echo "qdel "$'+'" "$'.join(id_list)+' > '+kill_file+'\n'
-            f.write(kill)
-
-        
-    f.close()
-
-    gen.make_executable(submit_file)
+    gen.write_submit_file(submit_file,target_steps,INFRASTRUCTURE)
 
     gen.print_spacer()
     print(gen.col('Run file')+submit_file)
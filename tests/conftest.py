@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import numpy
+import os.path as o
+import pytest
+import struct
+import sys
+import types
+sys.path.append(o.abspath(o.join(o.dirname(__file__), "..")))
+
+
+# ------------------------------------------------------------------------
+#
+# In-memory stand-in for pyrap.tables, so that the Measurement Set code
+# can be tested without casacore. Tables are dicts of column name : numpy
+# array (rows first) in ms_tables, keyed by name, with sub-tables as e.g.
+# 'x.ms/ANTENNA'. A column whose cell shape varies between rows (e.g. FLAG
+# with several SPWs) is a list of per-row arrays. Queries support
+# conditions of the form COL==value joined by &&. The name, readonly and
+# lockoptions of each table opened by name are kept in FakeTable.opened.
+#
+
+
+class FakeTable:
+
+    opened = []
+
+    def __init__(self,tablename,readonly=True,ack=False,lockoptions='default',rows=None):
+        if tablename not in ms_tables:
+            raise RuntimeError('Table '+tablename+' does not exist')
+        self.name = tablename
+        self.cols = ms_tables[tablename]
+        if rows is None:
+            rows = numpy.arange(len(next(iter(self.cols.values()))))
+            FakeTable.opened.append((tablename,readonly,lockoptions))
+        self.rows = rows
+
+    def colnames(self):
+        return list(self.cols.keys())
+
+    def nrows(self):
+        return len(self.rows)
+
+    def selected(self,startrow,nrow):
+        if nrow < 0:
+            return self.rows[startrow:]
+        return self.rows[startrow:startrow+nrow]
+
+    def getcol(self,columnname,startrow=0,nrow=-1):
+        col = self.cols[columnname]
+        if isinstance(col,list):
+            return numpy.stack([col[i] for i in self.selected(startrow,nrow)])
+        return numpy.array(col[self.selected(startrow,nrow)])
+
+    def getcell(self,columnname,rownr):
+        return numpy.array(self.cols[columnname][self.rows[rownr]])
+
+    def getcolnp(self,columnname,nparray,startrow=0,nrow=-1):
+        nparray[...] = self.cols[columnname][self.selected(startrow,nrow)]
+
+    def putcol(self,columnname,value,startrow=0,nrow=-1):
+        self.cols[columnname][self.selected(startrow,nrow)] = value
+
+    def selectrows(self,rownrs):
+        return FakeTable(self.name,rows=self.rows[numpy.asarray(rownrs)])
+
+    def query(self,query='',columns=''):
+        selection = numpy.ones(len(self.rows),dtype=bool)
+        for condition in query.split('&&'):
+            if condition.strip() == '':
+                continue
+            col,value = condition.split('==')
+            selection &= self.cols[col.strip()][self.rows] == int(value)
+        return FakeTable(self.name,rows=self.rows[selection])
+
+    def done(self):
+        pass
+
+    def close(self):
+        pass
+
+
+ms_tables = {}
+
+pyrap = types.ModuleType('pyrap')
+pyrap.tables = types.ModuleType('pyrap.tables')
+pyrap.tables.table = FakeTable
+sys.modules['pyrap'] = pyrap
+sys.modules['pyrap.tables'] = pyrap.tables
+
+
+@pytest.fixture
+def tables():
+    ms_tables.clear()
+    FakeTable.opened.clear()
+    yield ms_tables
+    ms_tables.clear()
+
+
+def write_table_dat(tabledat,nrows,columns):
+
+    """ Write a minimal casacore table.dat for a table of nrows rows
+    whose columns is a list of (name, data manager sequence number):
+    the AipsIO header with the row count, the column descriptions and
+    then the column set entries that map each column to its data
+    manager, all big-endian
+    """
+
+    def aipsio_string(txt):
+        return struct.pack('>I',len(txt))+txt.encode()
+
+    body = aipsio_string('Table')+struct.pack('>IQ',3,nrows)
+    body += aipsio_string('TableDesc')+struct.pack('>I',len(columns))
+    for name,seqnr in columns:
+        body += struct.pack('>I',1)+aipsio_string(name)+aipsio_string('')+aipsio_string('StandardStMan')
+    body += struct.pack('>iQ',-3,nrows)
+    for name,seqnr in columns:
+        body += struct.pack('>I',2)+aipsio_string(name)+struct.pack('>II',1,seqnr)
+    f = open(tabledat,'wb')
+    f.write(struct.pack('>II',0xbebebebe,len(body)+8)+body)
+    f.close()
+
+
+@pytest.fixture
+def table_dat():
+    return write_table_dat
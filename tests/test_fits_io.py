@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import numpy
+from astropy.io import fits
+from multiprocessing import Pool
+
+from oxkat.fits_io import get_data, get_image, get_nplanes, flush_fits, create_fits
+
+
+def write_cube(fitsfile,nplanes=4,ny=16,nx=12):
+    data = numpy.arange(nplanes*ny*nx,dtype=numpy.float32).reshape((1,nplanes,ny,nx))+1.0
+    hdu = fits.PrimaryHDU(data)
+    hdu.header['CTYPE3'] = 'FREQ'
+    hdu.writeto(fitsfile)
+    return data
+
+
+def write_plane(args):
+    fitsfile,plane = args
+    image = get_image(fitsfile,plane)
+    flush_fits(numpy.full(image.shape,plane*10.0,dtype=numpy.float32),fitsfile,plane)
+    return plane
+
+
+def test_get_data_is_copy_on_write(tmp_path):
+    fitsfile = str(tmp_path/'cube.fits')
+    data = write_cube(fitsfile)
+    mapped = get_data(fitsfile)
+    mapped[...] = 0.0
+    assert numpy.array_equal(fits.getdata(fitsfile),data)
+
+
+def test_get_image_plane(tmp_path):
+    fitsfile = str(tmp_path/'cube.fits')
+    data = write_cube(fitsfile)
+    assert get_nplanes(fitsfile) == 4
+    image = get_image(fitsfile,2)
+    assert numpy.array_equal(image,data[0,2])
+    image[0,0] = -1.0
+    assert fits.getdata(fitsfile)[0,2,0,0] == data[0,2,0,0]
+
+
+def test_create_fits_copies_multiple_planes(tmp_path):
+    infits = str(tmp_path/'cube.fits')
+    outfits = str(tmp_path/'out.fits')
+    data = write_cube(infits)
+    create_fits(infits,outfits)
+    flush_fits(numpy.zeros((16,12)),outfits,1)
+    out = fits.getdata(outfits)
+    assert numpy.all(out[0,1] == 0.0)
+    assert numpy.array_equal(out[0,[0,2,3]],data[0,[0,2,3]])
+
+
+def test_create_fits_zero_fills(tmp_path):
+    infits = str(tmp_path/'cube.fits')
+    write_cube(infits)
+    outfits = str(tmp_path/'empty.fits')
+    create_fits(infits,outfits,copy=False)
+    out = fits.getdata(outfits)
+    assert out.shape == (1,4,16,12)
+    assert numpy.all(out == 0.0)
+    outfits = str(tmp_path/'int.fits')
+    create_fits(infits,outfits,bitpix=16)
+    assert fits.getheader(outfits)['BITPIX'] == 16
+    assert numpy.all(fits.getdata(outfits) == 0)
+
+
+def test_concurrent_plane_writes(tmp_path):
+    infits = str(tmp_path/'cube.fits')
+    outfits = str(tmp_path/'out.fits')
+    write_cube(infits,nplanes=8)
+    create_fits(infits,outfits,copy=False)
+    with Pool(processes=4) as pool:
+        done = pool.map(write_plane,[(outfits,plane) for plane in range(0,8)])
+    assert sorted(done) == list(range(0,8))
+    out = fits.getdata(outfits)
+    for plane in range(0,8):
+        assert numpy.all(out[0,plane] == plane*10.0)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import pytest
+
+from oxkat import config as cfg
+from oxkat import generate_jobs as gen
+
+
+def make_step(step_id,dependency,walltime='01:00:00'):
+    slurm_config = dict(cfg.SLURM_DEFAULTS)
+    slurm_config['TIME'] = walltime
+    return {'id':step_id,'dependency':dependency,'slurm_config':slurm_config,'syscall':'echo '+step_id}
+
+
+def test_walltime_to_hours():
+    assert gen.walltime_to_hours('02:30:00') == 2.5
+    assert gen.walltime_to_hours('1-12:00:00') == 36.0
+    assert gen.walltime_to_hours('01:30') == 1.5
+    assert gen.walltime_to_hours('90') == 1.5
+
+
+def test_toposort_parents_first():
+    steps = [make_step('D',[1,2]),
+        make_step('A',None),
+        make_step('B',1),
+        make_step('C',None)]
+    order = gen.toposort_steps(steps)
+    assert sorted(order) == [0,1,2,3]
+    for i in order:
+        for j in gen.get_dependencies(steps[i]):
+            assert order.index(j) < order.index(i)
+    # Of the steps that are ready, the earliest in the recipe goes first
+    assert order == [1,2,0,3]
+
+
+def test_toposort_keeps_a_linear_recipe_in_order():
+    steps = [make_step('A',None)]+[make_step(str(i),i-1) for i in range(1,6)]
+    assert gen.toposort_steps(steps) == list(range(0,6))
+
+
+def test_toposort_rejects_cycles_and_bad_dependencies():
+    with pytest.raises(SystemExit):
+        gen.toposort_steps([make_step('A',1),make_step('B',0)])
+    with pytest.raises(SystemExit):
+        gen.toposort_steps([make_step('A',None),make_step('B',5)])
+    with pytest.raises(SystemExit):
+        gen.toposort_steps([make_step('A',0)])
+
+
+def test_critical_path():
+    steps = [make_step('A',None,'01:00:00'),
+        make_step('B',0,'05:00:00'),
+        make_step('C',0,'02:00:00'),
+        make_step('D',[1,2],'00:30:00'),
+        make_step('E',None,'04:00:00')]
+    path,hours = gen.critical_path(steps,'idia')
+    assert path == ['A','B','D']
+    assert hours == 6.5
+
+
+def test_critical_path_empty():
+    assert gen.critical_path([],'idia') == ([],0.0)
+
+
+def test_marker_columns_leave_out_downstream_writes():
+    steps = [make_step('PREDI',None,1),make_step('SOLVE',0,1),make_step('IMAGE',1,1)]
+    steps[0]['input_columns'] = ['DATA','FLAG']
+    steps[0]['output_columns'] = ['MODEL_DATA']
+    steps[1]['input_columns'] = ['DATA','MODEL_DATA','FLAG']
+    steps[1]['output_columns'] = ['CORRECTED_DATA','FLAG']
+    steps[2]['input_columns'] = ['CORRECTED_DATA','FLAG']
+    gen.set_marker_columns(steps)
+    assert steps[0]['marker_columns'] == ['DATA']
+    assert steps[1]['marker_columns'] == ['DATA','MODEL_DATA','FLAG']
+    assert steps[2]['marker_columns'] == ['CORRECTED_DATA','FLAG']
+    steps[2].pop('input_columns')
+    steps[2].pop('marker_columns')
+    gen.set_marker_columns(steps)
+    assert 'marker_columns' not in steps[2]
+
+
+def test_cache_refuses_in_place_steps():
+    assert gen.paths_overlap(['img-0*-model.fits'],['img-0*-model.fits'])
+    assert gen.paths_overlap(['img-0*-model.fits'],['img-0001-model.fits'])
+    assert gen.paths_overlap(['x.ms/'],['x.ms'])
+    assert not gen.paths_overlap(['img-MFS-image.fits'],['img-MFS-image.pbcor.fits'])
+    assert gen.cache_syscall('run',['a.fits'],['a.fits']) == 'run'
+    wrapped = gen.cache_syscall('run',['a.fits'],['b.fits'])
+    assert 'result_cache.py' in wrapped and '--outputs b.fits' in wrapped
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import pytest
+
+from oxkat import config as cfg
+from oxkat import generate_jobs as gen
+
+
+def target_steps(tmp_path,ntargets=2):
+    # Per-target recipe of an image, a self-cal that follows it and a
+    # second image that needs both
+    target_steps = []
+    for t in range(0,ntargets):
+        code = 't'+str(t)
+        steps = []
+        for step_id,dependency in [('WSDMA',None),('CL2GC',0),('WSCMA',[0,1])]:
+            steps.append({'id':step_id+code,
+                        'dependency':dependency,
+                        'comment':'Run '+step_id,
+                        'slurm_config':cfg.SLURM_DEFAULTS,
+                        'pbs_config':cfg.PBS_DEFAULTS,
+                        'syscall':'run_'+step_id+' target'+str(t)+'.ms'})
+        target_steps.append((steps,str(tmp_path/('kill_'+code+'.sh')),'target'+str(t)))
+    return target_steps
+
+
+@pytest.fixture
+def arrays(tmp_path,monkeypatch):
+    for name in ['SCRIPTS','LOGS']:
+        (tmp_path/name).mkdir()
+        monkeypatch.setattr(cfg,name,str(tmp_path/name))
+    monkeypatch.setattr(cfg,'JOB_ARRAYS',True)
+    monkeypatch.setattr(cfg,'JOB_ARRAY_MAX',0)
+    return tmp_path
+
+
+def write_submit(tmp_path,infrastructure,ntargets=2):
+    submit_file = str(tmp_path/'submit_2GC_jobs.sh')
+    gen.write_submit_file(submit_file,target_steps(tmp_path,ntargets),infrastructure)
+    return open(submit_file).read()
+
+
+def test_array_names(tmp_path):
+    steps = target_steps(tmp_path)
+    assert gen.array_names(steps) == ['WSDMA','CL2GC','WSCMA']
+    assert gen.array_names(steps[0:1]) is None
+    steps[1][0][2]['dependency'] = 1
+    assert gen.array_names(steps) is None
+    steps = target_steps(tmp_path)
+    steps[1][0][1]['slurm_config'] = cfg.SLURM_HIGHMEM
+    assert gen.array_names(steps) is None
+    steps = target_steps(tmp_path)
+    steps[1][0].pop()
+    assert gen.array_names(steps) is None
+
+
+def test_slurm_arrays(arrays,monkeypatch):
+    monkeypatch.setattr(cfg,'JOB_ARRAY_MAX',4)
+    submit = write_submit(arrays,'idia')
+    scripts = cfg.SCRIPTS+'/'
+    assert "WSDMA=`sbatch "+scripts+"slurm_WSDMA.sh | awk '{print $4}'`" in submit
+    assert "CL2GC=`sbatch -d aftercorr:${WSDMA} "+scripts+"slurm_CL2GC.sh" in submit
+    assert "WSCMA=`sbatch -d aftercorr:${WSDMA}:${CL2GC} "+scripts+"slurm_WSCMA.sh" in submit
+    assert '#   1 : target1\n' in submit
+    assert submit.count('sbatch') == 3
+
+    runfile = open(scripts+'slurm_CL2GC.sh').read()
+    assert '#SBATCH --array=0-1%4\n' in runfile
+    assert '#SBATCH --output='+cfg.LOGS+'/slurm_CL2GC_%a.log\n' in runfile
+    assert 'case $SLURM_ARRAY_TASK_ID in\n' in runfile
+    assert '0)\n    run_CL2GC target0.ms\n    echo "****ELAPSED "$SECONDS" CL2GCt0"\n    ;;\n' in runfile
+    assert '1)\n    run_CL2GC target1.ms\n' in runfile
+
+    kill = 'echo "scancel ${WSDMA}_1 ${CL2GC}_1 ${WSCMA}_1" > '+str(arrays/'kill_t1.sh')+'\n'
+    assert kill in submit
+
+
+def test_pbs_arrays(arrays):
+    submit = write_submit(arrays,'chpc')
+    scripts = cfg.SCRIPTS+'/'
+    assert "WSDMA=`qsub "+scripts+"pbs_WSDMA.sh | awk '{print $1}'`" in submit
+    # PBS dependencies on an array wait for all of its tasks
+    assert "WSCMA=`qsub -W depend=afterok:${WSDMA}:${CL2GC} "+scripts+"pbs_WSCMA.sh" in submit
+
+    runfile = open(scripts+'pbs_WSDMA.sh').read()
+    assert '#PBS -J 0-1\n' in runfile
+    assert '#PBS -o '+cfg.LOGS+'/pbs_WSDMA_^array_index^.log\n' in runfile
+    assert 'case $PBS_ARRAY_INDEX in\n' in runfile
+    assert '1)\n    run_WSDMA target1.ms\n' in runfile
+
+    kill = 'echo "qdel ${WSDMA/\\[\\]/[0]} ${CL2GC/\\[\\]/[0]} ${WSCMA/\\[\\]/[0]}" > '+str(arrays/'kill_t0.sh')+'\n'
+    assert kill in submit
+
+
+def test_no_arrays_when_off_or_single_target(arrays,monkeypatch):
+    submit = write_submit(arrays,'idia',ntargets=1)
+    assert 'WSDMAt0=`sbatch ' in submit
+    assert '--array' not in open(cfg.SCRIPTS+'/slurm_WSDMAt0.sh').read()
+    monkeypatch.setattr(cfg,'JOB_ARRAYS',False)
+    submit = write_submit(arrays,'idia')
+    assert "CL2GCt1=`sbatch -d afterok:${WSDMAt1} " in submit
+    assert 'aftercorr' not in submit
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import json
+import numpy
+
+from oxkat import ms_flags
+
+
+def make_ms(tables,nant=6,nchan=16,ncorr=2,nfield=3,seed=23):
+    # All baselines including autocorrelations for each scan
+    rng = numpy.random.default_rng(seed)
+    a1,a2 = numpy.triu_indices(nant)
+    nscan = 9
+    nbl = len(a1)
+    scan = numpy.repeat(numpy.arange(1,nscan+1),nbl)
+    tables['x.ms'] = {'ANTENNA1':numpy.tile(a1,nscan),
+        'ANTENNA2':numpy.tile(a2,nscan),
+        'SCAN_NUMBER':scan,
+        'FIELD_ID':scan % nfield,
+        'DATA_DESC_ID':numpy.zeros(nscan*nbl,dtype=int),
+        'FLAG':rng.random((nscan*nbl,nchan,ncorr)) < 0.3}
+    tables['x.ms/ANTENNA'] = {'NAME':numpy.array(['m00'+str(i) for i in range(0,nant)])}
+    tables['x.ms/FIELD'] = {'NAME':numpy.array(['field'+str(i) for i in range(0,nfield)])}
+    tables['x.ms/DATA_DESCRIPTION'] = {'SPECTRAL_WINDOW_ID':numpy.array([0])}
+    return tables['x.ms']
+
+
+def antenna_counts(cols,nant,field_id=None):
+    # Per-antenna counts the slow way, one baseline at a time
+    flagged = numpy.zeros(nant)
+    total = numpy.zeros(nant)
+    for row in range(0,len(cols['FLAG'])):
+        if field_id is not None and cols['FIELD_ID'][row] != field_id:
+            continue
+        ants = set([cols['ANTENNA1'][row],cols['ANTENNA2'][row]])
+        for ant in ants:
+            flagged[ant] += numpy.sum(cols['FLAG'][row])
+            total[ant] += cols['FLAG'][row].size
+    return flagged,total
+
+
+def test_antenna_flag_counts(tables):
+    cols = make_ms(tables)
+    for field_id in [None,1]:
+        expected = antenna_counts(cols,6,field_id)
+        for rowchunk in [0,5,1000]:
+            flagged,total = ms_flags.antenna_flag_counts('x.ms',field_id,rowchunk)
+            assert numpy.array_equal(flagged,expected[0])
+            assert numpy.array_equal(total,expected[1])
+
+
+def test_antenna_flag_percentages(tables):
+    cols = make_ms(tables)
+    # Antenna 5 is fully flagged, antenna 0 has no data for field 2
+    cols['FLAG'][(cols['ANTENNA1'] == 5) | (cols['ANTENNA2'] == 5)] = True
+    keep = ~((cols['FIELD_ID'] == 2) & ((cols['ANTENNA1'] == 0) | (cols['ANTENNA2'] == 0)))
+    for key in list(cols.keys()):
+        cols[key] = cols[key][keep]
+    pcs = ms_flags.antenna_flag_percentages('x.ms')
+    assert pcs[5] == 100.0
+    assert numpy.all(pcs[0:5] < 100.0)
+    pcs = ms_flags.antenna_flag_percentages('x.ms',field_id=2)
+    assert numpy.isnan(pcs[0])
+    assert pcs[5] == 100.0
+
+
+def make_multi_spw_ms(tables,seed=24):
+    # Two SPWs of 8 and 4 channels, with DATA_DESC_IDs 0 and 2 both
+    # pointing at SPW 0
+    rng = numpy.random.default_rng(seed)
+    nant = 4
+    a1,a2 = numpy.triu_indices(nant,1)
+    ddids = [0,1,2]
+    nchans = {0:8,1:4}
+    dd_spw = [0,1,0]
+    rows = {'ANTENNA1':[],'ANTENNA2':[],'SCAN_NUMBER':[],'FIELD_ID':[],'DATA_DESC_ID':[]}
+    flags = []
+    for scan in [3,4,7]:
+        for ddid in ddids:
+            for i in range(0,len(a1)):
+                rows['ANTENNA1'].append(a1[i])
+                rows['ANTENNA2'].append(a2[i])
+                rows['SCAN_NUMBER'].append(scan)
+                rows['FIELD_ID'].append(0 if scan < 7 else 2)
+                rows['DATA_DESC_ID'].append(ddid)
+                flags.append(rng.random((nchans[dd_spw[ddid]],2)) < 0.4)
+    cols = dict((key,numpy.array(value)) for key,value in rows.items())
+    cols['FLAG'] = flags
+    tables['y.ms'] = cols
+    tables['y.ms/ANTENNA'] = {'NAME':numpy.array(['m000','m001','m002','m003'])}
+    tables['y.ms/FIELD'] = {'NAME':numpy.array(['cal','unused','target'])}
+    tables['y.ms/DATA_DESCRIPTION'] = {'SPECTRAL_WINDOW_ID':numpy.array(dd_spw)}
+    return cols,dd_spw
+
+
+def test_flag_stats_ms(tables):
+    cols,dd_spw = make_multi_spw_ms(tables)
+    stats = ms_flags.flag_stats('y.ms',rowchunk=4)
+    nflag = numpy.array([numpy.sum(x) for x in cols['FLAG']],dtype=float)
+    nvis = numpy.array([x.size for x in cols['FLAG']],dtype=float)
+
+    assert float(stats['flagged']) == numpy.sum(nflag)
+    assert float(stats['total']) == numpy.sum(nvis)
+    assert not bool(stats['caltable'])
+    assert list(stats['spws']) == [0,1]
+    for spw in [0,1]:
+        rows = [i for i in range(0,len(nflag)) if dd_spw[cols['DATA_DESC_ID'][i]] == spw]
+        chans = numpy.stack([cols['FLAG'][i] for i in rows])
+        assert numpy.array_equal(stats['channel_flagged_'+str(spw)],numpy.sum(chans,axis=(0,2)))
+        assert numpy.array_equal(stats['channel_total_'+str(spw)],numpy.full(chans.shape[1],2.0*len(rows)))
+    assert list(stats['scans']) == [3,4,7]
+    for i,scan in enumerate([3,4,7]):
+        assert stats['scan_flagged'][i] == numpy.sum(nflag[cols['SCAN_NUMBER'] == scan])
+    assert list(stats['fields']) == [0,2]
+    assert stats['field_total'][1] == numpy.sum(nvis[cols['FIELD_ID'] == 2])
+    for ant1,ant2 in [(0,1),(1,3),(2,3)]:
+        rows = (cols['ANTENNA1'] == ant1) & (cols['ANTENNA2'] == ant2)
+        assert stats['baseline_flagged'][ant1,ant2] == numpy.sum(nflag[rows])
+    for ant in range(0,4):
+        rows = (cols['ANTENNA1'] == ant) | (cols['ANTENNA2'] == ant)
+        assert stats['antenna_flagged'][ant] == numpy.sum(nflag[rows])
+        assert stats['antenna_total'][ant] == numpy.sum(nvis[rows])
+
+
+def test_flag_stats_opens_without_read_locks(tables):
+    make_multi_spw_ms(tables)
+    ms_flags.flag_stats('y.ms')
+    opened = ms_flags.table.opened
+    assert [name for name,readonly,lockoptions in opened][0:3] == ['y.ms','y.ms/ANTENNA','y.ms/FIELD']
+    assert 'y.ms/DATA_DESCRIPTION' in [name for name,readonly,lockoptions in opened]
+    for name,readonly,lockoptions in opened:
+        assert readonly and lockoptions == 'autonoread'
+
+
+def test_flag_stats_single_field(tables):
+    cols,dd_spw = make_multi_spw_ms(tables)
+    stats = ms_flags.flag_stats('y.ms',field_id=2)
+    nflag = numpy.array([numpy.sum(x) for x in cols['FLAG']],dtype=float)
+    assert list(stats['fields']) == [2]
+    assert list(stats['scans']) == [7]
+    assert float(stats['flagged']) == numpy.sum(nflag[cols['FIELD_ID'] == 2])
+
+
+def test_flag_stats_caltable(tables):
+    rng = numpy.random.default_rng(5)
+    nrows = 24
+    cols = {'CPARAM':numpy.ones((nrows,1,2),dtype=complex),
+        'ANTENNA1':numpy.tile(numpy.arange(0,4),6),
+        'ANTENNA2':numpy.zeros(nrows,dtype=int),
+        'SCAN_NUMBER':numpy.repeat(numpy.arange(1,7),4),
+        'FIELD_ID':numpy.repeat(numpy.arange(0,6),4) % 2,
+        'SPECTRAL_WINDOW_ID':numpy.zeros(nrows,dtype=int),
+        'FLAG':rng.random((nrows,1,2)) < 0.5}
+    tables['cal.G0'] = cols
+    tables['cal.G0/ANTENNA'] = {'NAME':numpy.array(['m000','m001','m002','m003'])}
+    tables['cal.G0/FIELD'] = {'NAME':numpy.array(['bpcal','gcal'])}
+    tables['cal.G0/SPECTRAL_WINDOW'] = {'NUM_CHAN':numpy.array([1])}
+    stats = ms_flags.flag_stats('cal.G0')
+    assert bool(stats['caltable'])
+    assert 'baseline_flagged' not in stats
+    # Only ANTENNA1 counts, ANTENNA2 is the reference antenna
+    for ant in range(0,4):
+        rows = cols['ANTENNA1'] == ant
+        assert stats['antenna_flagged'][ant] == numpy.sum(cols['FLAG'][rows])
+        assert stats['antenna_total'][ant] == 12.0
+    assert float(stats['total']) == nrows*2
+
+
+def test_write_stats(tables,tmp_path):
+    make_multi_spw_ms(tables)
+    stats = ms_flags.flag_stats('y.ms')
+    json_file,npz_file = ms_flags.write_stats('y.ms',stats,str(tmp_path),'autoflag')
+    assert json_file == str(tmp_path/'y.ms_autoflag.flagstats.json')
+    with open(json_file) as f:
+        summary = json.load(f)
+    assert summary['type'] == 'ms'
+    assert sorted(summary['fields'].keys()) == ['cal','target']
+    assert sorted(summary['spws'].keys()) == ['0','1']
+    assert summary['flagged_pc'] == round(100.0*float(stats['flagged'])/float(stats['total']),3)
+    saved = numpy.load(npz_file)
+    assert numpy.array_equal(saved['antenna_flagged'],stats['antenna_flagged'])
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import numpy
+import pytest
+
+from oxkat import ms_scans
+
+
+def make_ms(tables,nrows=500,seed=21):
+    # Scans of consecutive rows, as in a real MS, with some rows of
+    # neighbouring scans interleaved
+    rng = numpy.random.default_rng(seed)
+    scan = numpy.sort(rng.integers(1,12,size=nrows))
+    swap = rng.integers(0,nrows-1,size=20)
+    scan[swap],scan[swap+1] = scan[swap+1],scan[swap]
+    time = 1e9+scan*100.0+rng.integers(0,10,size=nrows)*8.0
+    tables['x.ms'] = {'SCAN_NUMBER':scan,
+        'TIME':time,
+        'FIELD_ID':(scan % 3).astype(numpy.int32),
+        'STATE_ID':(scan % 2).astype(numpy.int32),
+        'EXPOSURE':numpy.full(nrows,8.0),
+        'ANTENNA1':rng.integers(0,5,size=nrows),
+        'ANTENNA2':rng.integers(5,8,size=nrows)}
+    return tables['x.ms']
+
+
+@pytest.mark.parametrize('rowchunk',[7,64,100000])
+def test_scan_index_matches_brute_force(tables,rowchunk):
+    cols = make_ms(tables)
+    index = ms_scans.derive(ms_scans.build_scan_index('x.ms',rowchunk=rowchunk))
+    scans = numpy.unique(cols['SCAN_NUMBER'])
+    assert numpy.array_equal(index['scans'],scans)
+    for i,scan in enumerate(scans):
+        rows = cols['SCAN_NUMBER'] == scan
+        assert index['nrows'][i] == numpy.sum(rows)
+        assert index['t0'][i] == numpy.min(cols['TIME'][rows])
+        assert index['t1'][i] == numpy.max(cols['TIME'][rows])
+        assert index['tmean'][i] == pytest.approx(numpy.mean(cols['TIME'][rows]),rel=1e-12)
+        assert index['field'][i] == numpy.min(cols['FIELD_ID'][rows])
+        assert index['state'][i] == numpy.min(cols['STATE_ID'][rows])
+    assert numpy.array_equal(index['times'],numpy.unique(cols['TIME']))
+    assert numpy.array_equal(index['antennas'],numpy.arange(0,8))
+    assert int(index['total_rows']) == 500
+    assert index['mean_exposure'] == 8.0
+
+
+def test_merge_chunks_matches_single_chunk():
+    rng = numpy.random.default_rng(3)
+    n = 300
+    scan = rng.integers(0,9,size=n)
+    time = rng.uniform(0,1000,size=n)
+    field = rng.integers(0,4,size=n)
+    state = rng.integers(0,3,size=n)
+    whole = ms_scans.reduce_chunk(scan,time,field,state)
+    edges = [0,1,50,51,180,300]
+    chunks = [ms_scans.reduce_chunk(scan[a:b],time[a:b],field[a:b],state[a:b]) for a,b in zip(edges[:-1],edges[1:])]
+    merged = ms_scans.merge_chunks(chunks)
+    for key in ['scans','field','state','t0','t1','nrows']:
+        assert numpy.array_equal(merged[key],whole[key])
+    assert numpy.allclose(merged['tsum'],whole['tsum'])
+
+
+def test_no_state_column(tables):
+    cols = make_ms(tables)
+    del cols['STATE_ID']
+    index = ms_scans.build_scan_index('x.ms',rowchunk=50)
+    assert numpy.all(index['state'] == -1)
+    assert numpy.all(index['field_states'][:,1] == -1)
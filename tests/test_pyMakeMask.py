@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import importlib.util
+import numpy
+import os.path as o
+import pytest
+import scipy.ndimage
+import sys
+
+
+def load_tool(name):
+    # The tools are scripts rather than a package
+    toolfile = o.join(o.dirname(__file__),'..','tools',name+'.py')
+    spec = importlib.util.spec_from_file_location(name,toolfile)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+pyMakeMask = load_tool('pyMakeMask')
+
+
+@pytest.mark.parametrize('boxsize',[1,2,5,8,31,64])
+def test_vhgw_matches_minimum_filter(boxsize):
+    rng = numpy.random.default_rng(boxsize)
+    image = rng.normal(size=(57,43)).astype(numpy.float32)
+    expected = scipy.ndimage.minimum_filter(image,boxsize)
+    result = pyMakeMask.vhgw_minimum(image,boxsize,nthreads=3)
+    assert result.dtype == image.dtype
+    assert numpy.array_equal(result,expected)
+
+
+def test_vhgw_big_endian():
+    # FITS data are big-endian
+    rng = numpy.random.default_rng(1)
+    image = rng.normal(size=(40,40)).astype('>f4')
+    expected = scipy.ndimage.minimum_filter(image,9)
+    assert numpy.array_equal(pyMakeMask.vhgw_minimum(image,9),expected)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import numpy
+from astropy.io import fits
+
+from oxkat.regions import circle_mask, circles_to_pixels, region_mask
+
+
+def loop_mask(shape,pixels):
+    # The per-pixel loop that circle_mask replaced
+    image = numpy.zeros(shape)
+    for xpix,ypix,rpix in pixels:
+        xg,yg = numpy.mgrid[int(xpix-rpix):int(xpix+rpix)+1,int(ypix-rpix):int(ypix+rpix)+1]
+        for i,j in zip(xg.ravel(),yg.ravel()):
+            sep = ((i-xpix)**2.0 + (j-ypix)**2.0)**0.5
+            if sep < rpix:
+                image[j,i] = 1.0
+    return image.astype(bool)
+
+
+def make_header(npix=200):
+    hdr = fits.Header()
+    hdr['NAXIS'] = 2
+    hdr['NAXIS1'] = npix
+    hdr['NAXIS2'] = npix
+    hdr['CTYPE1'] = 'RA---SIN'
+    hdr['CTYPE2'] = 'DEC--SIN'
+    hdr['CRVAL1'] = 150.0
+    hdr['CRVAL2'] = -30.0
+    hdr['CRPIX1'] = npix/2+1
+    hdr['CRPIX2'] = npix/2+1
+    hdr['CDELT1'] = -1.0/3600.0
+    hdr['CDELT2'] = 1.0/3600.0
+    return hdr
+
+
+def test_circle_mask_matches_loop():
+    rng = numpy.random.default_rng(8)
+    shape = (120,150)
+    pixels = []
+    for i in range(0,20):
+        rpix = rng.uniform(0.5,15.0)
+        xpix = rng.uniform(rpix+1,shape[1]-rpix-2)
+        ypix = rng.uniform(rpix+1,shape[0]-rpix-2)
+        pixels.append((xpix,ypix,rpix))
+    pixels.append((40.0,50.0,7.0))
+    assert numpy.array_equal(circle_mask(shape,pixels),loop_mask(shape,pixels))
+
+
+def test_circle_mask_clipped_at_edges():
+    mask = circle_mask((50,60),[(-3.0,10.0,6.0),(58.5,48.5,4.0),(500.0,500.0,3.0)])
+    assert mask[10,0:3].all()
+    assert not mask[10,3:].any()
+    assert mask[48,58]
+    # The circle past the left edge must not wrap round to the right
+    assert not mask[0:20,50:55].any()
+
+
+def test_region_mask_from_sky_circles():
+    hdr = make_header()
+    circles = [(150.0,-30.0,10.0/3600.0),(150.01,-29.99,5.0/3600.0)]
+    pixels = circles_to_pixels(hdr,circles)
+    assert abs(pixels[0][0]-100.0) < 1e-6 and abs(pixels[0][1]-100.0) < 1e-6
+    assert abs(pixels[0][2]-10.0) < 1e-9
+    mask = region_mask(hdr,circles)
+    assert numpy.array_equal(mask,loop_mask((200,200),pixels))
+    assert region_mask(hdr,circles) is mask
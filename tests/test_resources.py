@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import pytest
+import struct
+
+from oxkat import resources
+
+
+def test_table_nrows(tmp_path,table_dat):
+    # Version 3 headers have a 64 bit row count
+    tabledat = str(tmp_path/'table.dat')
+    table_dat(tabledat,5000000000,[('DATA',1)])
+    assert resources.table_nrows(tabledat) == 5000000000
+
+    # Version 2 headers have a 32 bit row count
+    body = struct.pack('>I',5)+b'Table'+struct.pack('>II',2,123456)
+    open(tabledat,'wb').write(struct.pack('>II',0xbebebebe,len(body)+8)+body)
+    assert resources.table_nrows(tabledat) == 123456
+
+    open(tabledat,'wb').write(struct.pack('>II',0xdeadbeef,8)+body)
+    assert resources.table_nrows(tabledat) is None
+    open(tabledat,'wb').write(b'\xbe\xbe')
+    assert resources.table_nrows(tabledat) is None
+    assert resources.table_nrows(str(tmp_path/'missing.dat')) is None
+
+
+def test_table_columns_and_managers(tmp_path,table_dat):
+    tabledat = str(tmp_path/'table.dat')
+    table_dat(tabledat,10,[('TIME',0),('DATA',1),('FLAG',2),('WEIGHT_SPECTRUM',1)])
+    assert resources.table_columns(tabledat,resources.data_columns) == ['DATA','WEIGHT_SPECTRUM']
+    managers = resources.table_column_managers(tabledat,['DATA','FLAG','TIME','MODEL_DATA'])
+    assert managers == {'DATA':1,'FLAG':2,'TIME':0}
+
+
+def test_ms_dimensions(tmp_path,table_dat):
+    myms = tmp_path/'x.ms'
+    myms.mkdir()
+    table_dat(str(myms/'table.dat'),1000,[('DATA',1),('CORRECTED_DATA',2)])
+    dims = resources.ms_dimensions(str(myms),nchan=4096)
+    assert dims['nrows'] == 1000
+    assert dims['columns'] == ['DATA','CORRECTED_DATA']
+    assert dims['vis_gb'] == pytest.approx(1000*4096*4*8.0/1e9)
+    assert resources.ms_dimensions(str(tmp_path/'missing.ms'))['nrows'] is None
+
+
+def test_ladder_value():
+    ladder = resources.mem_ladder
+    assert resources.ladder_value(0.5,ladder,1024) == 8
+    assert resources.ladder_value(64,ladder,1024) == 64
+    assert resources.ladder_value(64.1,ladder,1024) == 96
+    assert resources.ladder_value(100,ladder,90) == 90
+    # Beyond the top of the ladder the ceiling is used
+    assert resources.ladder_value(1500,ladder,2000) == 2000
+    assert resources.ladder_value(1500,ladder,1024) == 1024
+
+
+def test_size_resources_headroom():
+    # wsclean on 10 GB: 8 CPUs, 6.5 GB and 3.5 hours before headroom
+    (cpus,mem,hours),(raw_mem,raw_hours) = resources.size_resources('wsclean',10.0,32,480,72,headroom=1.0)
+    assert (cpus,mem,hours) == (8,8,4)
+    assert (raw_mem,raw_hours) == pytest.approx((6.5,3.5))
+    (cpus,mem,hours),(raw_mem,raw_hours) = resources.size_resources('wsclean',10.0,32,480,72)
+    assert (cpus,mem,hours) == (8,16,6)
+    assert (raw_mem,raw_hours) == pytest.approx((9.75,5.25))
+
+
+def test_size_resources_image_buffers():
+    (cpus,mem,hours),(raw_mem,raw_hours) = resources.size_resources('wsclean',10.0,32,480,72,npix=10240,nchanout=8,headroom=1.0)
+    image_gb = 10240.0**2*4/1e9
+    assert raw_mem == pytest.approx(6.5+(8+3*8)*image_gb)
+    assert mem == 32
+
+
+def test_size_resources_caps():
+    # 100 GB would want 64 CPUs, 43.5 GB and 23.25 hours
+    (cpus,mem,hours),(raw_mem,raw_hours) = resources.size_resources('wsclean',100.0,16,48,12)
+    assert (cpus,mem,hours) == (16,48,12)
+    assert raw_hours == pytest.approx((0.5+2.4*100/16)*1.5)
+    # Steps that do not take their thread count from the syscall keep the
+    # configured CPUs
+    (cpus,mem,hours),raw = resources.size_resources('tricolour',100.0,32,480,72)
+    assert cpus == 32
+
+
+def test_size_resources_top_of_ladder():
+    (cpus,mem,hours),(raw_mem,raw_hours) = resources.size_resources('wsclean',10000.0,256,2000,500)
+    assert cpus == 256
+    assert raw_mem > resources.mem_ladder[-1]
+    assert mem == 2000
+    assert hours == 168
+    (cpus,mem,hours),(raw_mem,raw_hours) = resources.size_resources('ddfacet',100000.0,128,1024,168)
+    assert (cpus,mem,hours) == (128,1024,168)
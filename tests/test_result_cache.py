@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import glob
+import os
+
+from oxkat import result_cache
+
+
+def setup_step(tmp_path,name='out.txt'):
+    infile = tmp_path/'in.txt'
+    infile.write_text('input')
+    outfile = tmp_path/name
+    counter = tmp_path/'runs.txt'
+    command = 'cat '+str(infile)+' > '+str(outfile)+' && echo run >> '+str(counter)
+    return str(infile),str(outfile),str(counter),command
+
+
+def nruns(counter):
+    if not os.path.isfile(counter):
+        return 0
+    return len(open(counter).readlines())
+
+
+def test_miss_then_hit(tmp_path):
+    cachedir = str(tmp_path/'CACHE')
+    infile,outfile,counter,command = setup_step(tmp_path)
+    assert result_cache.run_cached(command,[infile],[outfile],cachedir,1.0) == 0
+    assert nruns(counter) == 1
+    os.remove(outfile)
+    assert result_cache.run_cached(command,[infile],[outfile],cachedir,1.0) == 0
+    assert nruns(counter) == 1
+    assert open(outfile).read() == 'input'
+
+
+def test_changed_input_or_command_misses(tmp_path):
+    cachedir = str(tmp_path/'CACHE')
+    infile,outfile,counter,command = setup_step(tmp_path)
+    result_cache.run_cached(command,[infile],[outfile],cachedir,1.0)
+    open(infile,'w').write('other input')
+    result_cache.run_cached(command,[infile],[outfile],cachedir,1.0)
+    assert nruns(counter) == 2
+    assert open(outfile).read() == 'other input'
+    result_cache.run_cached(command+' && true',[infile],[outfile],cachedir,1.0)
+    assert nruns(counter) == 3
+
+
+def test_failed_command_is_not_cached(tmp_path):
+    cachedir = str(tmp_path/'CACHE')
+    infile,outfile,counter,command = setup_step(tmp_path)
+    assert result_cache.run_cached(command+' && false',[infile],[outfile],cachedir,1.0) != 0
+    assert glob.glob(cachedir+'/*/manifest.json') == []
+
+
+def test_modified_entry_is_discarded(tmp_path):
+    cachedir = str(tmp_path/'CACHE')
+    infile,outfile,counter,command = setup_step(tmp_path)
+    result_cache.run_cached(command,[infile],[outfile],cachedir,1.0)
+    # The output shares its data with the cache entry
+    open(outfile,'a').write(' modified')
+    result_cache.run_cached(command,[infile],[outfile],cachedir,1.0)
+    assert nruns(counter) == 2
+    assert open(outfile).read() == 'input'
+
+
+def test_eviction_keeps_newest(tmp_path):
+    cachedir = str(tmp_path/'CACHE')
+    infile = tmp_path/'in.txt'
+    infile.write_text('x'*1000)
+    keys = []
+    for i in range(0,3):
+        outfile = str(tmp_path/('out'+str(i)+'.txt'))
+        command = 'cat '+str(infile)+' > '+outfile+' # '+str(i)
+        result_cache.run_cached(command,[str(infile)],[outfile],cachedir,1e-5)
+        keys.append(result_cache.cache_key(command,[str(infile)],{}))
+        manifest = cachedir+'/'+keys[-1]+'/manifest.json'
+        os.utime(manifest,(1000+i,1000+i))
+    # A quota of 10 kB holds all three entries, 1.5 kB only the newest
+    result_cache.evict(cachedir,1e-5)
+    assert len(glob.glob(cachedir+'/*/manifest.json')) == 3
+    result_cache.evict(cachedir,1.5e-6)
+    assert [os.path.isdir(cachedir+'/'+key) for key in keys] == [False,False,True]
+
+
+def test_in_place_step_is_not_cached(tmp_path):
+    cachedir = str(tmp_path/'CACHE')
+    infile,outfile,counter,command = setup_step(tmp_path)
+    command = 'echo more >> '+infile+' && echo run >> '+counter
+    for i in range(0,2):
+        assert result_cache.run_cached(command,[infile],[infile],cachedir,1.0) == 0
+    assert nruns(counter) == 2
+    assert not os.path.isdir(cachedir)
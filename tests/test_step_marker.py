@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+import numpy
+import os
+from astropy.io import fits
+
+from oxkat import step_marker
+
+
+def touch_later(path):
+    # Move the modification time on without changing the size
+    st = os.stat(path)
+    os.utime(path,ns=(st.st_atime_ns,st.st_mtime_ns+10**9))
+
+
+def make_step(tmp_path):
+    myms = tmp_path/'x.ms'
+    (myms/'FIELD').mkdir(parents=True)
+    (myms/'table.dat').write_bytes(b'main table')
+    (myms/'table.f0').write_bytes(b'\0'*64)
+    (myms/'FIELD'/'table.f0').write_bytes(b'\0'*16)
+    image = str(tmp_path/'img.fits')
+    fits.PrimaryHDU(numpy.zeros((8,8),dtype=numpy.float32)).writeto(image)
+    markers = tmp_path/'MARKERS'
+    markers.mkdir()
+    return str(markers),[str(myms)],[image]
+
+
+def record_step(markers,syscall,inputs,outputs):
+    spec_file = step_marker.write_spec(markers,'STEP1',syscall,inputs,outputs)
+    return step_marker.record(spec_file)
+
+
+def test_complete_after_record(tmp_path):
+    markers,inputs,outputs = make_step(tmp_path)
+    assert not step_marker.is_complete(markers,'STEP1','run',inputs,outputs)
+    assert record_step(markers,'run',inputs,outputs)
+    assert step_marker.is_complete(markers,'STEP1','run',inputs,outputs)
+    assert not step_marker.is_complete(markers,'STEP1','run --other',inputs,outputs)
+
+
+def test_input_changes_are_seen(tmp_path):
+    markers,inputs,outputs = make_step(tmp_path)
+    record_step(markers,'run',inputs,outputs)
+    touch_later(inputs[0]+'/table.f0')
+    assert not step_marker.is_complete(markers,'STEP1','run',inputs,outputs)
+
+    record_step(markers,'run',inputs,outputs)
+    touch_later(inputs[0]+'/FIELD/table.f0')
+    assert not step_marker.is_complete(markers,'STEP1','run',inputs,outputs)
+
+    record_step(markers,'run',inputs,outputs)
+    open(inputs[0]+'/table.f1','wb').close()
+    assert not step_marker.is_complete(markers,'STEP1','run',inputs,outputs)
+
+
+def test_outputs_in_place_and_missing(tmp_path):
+    markers,inputs,outputs = make_step(tmp_path)
+    record_step(markers,'run',inputs,outputs)
+    # Writing new pixel values keeps the structure of the output
+    with fits.open(outputs[0],mode='update') as hdul:
+        hdul[0].data[...] = 1.0
+    assert step_marker.is_complete(markers,'STEP1','run',inputs,outputs)
+    os.remove(outputs[0])
+    assert not step_marker.is_complete(markers,'STEP1','run',inputs,outputs)
+
+
+def test_never_complete_without_inputs_or_outputs(tmp_path):
+    markers,inputs,outputs = make_step(tmp_path)
+    record_step(markers,'run',[],outputs)
+    assert not step_marker.is_complete(markers,'STEP1','run',[],outputs)
+    record_step(markers,'run',inputs,[])
+    assert not step_marker.is_complete(markers,'STEP1','run',inputs,[])
+
+
+def test_no_marker_for_missing_outputs(tmp_path):
+    markers,inputs,outputs = make_step(tmp_path)
+    assert not record_step(markers,'run',inputs,outputs+[str(tmp_path/'missing.fits')])
+    assert not step_marker.is_complete(markers,'STEP1','run',inputs,outputs+[str(tmp_path/'missing.fits')])
+
+
+def make_ms(tmp_path,table_dat):
+    # Main table with DATA, FLAG, CORRECTED_DATA and the metadata columns
+    # in separate data managers, plus FIELD and HISTORY sub-tables
+    myms = tmp_path/'y.ms'
+    for sub in ['FIELD','HISTORY']:
+        (myms/sub).mkdir(parents=True)
+        (myms/sub/'table.f0').write_bytes(b'\0'*16)
+        (myms/sub/'table.lock').write_bytes(b'\0'*8)
+    columns = [(col,0) for col in step_marker.metadata_columns]
+    columns += [('DATA',1),('FLAG',2),('CORRECTED_DATA',3)]
+    table_dat(str(myms/'table.dat'),100,columns)
+    for seqnr in range(0,4):
+        (myms/('table.f%d' % seqnr)).write_bytes(b'\0'*64)
+        (myms/('table.f%d_TSM0' % seqnr)).write_bytes(b'\0'*64)
+    (myms/'table.lock').write_bytes(b'\0'*8)
+    markers = tmp_path/'MARKERS'
+    markers.mkdir()
+    return str(markers),str(myms)
+
+
+def record_columns(markers,myms,columns):
+    spec_file = step_marker.write_spec(markers,'STEP1','run',[myms],[myms],columns=columns)
+    assert step_marker.record(spec_file)
+    return step_marker.is_complete(markers,'STEP1','run',[myms],[myms],columns=columns)
+
+
+def test_lock_files_and_history_are_ignored(tmp_path,table_dat):
+    markers,myms = make_ms(tmp_path,table_dat)
+    assert record_columns(markers,myms,None)
+    for lock in ['table.lock','FIELD/table.lock','HISTORY/table.lock']:
+        open(os.path.join(myms,lock),'wb').write(b'\1'*8)
+    touch_later(myms+'/HISTORY/table.f0')
+    assert step_marker.is_complete(markers,'STEP1','run',[myms],[myms])
+    # Without declared columns any data file of the main table counts
+    touch_later(myms+'/table.f3_TSM0')
+    assert not step_marker.is_complete(markers,'STEP1','run',[myms],[myms])
+
+
+def test_only_columns_read_are_fingerprinted(tmp_path,table_dat):
+    markers,myms = make_ms(tmp_path,table_dat)
+    columns = ['DATA','FLAG']
+    assert record_columns(markers,myms,columns)
+    assert step_marker.content_fingerprint(myms,columns)['columns']['DATA'] == 1
+
+    # Writing CORRECTED_DATA, or adding MODEL_DATA in a new data manager
+    touch_later(myms+'/table.f3_TSM0')
+    table_dat(myms+'/table.dat',100,[(col,0) for col in step_marker.metadata_columns]+
+                [('DATA',1),('FLAG',2),('CORRECTED_DATA',3),('MODEL_DATA',4)])
+    open(myms+'/table.f4_TSM0','wb').close()
+    assert step_marker.is_complete(markers,'STEP1','run',[myms],[myms],columns=columns)
+
+    for changed in ['table.f2_TSM0','table.f0','FIELD/table.f0']:
+        assert record_columns(markers,myms,columns)
+        touch_later(os.path.join(myms,changed))
+        assert not step_marker.is_complete(markers,'STEP1','run',[myms],[myms],columns=columns)
+
+
+def test_unmapped_columns_fall_back_to_all_data_files(tmp_path):
+    markers,inputs,outputs = make_step(tmp_path)
+    # table.dat cannot be parsed, so every data file is used
+    assert record_columns(markers,inputs[0],['DATA'])
+    touch_later(inputs[0]+'/table.f0')
+    assert not step_marker.is_complete(markers,'STEP1','run',inputs,inputs,columns=['DATA'])
@@ -6,37 +6,11 @@
 
 
 import numpy
-import shutil
+import os.path as o
 import sys
-from astropy.io import fits
 from skued import azimuthal_average as aa
-
-
-def getImage(fitsfile):
-        input_hdu = fits.open(fitsfile)[0]
-        if len(input_hdu.data.shape) == 2:
-                image = numpy.array(input_hdu.data[:,:])
-        elif len(input_hdu.data.shape) == 3:
-                image = numpy.array(input_hdu.data[0,:,:])
-        elif len(input_hdu.data.shape) == 4:
-                image = numpy.array(input_hdu.data[0,0,:,:])
-        elif len(input_hdu.data.shape) == 5:
-                image = numpy.array(input_hdu.data[0,0,0,:,:])
-        return image
-
-
-def flushFits(newimage,fitsfile):
-        f = fits.open(fitsfile,mode='update')
-        input_hdu = f[0]
-        if len(input_hdu.data.shape) == 2:
-                input_hdu.data[:,:] = newimage
-        elif len(input_hdu.data.shape) == 3:
-                input_hdu.data[0,:,:] = newimage
-        elif len(input_hdu.data.shape) == 4:
-                input_hdu.data[0,0,:,:] = newimage
-        elif len(input_hdu.data.shape) == 5:
-                input_hdu.data[0,0,0,:,:] = newimage
-        f.flush()
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.fits_io import get_image, flush_fits, create_fits
 
 
 def main():
@@ -45,9 +19,9 @@ def main():
 
         output_fits = input_fits.replace('.fits','_azavg.fits')
 
-        shutil.copyfile(input_fits,output_fits)
+        create_fits(input_fits,output_fits)
 
-        input_img = getImage(input_fits)
+        input_img = get_image(input_fits)
         output_img = input_img * 0.0
         ny,nx = input_img.shape
         x0 = int(nx/2)
@@ -60,8 +34,7 @@ def main():
         		val = (((float(y)-y0)**2.0)+((float(x)-x0)**2.0))**0.5
         		output_img[y][x] = average[int(val)]
 
-        flushFits(output_img,output_fits)
-
+        flush_fits(output_img,output_fits)
 
 
 if __name__ == "__main__":
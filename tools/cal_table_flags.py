@@ -3,29 +3,32 @@
 
 
 import glob
-import numpy
+import os.path as o
 import sys
-from pyrap.tables import table
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.ms_flags import flag_stats
 
 
-def main():
+# Print the flagged percentage of each caltable matching a pattern, see
+# tools/flag_stats.py for the per-antenna, field, scan and channel values
+
 
-	pat = sys.argv[1]
+def main():
 
-	tabs = glob.glob('*'+pat+'*')
+    pat = sys.argv[1]
 
-	for tab in tabs:
+    tabs = sorted(glob.glob('*'+pat+'*'))
 
-		tt = table(tab)
+    for tab in tabs:
 
-		flags = tt.getcol('FLAG')
+        stats = flag_stats(tab)
 
-		flag_pc = 100.0 * round(flags.sum() / float(flags.size),2)
+        flag_pc = 100.0 * round(float(stats['flagged']) / max(float(stats['total']),1.0),2)
 
-		print tab,flag_pc
+        print(tab,flag_pc)
 
 
 if __name__ == "__main__":
 
 
-    main()
\ No newline at end of file
+    main()
@@ -6,6 +6,7 @@ import glob
 import logging
 import numpy
 import os
+import os.path as o
 import scipy.signal
 import shutil
 import sys
@@ -16,32 +17,8 @@ from astropy.io import fits
 from datetime import datetime
 from optparse import OptionParser
 
-
-def get_image(fitsfile):
-        input_hdu = fits.open(fitsfile)[0]
-        if len(input_hdu.data.shape) == 2:
-                image = numpy.array(input_hdu.data[:,:])
-        elif len(input_hdu.data.shape) == 3:
-                image = numpy.array(input_hdu.data[0,:,:])
-        elif len(input_hdu.data.shape) == 4:
-                image = numpy.array(input_hdu.data[0,0,:,:])
-        else:
-                image = numpy.array(input_hdu.data[0,0,0,:,:])
-        return image
-
-
-def flush_fits(newimage,fitsfile):
-        f = fits.open(fitsfile,mode='update')
-        input_hdu = f[0]
-        if len(input_hdu.data.shape) == 2:
-                input_hdu.data[:,:] = newimage
-        elif len(input_hdu.data.shape) == 3:
-                input_hdu.data[0,:,:] = newimage_
-        elif len(input_hdu.data.shape) == 4:
-                input_hdu.data[0,0,:,:] = newimage
-        else:
-                input_hdu.data[0,0,0,:,:] = newimage
-        f.flush()
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.fits_io import get_image, flush_fits, create_fits
 
 
 def drop_deg(fitsfile):
@@ -78,7 +55,6 @@ def beam_header(fitsfile,bmaj,bmin,bpa):
     outhdu.flush()  
 
 
-
 if __name__ == '__main__':
 
 
@@ -198,12 +174,12 @@ if __name__ == '__main__':
         if os.path.isfile(kernel_fits):
             # Special case to get around pypher's refusal to overwrite in all cases
             os.remove(kernel_fits)
-        shutil.copyfile(restored_fits,residual_conv_fits)
-        shutil.copyfile(restored_fits,restored_conv_fits)
-        shutil.copyfile(restored_fits,model_conv_fits)
+        create_fits(restored_fits,residual_conv_fits)
+        create_fits(restored_fits,restored_conv_fits)
+        create_fits(restored_fits,model_conv_fits)
         if template_fits != '':
-            shutil.copyfile(template_fits,target_beam_fits)
-            shutil.copyfile(template_fits,restoring_beam_fits)
+            create_fits(template_fits,target_beam_fits)
+            create_fits(template_fits,restoring_beam_fits)
         else:
             os.system('fitstool.py -z '+str(cropsize)+' -o '+target_beam_fits+' '+restored_fits)
             os.system('fitstool.py -z '+str(cropsize)+' -o '+restoring_beam_fits+' '+restored_fits)
@@ -1,35 +1,13 @@
-import numpy
+import os.path as o
 import sys
-from astropy.io import fits
 from scipy.ndimage.morphology import binary_dilation
-
-
-def getImage(fitsfile):
-	input_hdu = fits.open(fitsfile)[0]
-	if len(input_hdu.data.shape) == 2:
-	        image = numpy.array(input_hdu.data[:,:])
-	elif len(input_hdu.data.shape) == 3:
-	        image = numpy.array(input_hdu.data[0,:,:])
-	else:
-	        image = numpy.array(input_hdu.data[0,0,:,:])
-	return image
-
-
-def flushFits(newimage,fitsfile):
-	f = fits.open(fitsfile,mode='update')
-	input_hdu = f[0]
-	if len(input_hdu.data.shape) == 2:
-	        input_hdu.data[:,:] = newimage
-	elif len(input_hdu.data.shape) == 3:
-	        input_hdu.data[0,:,:] = newimage
-	else:
-	        input_hdu.data[0,0,:,:] = newimage
-	f.flush()
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.fits_io import get_image, flush_fits
 
 
 infits = sys.argv[1]
 niter = int(sys.argv[2])
 
-maskimage = getImage(infits)
+maskimage = get_image(infits)
 dilated = binary_dilation(input=maskimage,iterations=niter)
-flushFits(dilated,infits)
\ No newline at end of file
+flush_fits(dilated,infits)
\ No newline at end of file
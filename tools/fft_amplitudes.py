@@ -4,19 +4,11 @@
 
 import imageio
 import numpy
+import os.path as o
+import sys
 from argparse import ArgumentParser
-from astropy.io import fits
-    
-
-def get_image(fitsfile):
-    input_hdu = fits.open(fitsfile)[0]
-    if len(input_hdu.data.shape) == 2:
-            image = numpy.array(input_hdu.data[:,:])
-    elif len(input_hdu.data.shape) == 3:
-            image = numpy.array(input_hdu.data[0,:,:])
-    else:
-            image = numpy.array(input_hdu.data[0,0,:,:])
-    return image
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.fits_io import get_image
 
 
 def fft_image(image):
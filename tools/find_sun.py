@@ -4,24 +4,26 @@
 
 import logging
 import numpy
+import os.path as o
 import sys
-from pyrap.tables import table
 from astropy.time import Time
 from astropy import units as u
 from astropy.coordinates import SkyCoord
 from astropy.coordinates import solar_system_ephemeris, EarthLocation, AltAz
-from astropy.coordinates import get_body_barycentric, get_body, get_moon
+from astropy.coordinates import get_body
+from optparse import OptionParser
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.ms_catalogue import get_catalogue
 
 
 def rad2deg(xx):
     return 180.0*xx/numpy.pi
 
 
-def get_fields(myms):
-    fieldtab = table(myms+'/FIELD',ack=False)
-    ids = fieldtab.getcol("SOURCE_ID")
-    names = fieldtab.getcol("NAME")
-    dirs = fieldtab.getcol("PHASE_DIR")
+def get_fields(cat):
+    ids = numpy.array(cat['field']['source_id'])
+    names = cat['field']['name']
+    dirs = numpy.array(cat['field']['phase_dir'])
     return ids,names,dirs
 
 
@@ -32,35 +34,87 @@ def match_field(ids,names,dirs,i):
 
 
 def calcsep(ra0,dec0,ra1,dec1):
+    # Separations of arrays of positions, in degrees
     c0 = SkyCoord(ra0*u.deg,dec0*u.deg,frame='fk5')
     c1 = SkyCoord(ra1*u.deg,dec1*u.deg,frame='fk5')
-    sep = round(c0.separation(c1).deg,4)
+    sep = numpy.round(c0.separation(c1).deg,4)
     return sep 
 
 
 def format_coords(ra0,dec0):
     c = SkyCoord(ra0*u.deg,dec0*u.deg,frame='fk5')
-    hms = str(c.ra.to_string(u.hour))
-    dms = str(c.dec)
+    hms = c.ra.to_string(u.hour)
+    dms = c.dec.to_string(u.deg)
     return hms,dms
 
 
+def sample_times(index,nsamples):
+
+    """ Times to evaluate the ephemerides at, and the index of the scan
+    each belongs to. One sample per scan is its mean time, otherwise the
+    samples are spread evenly from the start to the end of each scan.
+    """
+
+    nscans = len(index['scans'])
+    if nsamples <= 1:
+        return index['tmean'],numpy.arange(0,nscans)
+    frac = numpy.linspace(0.0,1.0,nsamples)
+    times = index['t0'][:,None]+(index['t1']-index['t0'])[:,None]*frac[None,:]
+    return times.ravel(),numpy.repeat(numpy.arange(0,nscans),nsamples)
+
+
+def body_positions(body,t,loc):
+
+    """ RA, Dec and altitude (deg) of a solar system body for an array of
+    times, from a single ephemeris call and AltAz transform
+    """
+
+    with solar_system_ephemeris.set('builtin'):
+        pos = get_body(body,t,loc)
+    altaz = pos.transform_to(AltAz(obstime=t,location=loc))
+    return pos.ra.value,pos.dec.value,altaz.alt.value
+
+
 def main():
 
+    parser = OptionParser(usage='%prog [options] msname')
+    parser.add_option('--samples',dest='samples',help='Number of times per scan to evaluate the Sun and Moon positions at, spread from the start to the end of the scan (default = 1, the mean time of the scan)',default=1)
+    (options,args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.print_help()
+        sys.exit(1)
+
     # MeerKAT
     obs_lat = -30.71323598930457
     obs_lon = 21.443001467965008
     loc = EarthLocation.from_geodetic(obs_lat,obs_lon) #,obs_height,ellipsoid)
 
 
-    myms = sys.argv[1].rstrip('/')
-    maintab = table(myms,ack=False)
-    scans = list(numpy.unique(maintab.getcol('SCAN_NUMBER')))
-    ids,names,dirs = get_fields(myms)
+    myms = args[0].rstrip('/')
+    cat = get_catalogue(myms)
+    index = cat['scans']
+    scans = index['scans']
+    ids,names,dirs = get_fields(cat)
 
     logfile = 'sun_'+myms+'.log'
     logging.basicConfig(filename=logfile, level=logging.DEBUG, format='%(asctime)s |  %(message)s', datefmt='%d/%m/%Y %H:%M:%S ')
 
+    # All of the times are evaluated together
+    t_samples,scan_idx = sample_times(index,int(options.samples))
+    t = Time(t_samples/86400.0,format='mjd')
+    sun_ra,sun_dec,sun_alt = body_positions('Sun',t,loc)
+    moon_ra,moon_dec,moon_alt = body_positions('Moon',t,loc)
+    sun_hms,sun_dms = format_coords(sun_ra,sun_dec)
+    moon_hms,moon_dms = format_coords(moon_ra,moon_dec)
+
+    fields = index['field'][scan_idx].astype(int)
+    field_radec = dict([(field,match_field(ids,names,dirs,field)[1:]) for field in numpy.unique(fields)])
+    field_ra = numpy.array([field_radec[field][0] for field in fields])
+    field_dec = numpy.array([field_radec[field][1] for field in fields])
+    sun_sep = calcsep(field_ra,field_dec,sun_ra,sun_dec)
+    moon_sep = calcsep(field_ra,field_dec,moon_ra,moon_dec)
+    t_iso = t.iso
 
     logging.info(myms+' | '+str(len(ids))+' fields | '+str(len(scans))+' scans')
     #header = 'Scan  Field        ID    t[iso]                    t[s]                 t0[s]                t1[s]                int0    int1    Duration[m]  N_int'
@@ -68,35 +122,27 @@ def main():
     logging.info('-'*len(header))
     logging.info(header)
     logging.info('-'*len(header))
-    for scan in scans:
-        subtab = maintab.query(query='SCAN_NUMBER=='+str(scan))
-        field = numpy.unique(subtab.getcol('FIELD_ID'))[0]
-        name,field_ra,field_dec = match_field(ids,names,dirs,field)
-        field_hms,field_dms = format_coords(field_ra,field_dec)
-        t_scan = numpy.mean(subtab.getcol('TIME'))
-        t = Time(t_scan/86400.0,format='mjd')
-        with solar_system_ephemeris.set('builtin'):
-            sun = get_body('Sun', t, loc)
-            moon = get_body('Moon', t, loc)
-        sun_ra = sun.ra.value
-        sun_dec = sun.dec.value
-        sun_altaz = sun.transform_to(AltAz(obstime=t,location=loc))
-        sun_alt = sun_altaz.alt.value
-        moon_ra = moon.ra.value
-        moon_dec = moon.dec.value
-        moon_altaz = moon.transform_to(AltAz(obstime=t,location=loc))
-        moon_alt = moon_altaz.alt.value
-        sun_hms,sun_dms = format_coords(sun_ra,sun_dec)
-        moon_hms,moon_dms = format_coords(moon_ra,moon_dec)
-        delta_ra_sun = field_ra - sun_ra
-        delta_dec_sun = field_dec - sun_dec
-        delta_ra_moon = field_ra - moon_ra
-        delta_dec_moon = field_dec - moon_dec
-        sun_sep = calcsep(field_ra,field_dec,sun_ra,sun_dec)
-        moon_sep = calcsep(field_ra,field_dec,moon_ra,moon_dec)
+    for i in range(0,len(t_samples)):
+        scan = int(scans[scan_idx[i]])
+        field = fields[i]
+        name = names[field]
     #   print field,name,sun_sep
         logging.info('%-28s %-5i %-5i %-12s %-12f %-12f %-16s %-16s %-12f %-12f %-12f %-12f %-16s %-16s %-12f %-12f' %
-            (t.iso,scan,field,name,sun_ra,sun_dec,sun_hms,sun_dms,sun_sep,sun_alt,moon_ra,moon_dec,moon_hms,moon_dms,moon_sep,moon_alt))
+            (t_iso[i],scan,field,name,sun_ra[i],sun_dec[i],sun_hms[i],sun_dms[i],sun_sep[i],sun_alt[i],moon_ra[i],moon_dec[i],moon_hms[i],moon_dms[i],moon_sep[i],moon_alt[i]))
+
+    logging.info('-'*len(header))
+
+    # Closest approach per field, over the times when the Sun is up
+    for field in numpy.unique(fields):
+        mask = fields == field
+        up = mask & (sun_alt > 0.0)
+        txt = names[field]+': min Sun separation '+str(numpy.min(sun_sep[mask]))+' deg'
+        if numpy.any(up):
+            txt += ' ('+str(numpy.min(sun_sep[up]))+' deg with the Sun up)'
+        else:
+            txt += ' (Sun never up)'
+        txt += ', min Moon separation '+str(numpy.min(moon_sep[mask]))+' deg'
+        logging.info(txt)
 
     logging.info('-'*len(header))
 
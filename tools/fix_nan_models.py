@@ -1,30 +1,9 @@
 import sys
 import glob
 import numpy
-from astropy.io import fits
-
-
-def get_image(fitsfile):
-    input_hdu = fits.open(fitsfile)[0]
-    if len(input_hdu.data.shape) == 2:
-            image = numpy.array(input_hdu.data[:,:])
-    elif len(input_hdu.data.shape) == 3:
-            image = numpy.array(input_hdu.data[0,:,:])
-    else:
-            image = numpy.array(input_hdu.data[0,0,:,:])
-    return image
-
-
-def flush_fits(newimage,fitsfile):
-    f = fits.open(fitsfile,mode='update')
-    input_hdu = f[0]
-    if len(input_hdu.data.shape) == 2:
-            input_hdu.data[:,:] = newimage
-    elif len(input_hdu.data.shape) == 3:
-            input_hdu.data[0,:,:] = newimage
-    else:
-            input_hdu.data[0,0,:,:] = newimage
-    f.flush()
+import os.path as o
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.fits_io import get_image, flush_fits
 
 
 pattern = sys.argv[1]
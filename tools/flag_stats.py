@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+# Flag statistics of Measurement Sets and CASA calibration tables, from a
+# single chunked pass over the FLAG column (see oxkat/ms_flags.py).
+#
+# Usage: python tools/flag_stats.py [options] table [table ...]
+#
+# For each table the flagged percentages per antenna, field, scan and SPW
+# are written to <outdir>/<table>[_<tag>].flagstats.json, the counts
+# (including per baseline and per channel) to the matching .npz, and the
+# overall, per-field and worst antenna percentages are printed.
+
+
+import os.path as o
+import sys
+import numpy
+from optparse import OptionParser
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.ms_flags import flag_stats, percentage, write_stats
+
+
+def main():
+
+    parser = OptionParser(usage='%prog [options] table [table ...]')
+    parser.add_option('--field',dest='field',help='Only count this FIELD_ID (default = all)',default='')
+    parser.add_option('--outdir',dest='outdir',help='Folder for the summary files (default = current folder)',default='.')
+    parser.add_option('--tag',dest='tag',help='Tag added to the summary file names, e.g. the flagging step',default='')
+    parser.add_option('--top',dest='top',help='Number of worst antennas to list (default = 10)',default=10)
+    parser.add_option('--rowchunk',dest='rowchunk',help='Rows per chunk (default = from available memory)',default=0)
+    (options,args) = parser.parse_args()
+
+    if len(args) == 0:
+        parser.print_help()
+        sys.exit(1)
+
+    field_id = None
+    if options.field != '':
+        field_id = int(options.field)
+
+    for tab in args:
+
+        tab = tab.rstrip('/')
+        stats = flag_stats(tab,field_id,int(options.rowchunk))
+        json_file,npz_file = write_stats(tab,stats,options.outdir,options.tag)
+
+        total = float(stats['total'])
+        print(tab)
+        if total == 0:
+            print('   No unflagged or flagged data selected')
+            continue
+        print('   Flagged: '+str(round(100.0*float(stats['flagged'])/total,2))+'%')
+
+        field_pc = percentage(stats['field_flagged'],stats['field_total'])
+        for field,pc in zip(stats['fields'],field_pc):
+            name = stats['field_names'][field] if field < len(stats['field_names']) else str(field)
+            print('   Field '+str(field)+' '+name+': '+str(round(pc,2))+'%')
+
+        ant_pc = percentage(stats['antenna_flagged'],stats['antenna_total'])
+        present = numpy.where(~numpy.isnan(ant_pc))[0]
+        worst = present[numpy.argsort(ant_pc[present])[::-1]][0:int(options.top)]
+        print('   Worst antennas: '+', '.join([stats['antenna_names'][i]+' '+str(round(ant_pc[i],1))+'%' for i in worst]))
+        print('   Written '+json_file+' and '+npz_file)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -1,49 +1,160 @@
+import ast
 import numpy
-import shutil
+import os.path as o
 import sys
+import time
 from astropy.io import fits
+from concurrent.futures import ThreadPoolExecutor
+from optparse import OptionParser
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.fits_io import get_data, create_fits
 
 
-def getImage(fitsfile):
-	input_hdu = fits.open(fitsfile)[0]
-	if len(input_hdu.data.shape) == 2:
-	        image = numpy.array(input_hdu.data[:,:])
-	elif len(input_hdu.data.shape) == 3:
-	        image = numpy.array(input_hdu.data[0,:,:])
-	else:
-	        image = numpy.array(input_hdu.data[0,0,:,:])
-	return image
-
-
-def flushFits(newimage,fitsfile):
-	f = fits.open(fitsfile,mode='update')
-	input_hdu = f[0]
-	if len(input_hdu.data.shape) == 2:
-	        input_hdu.data[:,:] = newimage
-	elif len(input_hdu.data.shape) == 3:
-	        input_hdu.data[0,:,:] = newimage
-	else:
-	        input_hdu.data[0,0,:,:] = newimage
-	f.flush()
-
-
-im1 = sys.argv[1]
-operator = sys.argv[2]
-im2 = sys.argv[3]
-out = sys.argv[4]
-
-shutil.copyfile(im1,out)
-
-data1 = getImage(im1)
-data2 = getImage(im2)
-
-if operator == 'plus':
-	dataout = data1+data2
-elif operator == 'minus':
-	dataout = data1-data2
-elif operator == 'times':
-	dataout = data1*data2
-elif operator == 'over':
-	dataout = data1/data2
-
-flushFits(dataout,out)
+# Evaluate an arithmetic expression over a set of named FITS images, e.g.
+#
+#	image_maths.py --expr '(a-b)*m/pb' a=img1.fits b=img2.fits m=mask.fits pb=pb.fits -o out.fits
+#
+# Inputs are memory-mapped and the expression is evaluated in blocks of
+# rows by a pool of threads, so memory use is bounded by the block size
+# rather than the image size. An input with a single plane is broadcast
+# across all planes of a cube.
+#
+# The original form is still supported:
+#
+#	image_maths.py img1.fits plus|minus|times|over img2.fits out.fits
+
+
+operators = {'plus':'a+b','minus':'a-b','times':'a*b','over':'a/b'}
+
+functions = {'abs':numpy.abs,'sqrt':numpy.sqrt,'exp':numpy.exp,
+	'log':numpy.log,'log10':numpy.log10,'sin':numpy.sin,'cos':numpy.cos,
+	'minimum':numpy.minimum,'maximum':numpy.maximum,'where':numpy.where,
+	'isnan':numpy.isnan,'isfinite':numpy.isfinite,'nan_to_num':numpy.nan_to_num}
+
+constants = {'pi':numpy.pi,'nan':numpy.nan,'inf':numpy.inf}
+
+allowed_nodes = (ast.Expression,ast.BinOp,ast.UnaryOp,ast.Compare,ast.Call,
+	ast.Name,ast.Load,ast.Constant,ast.Add,ast.Sub,ast.Mult,ast.Div,
+	ast.FloorDiv,ast.Mod,ast.Pow,ast.USub,ast.UAdd,ast.Invert,ast.BitAnd,
+	ast.BitOr,ast.BitXor,ast.Lt,ast.LtE,ast.Gt,ast.GtE,ast.Eq,ast.NotEq)
+
+
+def msg(txt):
+	stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+	print(stamp+txt)
+
+
+def compile_expr(expr,names):
+	# Parse expr and reject anything other than arithmetic on the named
+	# images, the numerical constants and the whitelisted functions
+	tree = ast.parse(expr,mode='eval')
+	for node in ast.walk(tree):
+		if not isinstance(node,allowed_nodes):
+			raise ValueError('Unsupported syntax in expression: '+type(node).__name__)
+		if isinstance(node,ast.Call) and (not isinstance(node.func,ast.Name) or node.func.id not in functions):
+			raise ValueError('Unsupported function in expression: '+ast.dump(node.func))
+		if isinstance(node,ast.Name) and node.id not in names and node.id not in functions and node.id not in constants:
+			raise ValueError('Unknown image name in expression: '+node.id)
+	return compile(tree,'<expr>','eval')
+
+
+def get_rows(fitsfile):
+	# Memory-mapped data viewed as (nplanes,ny,nx)
+	data = get_data(fitsfile)
+	ny,nx = data.shape[-2:]
+	return data.reshape((-1,ny,nx))
+
+
+def get_blocks(nplanes,ny,blockrows):
+	blocks = []
+	for plane in range(0,nplanes):
+		for row0 in range(0,ny,blockrows):
+			blocks.append((plane,row0,min(row0+blockrows,ny)))
+	return blocks
+
+
+def evaluate(code,inputs,output,blocks,nthreads):
+
+	def do_block(block):
+		plane,row0,row1 = block
+		namespace = dict(functions)
+		namespace.update(constants)
+		for name in inputs:
+			data = inputs[name]
+			if data.shape[0] == 1:
+				namespace[name] = numpy.asarray(data[0,row0:row1,:],dtype=numpy.float64)
+			else:
+				namespace[name] = numpy.asarray(data[plane,row0:row1,:],dtype=numpy.float64)
+		output[plane,row0:row1,:] = eval(code,{'__builtins__':{}},namespace)
+
+	with ThreadPoolExecutor(max_workers=nthreads) as executor:
+		for result in executor.map(do_block,blocks):
+			pass
+
+
+def main():
+
+	parser = OptionParser(usage = '%prog [options] name1=image1.fits name2=image2.fits ...')
+	parser.add_option('--expr', dest = 'expr', help = 'Expression to evaluate, e.g. "(a-b)*m/pb"', default = '')
+	parser.add_option('-o', '--output', dest = 'outfits', help = 'Output FITS image', default = '')
+	parser.add_option('--template', dest = 'template', help = 'Name of the input to take the output header from (default = largest input)', default = '')
+	parser.add_option('--nthreads', dest = 'nthreads', help = 'Number of threads (default = 4)', default = 4)
+	parser.add_option('--blockrows', dest = 'blockrows', help = 'Rows per block (default = auto, ~32 MB per input)', default = 0)
+	(options,args) = parser.parse_args()
+	expr = options.expr
+	outfits = options.outfits
+	template = options.template
+	nthreads = int(options.nthreads)
+	blockrows = int(options.blockrows)
+
+	if expr == '' and len(args) == 4 and args[1] in operators:
+		expr = operators[args[1]]
+		outfits = args[3]
+		args = ['a='+args[0],'b='+args[2]]
+
+	if expr == '' or outfits == '' or len(args) == 0:
+		parser.print_help()
+		sys.exit()
+
+	filenames = {}
+	for arg in args:
+		if '=' not in arg:
+			msg('Please give inputs as name=image.fits')
+			sys.exit()
+		name,fitsfile = arg.split('=',1)
+		filenames[name] = fitsfile
+
+	try:
+		code = compile_expr(expr,filenames)
+	except (SyntaxError,ValueError) as err:
+		msg('Could not parse expression: '+str(err))
+		sys.exit()
+
+	inputs = {}
+	for name in filenames:
+		inputs[name] = get_rows(filenames[name])
+		msg(name+' = '+filenames[name]+' '+str(inputs[name].shape))
+
+	if template == '':
+		template = max(inputs,key=lambda x: inputs[x].shape[0])
+	nplanes,ny,nx = inputs[template].shape
+	for name in inputs:
+		if inputs[name].shape[1:] != (ny,nx) or inputs[name].shape[0] not in (1,nplanes):
+			msg('Image '+name+' does not match the shape of '+template)
+			sys.exit()
+
+	if blockrows <= 0:
+		blockrows = max(1,int(32e6/(8*nx)))
+	blocks = get_blocks(nplanes,ny,blockrows)
+
+	msg('Evaluating '+expr+' in '+str(len(blocks))+' block(s) of '+str(blockrows)+' rows with '+str(nthreads)+' thread(s)')
+	create_fits(filenames[template],outfits,bitpix=-32,copy=False)
+	with fits.open(outfits,mode='update',memmap=True) as hdul:
+		output = hdul[0].data.reshape((-1,ny,nx))
+		evaluate(code,inputs,output,blocks,nthreads)
+	msg('Wrote '+outfits)
+
+
+if __name__ == "__main__":
+
+	main()
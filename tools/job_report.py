@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+
+
+# Summarise the resource usage of the pipeline steps, per recipe, from the
+# telemetry records written by oxkat/step_telemetry.py to LOGS/telemetry.
+#
+# Usage: python tools/job_report.py [options] [LOGS]
+#
+# For each recipe two tables are printed: the slowest steps, and the steps
+# whose requests were furthest from what they used, ranked by the idle
+# memory reservation (GB hours). Steps that only have the ****ELAPSED line
+# in their log (i.e. scripts generated without telemetry) are listed with
+# their wall time only.
+
+
+import glob
+import json
+import os
+import re
+import sys
+from optparse import OptionParser
+
+
+def load_records(logs,latest=True):
+    # Telemetry records, keeping only the latest run of each step by default
+    records = []
+    for jsonfile in sorted(glob.glob(logs+'/telemetry/*.json')):
+        try:
+            with open(jsonfile) as f:
+                records.append(json.load(f))
+        except ValueError:
+            print('Could not read '+jsonfile)
+    if latest:
+        newest = {}
+        for record in records:
+            key = (record['recipe'],record['id'])
+            if key not in newest or record['start'] > newest[key]['start']:
+                newest[key] = record
+        records = list(newest.values())
+    return records
+
+
+def load_elapsed(logs,known_ids):
+    # Wall times from the ****ELAPSED lines of logs without a telemetry record
+    records = []
+    pattern = re.compile(r'\*\*\*\*ELAPSED\s+(\d+)\s+"?([^"\s]+)"?')
+    for logfile in sorted(glob.glob(logs+'/*.log')):
+        f = open(logfile,'r',errors='replace')
+        for line in f:
+            match = pattern.search(line)
+            if match and match.group(2) not in known_ids:
+                records.append({'id':match.group(2),'recipe':'untracked','wall_s':float(match.group(1))})
+        f.close()
+    return records
+
+
+def fmt(value,ndp=1):
+    if value is None:
+        return '-'
+    if ndp == 0:
+        return str(int(round(value)))
+    return str(round(value,ndp))
+
+
+def print_table(title,records):
+    print('')
+    print('  '+title)
+    print('  '+'ID'.ljust(16)+'Wall (h)'.rjust(10)+'Req (h)'.rjust(10)+'CPU %'.rjust(8)+
+            'Peak (GB)'.rjust(11)+'Req (GB)'.rjust(10)+'Mem %'.rjust(8)+'Read (GB)'.rjust(11)+
+            'Write (GB)'.rjust(12)+'Idle GBh'.rjust(10))
+    for record in records:
+        wall_h = record['wall_s']/3600.0
+        req_mem = record.get('req_mem_gb')
+        peak = record.get('peak_rss_gb')
+        mem_pc = None
+        if req_mem and peak is not None:
+            mem_pc = 100.0*peak/req_mem
+        cpu_pc = None
+        if 'cpu_util' in record:
+            cpu_pc = 100.0*record['cpu_util']
+        status = ''
+        if record.get('returncode',0) != 0:
+            status = '  (exit '+str(record['returncode'])+')'
+        print('  '+record['id'].ljust(16)+fmt(wall_h,2).rjust(10)+fmt(record.get('req_hours')).rjust(10)+
+            fmt(cpu_pc,0).rjust(8)+fmt(peak).rjust(11)+fmt(req_mem,0).rjust(10)+fmt(mem_pc,0).rjust(8)+
+            fmt(record.get('read_gb')).rjust(11)+fmt(record.get('write_gb')).rjust(12)+
+            fmt(record.get('idle_gbh')).rjust(10)+status)
+
+
+def main():
+
+    parser = OptionParser(usage = '%prog [options] [LOGS folder]')
+    parser.add_option('--recipe', dest = 'recipe', help = 'Only report this recipe (e.g. 2GC)', default = '')
+    parser.add_option('--top', dest = 'top', help = 'Number of steps per table (default = 10)', default = 10)
+    parser.add_option('--all', dest = 'latest', help = 'Include every run of each step (default = latest run only)', action = 'store_false', default = True)
+    (options,args) = parser.parse_args()
+    top = int(options.top)
+
+    if len(args) > 0:
+        logs = args[0].rstrip('/')
+    else:
+        logs = 'LOGS'
+
+    if not os.path.isdir(logs):
+        print(logs+' not found')
+        sys.exit()
+
+    records = load_records(logs,options.latest)
+    records += load_elapsed(logs,set([record['id'] for record in records]))
+
+    if options.recipe != '':
+        records = [record for record in records if record['recipe'] == options.recipe]
+
+    if len(records) == 0:
+        print('No step records found in '+logs)
+        sys.exit()
+
+    for record in records:
+        if record.get('req_mem_gb') and record.get('peak_rss_gb') is not None:
+            idle = max(record['req_mem_gb']-record['peak_rss_gb'],0.0)
+            record['idle_gbh'] = idle*record['wall_s']/3600.0
+
+    recipes = sorted(set([record['recipe'] for record in records]))
+    for recipe in recipes:
+        subset = [record for record in records if record['recipe'] == recipe]
+        total_h = sum([record['wall_s'] for record in subset])/3600.0
+        print('')
+        print('Recipe '+recipe+': '+str(len(subset))+' steps, '+fmt(total_h,2)+' hours of wall time')
+
+        slowest = sorted(subset,key=lambda x: x['wall_s'],reverse=True)[0:top]
+        print_table('Slowest steps',slowest)
+
+        tracked = [record for record in subset if 'idle_gbh' in record]
+        if len(tracked) > 0:
+            overprovisioned = sorted(tracked,key=lambda x: x['idle_gbh'],reverse=True)[0:top]
+            print_table('Most over-provisioned steps (idle memory reservation)',overprovisioned)
+
+    print('')
+
+
+if __name__ == "__main__":
+
+    main()
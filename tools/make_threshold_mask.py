@@ -2,34 +2,12 @@
 # ianh@astro.ox.ac.uk
 
 
-from astropy.io import fits
 from scipy.ndimage.morphology import binary_dilation
-from shutil import copyfile
 import numpy
+import os.path as o
 import sys
-
-
-def getImage(fitsfile):
-	input_hdu = fits.open(fitsfile)[0]
-	if len(input_hdu.data.shape) == 2:
-	        image = numpy.array(input_hdu.data[:,:])
-	elif len(input_hdu.data.shape) == 3:
-	        image = numpy.array(input_hdu.data[0,:,:])
-	else:
-	        image = numpy.array(input_hdu.data[0,0,:,:])
-	return image
-
-
-def flushFits(newimage,fitsfile):
-	f = fits.open(fitsfile,mode='update')
-	input_hdu = f[0]
-	if len(input_hdu.data.shape) == 2:
-	        input_hdu.data[:,:] = newimage
-	elif len(input_hdu.data.shape) == 3:
-	        input_hdu.data[0,:,:] = newimage
-	else:
-	        input_hdu.data[0,0,:,:] = newimage
-	f.flush()
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.fits_io import get_image, flush_fits, create_fits
 
 
 def main():
@@ -40,16 +18,16 @@ def main():
 	thresh_str = '.thresh'+str(thresh).replace('.','p')+'.mask.fits'
 	opfits = infits.replace('.fits',thresh_str)
 
-	copyfile(infits,opfits)
+	create_fits(infits,opfits)
 
-	img = getImage(infits)
+	img = get_image(infits)
 	maskimg = img * 0.0
 	mask = img > thresh
 	maskimg[mask] = 1.0
 
 	maskimg = binary_dilation(maskimg,iterations=2)
 
-	flushFits(maskimg,opfits)
+	flush_fits(maskimg,opfits)
 
 
 if __name__ == "__main__":
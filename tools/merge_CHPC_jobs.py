@@ -5,6 +5,9 @@
 # Usage: python tools/merge_CHPC_1GC_jobs.py <submit_jobs.sh>
 # Will merge all the sequential jobs in the submit_jobs.sh script into a single submission
 # in an attempt to get around the haunted job queue.
+# Dependencies between the steps are lost, so any failure goes unnoticed. Setting
+# PACK_JOBS = True in oxkat/config.py instead packs runs of short steps into single
+# jobs when the scripts are generated, on Slurm or PBS, keeping their dependencies.
 
 
 import sys
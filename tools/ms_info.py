@@ -3,13 +3,15 @@
 
 
 import logging
+import os.path as o
 import sys
 import numpy
 from astropy.coordinates import SkyCoord
 from astropy import units as u
 from astropy.time import Time
-from pyrap.tables import table
 from optparse import OptionParser
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.ms_catalogue import get_catalogue
 
 
 def rad2deg(xx):
@@ -54,51 +56,37 @@ def main():
 
     # ------- GETTING INFORMATION -------
 
-    fldtab = table(myms+'/FIELD',ack=False)
-    names = fldtab.getcol('NAME')
-    ids = fldtab.getcol('SOURCE_ID')
-    dirs = fldtab.getcol('PHASE_DIR')
-    fldtab.done()
-
-    statetab = table(myms+'/STATE',ack=False)
-    modes = statetab.getcol('OBS_MODE')
-    statetab.done()
-
-    maintab = table(myms,ack=False)
-    meanexp = round(numpy.mean(maintab.getcol('EXPOSURE')),2)
-    times = maintab.getcol('TIME')
-    t0 = times[0]
-    t1 = times[-1]
+    cat = get_catalogue(myms)
+
+    names = cat['field']['name']
+    ids = cat['field']['source_id']
+    dirs = numpy.array(cat['field']['phase_dir'])
+
+    modes = cat['state']['obs_mode']
+
+    index = cat['scans']
+    meanexp = round(index['mean_exposure'],2)
+    t0 = index['times'][0]
+    t1 = index['times'][-1]
     length = round((t1 - t0),0)
 
     start_time = Time(t0/86400.0,format='mjd').iso
     end_time = Time(t1/86400.0,format='mjd').iso
 
-    chanwidths = []
-    spwtab = table(myms+'/SPECTRAL_WINDOW',ack=False)
-    nspw = len(spwtab)
-    spwnames = spwtab.getcol('NAME')
-    spwfreqs = spwtab.getcol('REF_FREQUENCY')
-    for name in spwnames:
-            subtab = spwtab.query(query='NAME=="'+name+'"')
-            chanwidth = subtab.getcol('CHAN_WIDTH')[0][0]/1e6
-            chanwidths.append(chanwidth)
-    nchans = spwtab.getcol('NUM_CHAN')
-    spwtab.done()
+    spwnames = cat['spw']['name']
+    nspw = len(spwnames)
+    spwfreqs = cat['spw']['ref_frequency']
+    chanwidths = [x/1e6 for x in cat['spw']['chan_width']]
+    nchans = cat['spw']['num_chan']
 
     scanlist = []
-    scans = numpy.unique(maintab.getcol('SCAN_NUMBER'))
-    for sc in scans:
-            subtab = maintab.query(query='SCAN_NUMBER=='+str(sc))
-            st0 = subtab.getcol('TIME')[0]
-            st1 = subtab.getcol('TIME')[-1]
-            sfield = numpy.unique(subtab.getcol('FIELD_ID'))[0]
-            if 'STATE_ID' in subtab.colnames():
-                ii = numpy.unique(subtab.getcol('STATE_ID'))
-                if ii[0] > 0:
-                    sintent = modes[ii[0]]
-                else:
-                    sintent = 'None'
+    for i in range(0,len(index['scans'])):
+            sc = int(index['scans'][i])
+            st0 = index['t0'][i]
+            st1 = index['t1'][i]
+            sfield = int(index['field'][i])
+            if index['state'][i] > 0:
+                sintent = modes[index['state'][i]]
             else:
                 sintent = 'None'
             st = round((st1-st0),0)
@@ -113,18 +101,11 @@ def main():
                 tot += float(sc[2])
         field_integrations.append((fld,tot))
 
-    anttab = table(myms+'/ANTENNA',ack=False)
-    nant = len(anttab)
-    antpos = anttab.getcol('POSITION')
-    antnames = anttab.getcol('NAME')
-    anttab.done()
-
-    A1 = numpy.unique(maintab.getcol('ANTENNA1'))
-    A2 = numpy.unique(maintab.getcol('ANTENNA2'))
-
-    usedants = numpy.unique(numpy.concatenate((A1,A2)))
+    antnames = cat['antenna']['name']
+    antpos = numpy.array(cat['antenna']['position'])
+    nant = len(antnames)
 
-    maintab.done()
+    usedants = index['antennas']
 
     # ------- PRINTING INFORMATION -------
 
@@ -7,15 +7,22 @@
 # https://pypi.org/project/scikit-ued/
 
 
+import glob
+import hashlib
 import numpy
 import os
+import os.path as o
+import shutil
 import sys
+import tempfile
 import time
 from astropy.io import fits
 from katbeam import JimBeam
+from multiprocessing import Pool
 from optparse import OptionParser
-from shutil import copyfile
 
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.fits_io import get_image, flush_fits, create_fits, get_nplanes
 
 
 def msg(txt):
@@ -48,29 +55,206 @@ def get_header(fitsfile,freqaxis):
     return nx,ny,dx,dy,freq
 
 
-def get_image(fitsfile):
-    input_hdu = fits.open(fitsfile)[0]
-    if len(input_hdu.data.shape) == 2:
-            image = numpy.array(input_hdu.data[:,:])
-    elif len(input_hdu.data.shape) == 3:
-            image = numpy.array(input_hdu.data[0,:,:])
-    else:
-            image = numpy.array(input_hdu.data[0,0,:,:])
-    return image
+radius_maps = {}
 
+def get_radius_map(nx,ny,x0,y0):
+    # Integer pixel radius from (x0,y0), computed once per image geometry
+    # and built in row blocks to keep the float temporaries small
+    key = (nx,ny,x0,y0)
+    if key not in radius_maps:
+        xx = (numpy.arange(nx,dtype=numpy.float64)-x0)**2.0
+        radius = numpy.empty((ny,nx),dtype=numpy.int32)
+        rowchunk = max(1,int(1e7/nx))
+        for y in range(0,ny,rowchunk):
+            yy = (numpy.arange(y,min(y+rowchunk,ny),dtype=numpy.float64)-y0)**2.0
+            radius[y:y+len(yy),:] = numpy.sqrt(yy[:,None]+xx[None,:])
+        radius_maps[key] = radius
+    return radius_maps[key]
 
-def flush_fits(newimage,fitsfile):
-    f = fits.open(fitsfile,mode='update')
-    input_hdu = f[0]
-    if len(input_hdu.data.shape) == 2:
-            input_hdu.data[:,:] = newimage
-    elif len(input_hdu.data.shape) == 3:
-            input_hdu.data[0,:,:] = newimage
-    else:
-            input_hdu.data[0,0,:,:] = newimage
-    f.flush()
+
+def azavg_fill(average,nx,ny,x0,y0):
+    # Fill an image with the radial profile via a single indexed gather
+    radius = get_radius_map(nx,ny,x0,y0)
+    return average[radius]
+
+
+def make_beam(beam_model,nx,dx,freq,pbcut,azavg):
+    # Evaluate, mask and (optionally) azimuthally average the beam pattern
+    beam = JimBeam(beam_model)
+    extent = nx*dx # degrees
+    msg('Evaluating beam at '+str(round(freq,4))+' MHz')
+    interval = numpy.linspace(-extent/2.0,extent/2.0,nx)
+    xx,yy = numpy.meshgrid(interval,interval)
+    beam_image = beam.I(xx,yy,freq)
+
+    msg('Masking beam beyond the '+str(pbcut)+' level')
+    mask = beam_image < pbcut
+    beam_image[mask] = numpy.nan
+
+    if azavg:
+        from skued import azimuthal_average as aa
+        msg('Azimuthally averaging the beam pattern')
+        x0 = int(nx/2)
+        y0 = int(nx/2)
+        radius,average = aa(beam_image,center=(x0,y0))
+        beam_image = azavg_fill(average,nx,nx,x0,y0)
+
+    return beam_image
+
+
+def beam_cache_key(band,beam_model,nx,dx,freq,pbcut,azavg):
+    # Hash of everything that determines the final beam image
+    keystr = '|'.join([band,beam_model,str(nx),repr(float(dx)),repr(float(freq)),repr(float(pbcut)),str(azavg)])
+    return hashlib.sha1(keystr.encode()).hexdigest()
+
+
+def beam_cache_file(cachedir,key):
+    return cachedir+'/beam_'+key+'.npy'
+
+
+def get_cached_beam(cachedir,key):
+    # Return a read-only memory-mapped beam, or None on a cache miss
+    npyfile = beam_cache_file(cachedir,key)
+    if not os.path.isfile(npyfile):
+        return None
+    os.utime(npyfile) # mark as recently used
+    return numpy.load(npyfile,mmap_mode='r')
+
+
+def put_cached_beam(cachedir,key,beam_image,cachesize):
+    # Write atomically so that concurrent jobs never see a partial file
+    if not os.path.isdir(cachedir):
+        os.makedirs(cachedir,exist_ok=True)
+    npyfile = beam_cache_file(cachedir,key)
+    tmpfile = npyfile+'.'+str(os.getpid())+'.tmp'
+    with open(tmpfile,'wb') as f:
+        numpy.save(f,beam_image)
+    os.replace(tmpfile,npyfile)
+    evict_beam_cache(cachedir,cachesize,keep=npyfile)
 
 
+def evict_beam_cache(cachedir,cachesize,keep=''):
+    # Remove least recently used beams until the cache fits in cachesize GB
+    beams = glob.glob(cachedir+'/beam_*.npy')
+    beams = sorted(beams,key=lambda x: os.path.getmtime(x))
+    total = sum(os.path.getsize(x) for x in beams)
+    for npyfile in beams:
+        if total <= cachesize*1e9:
+            break
+        if npyfile == keep:
+            continue
+        total -= os.path.getsize(npyfile)
+        msg('Evicting '+npyfile+' from beam cache')
+        os.remove(npyfile)
+
+
+def get_output_names(input_fits,pbcor_fits='',pb_fits='',wt_fits=''):
+    # Generate output names if not provided
+    if pbcor_fits == '':
+        pbcor_fits = input_fits.replace('.fits','.pbcor.fits')
+        check_name(input_fits,pbcor_fits)
+    if pb_fits == '':
+        pb_fits = input_fits.replace('.fits','.pb.fits')
+        check_name(input_fits,pb_fits)
+    if wt_fits == '':
+        wt_fits = input_fits.replace('.fits','.wt.fits')
+        check_name(input_fits,wt_fits)
+    return pbcor_fits,pb_fits,wt_fits
+
+
+def get_plane_freqs(fitsfile,freqaxis):
+    # Frequency in MHz of every plane along freqaxis
+    hdr = fits.getheader(fitsfile)
+    nplanes = get_nplanes(fitsfile,freqaxis)
+    crval = hdr.get('CRVAL'+freqaxis)
+    crpix = hdr.get('CRPIX'+freqaxis,1.0)
+    cdelt = hdr.get('CDELT'+freqaxis,0.0)
+    freqs = [(crval+((i+1)-crpix)*cdelt)/1e6 for i in range(0,nplanes)]
+    return freqs
+
+
+def prepare_beam(beam_model,nx,dx,freq,pbcut,azavg,cachedir,key):
+    # Worker: evaluate one beam and leave it in the cache for correct_plane
+    beam_image = make_beam(beam_model,nx,dx,freq,pbcut,azavg)
+    put_cached_beam(cachedir,key,beam_image,cachesize=numpy.inf)
+    return key
+
+
+def correct_plane(input_fits,plane,freqaxis,beam_npy,outputs):
+    # Worker: apply one beam to one plane and write that plane of each output
+    beam_image = numpy.load(beam_npy,mmap_mode='r')
+    input_image = get_image(input_fits,plane,freqaxis)
+    for output_fits,product in outputs:
+        if product == 'pbcor':
+            newimage = input_image / beam_image
+        elif product == 'pb':
+            newimage = beam_image
+        elif product == 'wt':
+            newimage = beam_image**2.0
+        flush_fits(newimage,output_fits,plane,freqaxis)
+    msg('Corrected plane '+str(plane)+' of '+input_fits)
+    return input_fits,plane
+
+
+def run_batch(fitslist,band,beam_model,freq,freqaxis,pbcut,azavg,
+            savepbcor,savepb,savewt,overwrite,usecache,cachedir,cachesize,ncpu):
+
+    # Correct a list of images and/or cubes, evaluating the beam once per
+    # distinct geometry and frequency and processing planes in a worker pool
+
+    if not usecache:
+        cachedir = tempfile.mkdtemp(prefix='pbcor_beams_',dir='.')
+
+    beams = {}
+    jobs = []
+
+    for input_fits in fitslist:
+        msg(' <--- '+input_fits)
+        nx,ny,dx,dy,fitsfreq = get_header(input_fits,freqaxis)
+        if nx != ny or abs(dx) != abs(dy):
+            msg('Can only handle square images / pixels, skipping '+input_fits)
+            continue
+
+        pbcor_fits,pb_fits,wt_fits = get_output_names(input_fits)
+        outputs = []
+        if savepbcor:
+            outputs.append((pbcor_fits,'pbcor'))
+        if savepb:
+            outputs.append((pb_fits,'pb'))
+        if savewt:
+            outputs.append((wt_fits,'wt'))
+        if not overwrite and True in [check_file(x[0]) for x in outputs]:
+            continue
+        for output_fits,product in outputs:
+            msg(' ---> '+output_fits)
+            create_fits(input_fits,output_fits,copy=False)
+
+        for plane,plane_freq in enumerate(get_plane_freqs(input_fits,freqaxis)):
+            if freq != '':
+                plane_freq = float(freq)
+            key = beam_cache_key(band,beam_model,nx,dx,plane_freq,pbcut,azavg)
+            beams[key] = (nx,dx,plane_freq)
+            jobs.append((input_fits,plane,freqaxis,beam_cache_file(cachedir,key),outputs))
+
+    msg(str(len(beams))+' distinct beam(s) required for '+str(len(jobs))+' plane(s)')
+
+    pending = []
+    for key in beams:
+        if get_cached_beam(cachedir,key) is None:
+            nx,dx,plane_freq = beams[key]
+            pending.append((beam_model,nx,dx,plane_freq,pbcut,azavg,cachedir,key))
+        else:
+            msg('Read beam pattern from cache '+cachedir)
+
+    with Pool(processes=ncpu) as pool:
+        pool.starmap(prepare_beam,pending)
+        pool.starmap(correct_plane,jobs)
+
+    if usecache:
+        evict_beam_cache(cachedir,cachesize)
+    else:
+        shutil.rmtree(cachedir)
+
 
 def main():
 
@@ -78,7 +262,7 @@ def main():
     # -------------------------------------------------
     # Options and some error checking
 
-    parser = OptionParser(usage = '%prog [options] input_fits')
+    parser = OptionParser(usage = '%prog [options] input_fits [input_fits ...]')
     parser.add_option('--band', dest = 'band', help = 'Select [U]HF or [L]-band (default = L-band)', default = 'L')
     parser.add_option('--freq', dest = 'freq', help = 'Frequency in MHz at which to evaluate beam model (default = get from input FITS header)', default = '')
     parser.add_option('--freqaxis', dest = 'freqaxis', help = 'Frequency axis in FITS header (default = 3, set to 4 for DDFacet images)', default = '3')
@@ -90,11 +274,27 @@ def main():
     parser.add_option('--pbcorname', dest = 'pbcor_fits', help = 'Filename for primary beam corrected image (default = based on input image)', default = '')
     parser.add_option('--pbname', dest = 'pb_fits', help = 'Filename for primary beam image (default = based on input image)', default = '')
     parser.add_option('--wtname', dest = 'wt_fits', help = 'Filename for weight image (default = based on input image)', default = '')
+    parser.add_option('--cache', dest = 'usecache', help = 'Read and write beam patterns in a cache folder shared between runs (default = do not cache)', action = 'store_true', default = False)
+    parser.add_option('--cachedir', dest = 'cachedir', help = 'Folder for cached beam patterns with --cache (default = BEAMCACHE)', default = 'BEAMCACHE')
+    parser.add_option('--cachesize', dest = 'cachesize', help = 'Maximum size of the beam cache in GB with --cache (default = 20)', default = 20)
+    parser.add_option('--batch', dest = 'batch', help = 'Correct every plane of every input image / cube / glob pattern (default = single image)', action = 'store_true', default = False)
+    parser.add_option('--ncpu', dest = 'ncpu', help = 'Number of worker processes for batch mode (default = 4)', default = 4)
     parser.add_option('--overwrite', '-f', dest = 'overwrite', help = 'Overwrite any existing output files (default = do not overwrite)', action = 'store_true', default = False)
     (options,args) = parser.parse_args()
 
-    # Input FITS file
-    if len(args) != 1:
+    # Input FITS file(s)
+    batch = options.batch
+    if batch:
+        fitslist = []
+        for arg in args:
+            fitslist.extend(sorted(glob.glob(arg.rstrip('/'))))
+        if len(fitslist) == 0:
+            msg('No FITS images match the input pattern(s)')
+            sys.exit()
+        if '' not in [options.pbcor_fits,options.pb_fits,options.wt_fits]:
+            msg('Custom output names are not available in batch mode')
+            sys.exit()
+    elif len(args) != 1:
         msg('Please provide a FITS image')
         sys.exit()
     else:
@@ -123,6 +323,11 @@ def main():
             msg('Try: pip install scikit-ued')
             azavg = False
 
+    # Beam cache
+    usecache = options.usecache
+    cachedir = options.cachedir.rstrip('/')
+    cachesize = float(options.cachesize)
+
     # Output files
     savepbcor = options.savepbcor
     savepb = options.savepb
@@ -131,24 +336,15 @@ def main():
         msg('Nothing to do, please check your options')
         sys.exit()
 
-    # Generate output names if not provided
-    pbcor_fits = options.pbcor_fits
-    pb_fits = options.pb_fits
-    wt_fits = options.wt_fits
+    overwrite = options.overwrite
+    ncpu = int(options.ncpu)
 
-    if pbcor_fits == '':
-        pbcor_fits = input_fits.replace('.fits','.pbcor.fits')
-        check_name(input_fits,pbcor_fits)
-    if pb_fits == '':
-        pb_fits = input_fits.replace('.fits','.pb.fits')
-        check_name(input_fits,pb_fits)
-    if wt_fits == '':
-        wt_fits = input_fits.replace('.fits','.wt.fits')
-        check_name(input_fits,wt_fits)
+    if not batch:
+        pbcor_fits,pb_fits,wt_fits = get_output_names(input_fits,
+                                options.pbcor_fits,options.pb_fits,options.wt_fits)
 
     # Bail out if some files will be overwritten
-    overwrite = options.overwrite
-    if not overwrite:
+    if not overwrite and not batch:
         file_check = []
         if savepbcor:
             file_check.append(check_file(pbcor_fits))
@@ -175,7 +371,12 @@ def main():
         band = 'S-band' 
     msg('Band is '+band)
     msg('Beam model is '+beam_model)
-    beam = JimBeam(beam_model)
+
+    if batch:
+        run_batch(fitslist,band,beam_model,freq,freqaxis,pbcut,azavg,
+                savepbcor,savepb,savewt,overwrite,usecache,cachedir,cachesize,ncpu)
+        msg('Done')
+        return
 
     # Get header info
     msg('Reading FITS image')
@@ -184,32 +385,23 @@ def main():
     if nx != ny or abs(dx) != abs(dy):
         msg('Can only handle square images / pixels')
         sys.exit()
-    extent = nx*dx # degrees
 
     if freq == '':
         freq = fitsfreq/1e6
     else:
         freq = float(freq)
 
-    msg('Evaluating beam at '+str(round(freq,4))+' MHz')
-    interval = numpy.linspace(-extent/2.0,extent/2.0,nx)
-    xx,yy = numpy.meshgrid(interval,interval)
-    beam_image = beam.I(xx,yy,freq)
-
-    msg('Masking beam beyond the '+str(pbcut)+' level')
-    mask = beam_image < pbcut
-    beam_image[mask] = numpy.nan
-
-    if azavg:
-        msg('Azimuthally averaging the beam pattern')
-        x0 = int(nx/2)
-        y0 = int(ny/2)
-        radius,average = aa(beam_image,center=(x0,y0))
-        # This can probably be sped up...
-        for y in range(0,ny):
-            for x in range(0,nx):
-                val = (((float(y)-y0)**2.0)+((float(x)-x0)**2.0))**0.5
-                beam_image[y][x] = average[int(val)]
+    beam_image = None
+    if usecache:
+        key = beam_cache_key(band,beam_model,nx,dx,freq,pbcut,azavg)
+        beam_image = get_cached_beam(cachedir,key)
+        if beam_image is not None:
+            msg('Read beam pattern from cache '+cachedir)
+    if beam_image is None:
+        beam_image = make_beam(beam_model,nx,dx,freq,pbcut,azavg)
+        if usecache:
+            msg('Saving beam pattern to cache '+cachedir)
+            put_cached_beam(cachedir,key,beam_image,cachesize)
 
     if savepbcor:
         msg('Correcting image')
@@ -217,17 +409,17 @@ def main():
         pbcor_image = input_image / beam_image
         msg('Writing primary beam corrected image')
         msg(' ---> '+pbcor_fits)
-        copyfile(input_fits,pbcor_fits)
+        create_fits(input_fits,pbcor_fits)
         flush_fits(pbcor_image,pbcor_fits)
     if savepb:
         msg('Writing primary beam image')
         msg(' ---> '+pb_fits)
-        copyfile(input_fits,pb_fits)
+        create_fits(input_fits,pb_fits)
         flush_fits(beam_image,pb_fits)
     if savewt:
         msg('Writing weight (pb^2) image')
         msg(' ---> '+wt_fits)
-        copyfile(input_fits,wt_fits)
+        create_fits(input_fits,wt_fits)
         flush_fits(beam_image**2.0,wt_fits)
 
     msg('Done')
@@ -1,51 +1,101 @@
 import numpy
+import os.path as o
 import scipy.ndimage
 import scipy.special
-import shutil
 import sys
-from astropy.io import fits
+import time
+from concurrent.futures import ThreadPoolExecutor
 from optparse import OptionParser
 from scipy.ndimage.morphology import binary_dilation
 from scipy.ndimage.measurements import label
-from scipy.ndimage import sum as ndi_sum
-
-
-def get_image(fitsfile):
-    print('Reading '+fitsfile)
-    input_hdu = fits.open(fitsfile)[0]
-    if len(input_hdu.data.shape) == 2:
-            image = numpy.array(input_hdu.data[:,:])
-    elif len(input_hdu.data.shape) == 3:
-            image = numpy.array(input_hdu.data[0,:,:])
-    else:
-            image = numpy.array(input_hdu.data[0,0,:,:])
-    return image
-
-
-def flush_fits(newimage,fitsfile):
-    print('Writing '+fitsfile)
-    f = fits.open(fitsfile,mode='update')
-    input_hdu = f[0]
-    if len(input_hdu.data.shape) == 2:
-            input_hdu.data[:,:] = newimage
-    elif len(input_hdu.data.shape) == 3:
-            input_hdu.data[0,:,:] = newimage
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.fits_io import get_image, flush_fits, create_fits
+
+
+def vhgw_minimum_1d(image,size,out):
+    # van Herk/Gil-Werman running minimum down the columns of image: a
+    # forward and a backward cumulative minimum within blocks of length
+    # size, so the cost per pixel does not depend on the box size. The
+    # window is clipped at the image edges, which matches the default
+    # reflect mode of scipy.ndimage.minimum_filter
+    n,m = image.shape
+    left = size//2
+    nblocks = -(-(n+size-1)//size)
+    padded = numpy.full((nblocks*size,m),numpy.inf,dtype=image.dtype)
+    padded[left:left+n] = image
+    padded = padded.reshape((nblocks,size,m))
+    forward = numpy.minimum.accumulate(padded,axis=1).reshape((nblocks*size,m))
+    backward = numpy.minimum.accumulate(padded[:,::-1],axis=1)[:,::-1].reshape((nblocks*size,m))
+    numpy.minimum(backward[0:n],forward[size-1:size-1+n],out=out)
+
+
+def vhgw_pass(image,size,nthreads,chunk=256):
+    # Run vhgw_minimum_1d over stripes of columns in a thread pool
+    out = numpy.empty_like(image)
+    m = image.shape[1]
+    stripes = [(i,min(i+chunk,m)) for i in range(0,m,chunk)]
+    def do_stripe(stripe):
+        vhgw_minimum_1d(image[:,stripe[0]:stripe[1]],size,out[:,stripe[0]:stripe[1]])
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        list(executor.map(do_stripe,stripes))
+    return out
+
+
+def vhgw_minimum(image,boxsize,nthreads=4):
+    # Exact separable box minimum, columns then rows
+    image = numpy.ascontiguousarray(image,dtype=image.dtype.newbyteorder('='))
+    temp = vhgw_pass(image,boxsize,nthreads)
+    temp = vhgw_pass(numpy.ascontiguousarray(temp.T),boxsize,nthreads)
+    return numpy.ascontiguousarray(temp.T)
+
+
+def tile_weights(n,tile,ntiles):
+    # Bilinear interpolation indices and weights from tile centres
+    pos = numpy.clip((numpy.arange(n)+0.5)/tile-0.5,0,ntiles-1)
+    lo = numpy.floor(pos).astype(int)
+    hi = numpy.minimum(lo+1,ntiles-1)
+    wt = (pos-lo).astype(numpy.float32)
+    return lo,hi,wt
+
+
+def decimated_minimum(image,boxsize,ntile=10):
+    # Approximate box minimum: minima of tiles of boxsize/ntile pixels,
+    # a box minimum over ntile tiles on that coarse grid, then bilinear
+    # interpolation from the tile centres back to full resolution
+    ny,nx = image.shape
+    tile = max(1,boxsize//ntile)
+    nty = -(-ny//tile)
+    ntx = -(-nx//tile)
+    padded = numpy.full((nty*tile,ntx*tile),numpy.inf,dtype=numpy.float32)
+    padded[0:ny,0:nx] = image
+    tiles = padded.reshape((nty,tile,ntx*tile)).min(axis=1).reshape((nty,ntx,tile)).min(axis=2)
+    grid = scipy.ndimage.minimum_filter(tiles,max(1,boxsize//tile))
+    lo,hi,wt = tile_weights(ny,tile,nty)
+    rows = grid[lo]*(1.0-wt)[:,None] + grid[hi]*wt[:,None]
+    lo,hi,wt = tile_weights(nx,tile,ntx)
+    return rows[:,lo]*(1.0-wt) + rows[:,hi]*wt
+
+
+def box_minimum(image,boxsize,method='filter',nthreads=4):
+    if method == 'vhgw':
+        return vhgw_minimum(image,boxsize,nthreads)
+    elif method == 'decimate':
+        return decimated_minimum(image,boxsize)
     else:
-            input_hdu.data[0,0,:,:] = newimage
-    f.flush()
+        return scipy.ndimage.minimum_filter(image,(boxsize,boxsize))
 
 
-def make_noise_map(restored_image,boxsize):
+def make_noise_map(restored_image,boxsize,method='filter',nthreads=4):
     # Cyril's magic minimum filter
     # Plundered from the depths of https://github.com/cyriltasse/DDFacet/blob/master/SkyModel/MakeMask.py
-    print('Generating noise map')
-    box = (boxsize,boxsize)
+    print('Generating noise map ('+method+')')
     n = boxsize**2.0
     x = numpy.linspace(-10,10,1000)
     f = 0.5 * (1.0 + scipy.special.erf(x / numpy.sqrt(2.0)))
     F = 1.0 - (1.0 - f)**n
     ratio = numpy.abs(numpy.interp(0.5, F, x))
-    noise = -scipy.ndimage.filters.minimum_filter(restored_image, box) / ratio
+    noise = box_minimum(restored_image, boxsize, method, nthreads)
+    numpy.divide(noise, -ratio, out=noise)
     negative_mask = noise < 0.0
     noise[negative_mask] = 1.0e-10
     median_noise = numpy.median(noise)
@@ -55,6 +105,34 @@ def make_noise_map(restored_image,boxsize):
     return noise
 
 
+def island_sizes(mask_image,ntop=5):
+    # Label the mask once and size every island with bincount, returning
+    # the number of islands and the ntop largest sizes in descending order
+    labeled_mask_image, n_islands = label(mask_image)
+    sizes = numpy.bincount(labeled_mask_image.ravel(), minlength=n_islands+1)[1:]
+    if n_islands > ntop:
+        sizes = sizes[numpy.argpartition(sizes, -ntop)[-ntop:]]
+    return n_islands, numpy.sort(sizes)[::-1]
+
+
+def compare_noise_maps(restored_image,boxsize,method,threshold,nthreads):
+    # Check a noise map engine against scipy's minimum_filter
+    t0 = time.time()
+    reference = make_noise_map(restored_image,boxsize,'filter')
+    t1 = time.time()
+    noise = make_noise_map(restored_image,boxsize,method,nthreads)
+    t2 = time.time()
+    fracdiff = numpy.abs(noise-reference)/reference
+    ref_mask = restored_image > threshold * reference
+    mask = restored_image > threshold * noise
+    print('Noise map comparison, box size '+str(boxsize)+' pixels')
+    print('  filter time           : '+str(round(t1-t0,2))+' s')
+    print('  '+method.ljust(22)+': '+str(round(t2-t1,2))+' s')
+    print('  Max fractional diff   : '+str(numpy.max(fracdiff)))
+    print('  Median fractional diff: '+str(numpy.median(fracdiff)))
+    print('  Mask pixels differing : '+str(numpy.sum(ref_mask != mask))+' of '+str(numpy.sum(ref_mask)))
+
+
 def main():
 
     parser = OptionParser(usage = '%prog [options] restored_image')
@@ -63,6 +141,9 @@ def main():
     parser.add_option('--smallbox', dest = 'smallbox', help = 'Box size to switch to for fields with small islands (default = 50), set to zero to just use boxsize', default = 50)
     parser.add_option('--islandsize', dest = 'islandsize', help = 'Island size in pixels below which smallbox is used (default = 30000)', default = 30000)
     parser.add_option('--dilate', dest = 'dilate', help = 'Number of iterations of binary dilation (default = 3, set to 0 to disable)', default = 3)
+    parser.add_option('--noisemethod', dest = 'noisemethod', help = 'Box minimum engine for the noise map: filter (scipy), vhgw (exact, van Herk/Gil-Werman) or decimate (approximate, coarse grid) (default = filter)', default = 'filter')
+    parser.add_option('--comparenoise', dest = 'comparenoise', help = 'Compare the noise map from noisemethod against filter and exit', action = 'store_true', default = False)
+    parser.add_option('--nthreads', dest = 'nthreads', help = 'Number of threads for the vhgw noise method (default = 4)', default = 4)
     parser.add_option('--savenoise', dest = 'savenoise', help = 'Enable to export noise image as FITS file (default = do not save noise image', action = 'store_true', default = False)
     parser.add_option('--outfile', dest = 'outfile', help = 'Suffix for mask image (default = restored_image.replace(".fits",".mask.fits"))', default = '')
     (options,args) = parser.parse_args()
@@ -71,6 +152,9 @@ def main():
     smallbox = int(options.smallbox)
     islandsize = int(options.islandsize)
     dilate = int(options.dilate)
+    noisemethod = options.noisemethod.lower()
+    comparenoise = options.comparenoise
+    nthreads = int(options.nthreads)
     savenoise = options.savenoise
     outfile = options.outfile
 
@@ -80,37 +164,44 @@ def main():
     else:
         input_fits = args[0].rstrip('/')
 
+    print('Reading '+input_fits)
     input_image = get_image(input_fits)
+    input_image = numpy.ascontiguousarray(input_image, dtype=input_image.dtype.newbyteorder('='))
+
+    if noisemethod not in ['filter','vhgw','decimate']:
+        print('Noise method must be one of filter, vhgw or decimate')
+        sys.exit()
+
+    if comparenoise:
+        for box in [boxsize,smallbox]:
+            if box != 0:
+                compare_noise_maps(input_image,box,noisemethod,threshold,nthreads)
+        sys.exit()
 
     print('Computing mask with box size: '+str(boxsize)+' pixels')
     print('Threshold: '+str(threshold))
-    noise_image = make_noise_map(input_image,boxsize)
+    noise_image = make_noise_map(input_image,boxsize,noisemethod,nthreads)
     mask_image = input_image > threshold * noise_image
 
     if smallbox != 0:
-        print('Counting islands...')
-        sizes = []
-        mask_image = mask_image.byteswap().newbyteorder()
-        labeled_mask_image, n_islands = label(mask_image)
+        print('Counting and sizing islands...')
+        n_islands, sizes = island_sizes(mask_image)
         print('Found '+str(n_islands))
-        print('Sizing them up...')
-        indices = numpy.arange(0,n_islands)
-        sizes = ndi_sum(mask_image, labeled_mask_image, indices)
-        sizes = numpy.sort(sizes)[::-1]
         print('Island size threshold: '+str(islandsize))
         print('Top five island sizes:')
-        print(sizes[0:5])
-        if sizes[0] < islandsize:
+        print(sizes)
+        if n_islands == 0 or sizes[0] < islandsize:
             print('Largest island has fewer than '+str(islandsize)+' pixels')
-            print('Recomputing mask with box size: '+str(smallbox)+' pixels')
-            noise_image = make_noise_map(input_image,smallbox)
-            mask_image = input_image > threshold * noise_image
+            print('Recomputing noise map with box size: '+str(smallbox)+' pixels')
+            noise_image = make_noise_map(input_image,smallbox,noisemethod,nthreads)
+            numpy.greater(input_image, threshold * noise_image, out=mask_image)
         else:
             print('Sticking with box size: '+str(boxsize)+' pixels')
 
     if savenoise:
         noise_fits = input_fits.replace('.fits', '.noise.fits')
-        shutil.copyfile(input_fits, noise_fits)
+        print('Writing '+noise_fits)
+        create_fits(input_fits, noise_fits)
         flush_fits(noise_image, noise_fits)
 
     mask_image[:,-1]=0
@@ -127,8 +218,8 @@ def main():
         mask_fits = input_fits.replace('.fits', '.mask.fits')
     else:
         mask_fits = outfile
-    shutil.copyfile(input_fits, mask_fits)
-
+    print('Writing '+mask_fits)
+    create_fits(input_fits, mask_fits)
     flush_fits(mask_image,mask_fits)
 
     print('Done')
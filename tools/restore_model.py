@@ -6,9 +6,9 @@ import glob
 import logging
 import numpy
 import os
+import os.path as o
 import random 
 import scipy.signal
-import shutil
 import string
 import sys
 
@@ -17,32 +17,8 @@ from astropy.convolution import convolve,Gaussian2DKernel
 from itertools import repeat
 from multiprocessing import Pool
 
-
-def get_image(fitsfile):
-        input_hdu = fits.open(fitsfile)[0]
-        if len(input_hdu.data.shape) == 2:
-                image = numpy.array(input_hdu.data[:,:])
-        elif len(input_hdu.data.shape) == 3:
-                image = numpy.array(input_hdu.data[0,:,:])
-        elif len(input_hdu.data.shape) == 4:
-                image = numpy.array(input_hdu.data[0,0,:,:])
-        else:
-                image = numpy.array(input_hdu.data[0,0,0,:,:])
-        return image
-
-
-def flush_fits(newimage,fitsfile):
-        f = fits.open(fitsfile,mode='update')
-        input_hdu = f[0]
-        if len(input_hdu.data.shape) == 2:
-                input_hdu.data[:,:] = newimage
-        elif len(input_hdu.data.shape) == 3:
-                input_hdu.data[0,:,:] = newimage_
-        elif len(input_hdu.data.shape) == 4:
-                input_hdu.data[0,0,:,:] = newimage
-        else:
-                input_hdu.data[0,0,0,:,:] = newimage
-        f.flush()
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.fits_io import get_image, flush_fits, create_fits
 
 
 def deg2rad(xx):
@@ -76,7 +52,7 @@ def convolve_fits(residual_fits,model_image,proc_id):
         # Set up FITS files
         psf_fits = residual_fits.replace('image','psf')
         restored_fits = residual_fits.replace('image','image-restored')
-        shutil.copyfile(residual_fits,restored_fits)
+        create_fits(residual_fits,restored_fits)
 
 
         # Get the fitted beam
@@ -6,8 +6,11 @@ from astropy.time import Time
 from pyrap.tables import table
 import logging
 import numpy
+import os.path as o
 import pickle
 import sys
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+from oxkat.ms_catalogue import get_catalogue
 
 
 def main():
@@ -34,16 +37,15 @@ def main():
     mylogger.setLevel(logging.DEBUG)
     mylogger.addHandler(stream)
 
-    tt = table(myms,ack=False)
-    all_times = list(numpy.unique(tt.getcol('TIME')))
+    cat = get_catalogue(myms)
+    index = cat['scans']
+    all_times = index['times']
     track_length = round(((all_times[-1] - all_times[0]) / 3600.0),3)
-    scan_numbers = list(set(tt.getcol('SCAN_NUMBER')))
+    scan_numbers = index['scans']
     n_scans = len(scan_numbers)
-    exposure = round(numpy.mean(tt.getcol('EXPOSURE')),4)
-    field_tab = table(myms+'/FIELD',ack=False)
-    field_names = field_tab.getcol('NAME')
+    exposure = round(index['mean_exposure'],4)
+    field_names = cat['field']['name']
     n_fields = len(field_names)
-    field_tab.done()
 
     scan_list = []
     pickle_name = 'scantimes_'+myms+'.p'
@@ -55,17 +57,15 @@ def main():
         mylogger.info('-'*len(header))
         mylogger.info(header)
         mylogger.info('-'*len(header))
-        for scan in scan_numbers:
-            subtab = tt.query(query='SCAN_NUMBER=='+str(scan))
-            times = subtab.getcol('TIME')
-            field_id = list(set(subtab.getcol("FIELD_ID")))[0]
+        for i in range(0,n_scans):
+            scan = int(scan_numbers[i])
+            field_id = int(index['field'][i])
             field_name = field_names[field_id]
-            subtab.done()
 
-            t0 = times[0] # start time for this scan 
-            t1 = times[-1] # end time for this scan
-            int0 = all_times.index(t0) # start interval number in the full MS
-            int1 = all_times.index(t1) # end interval number in the full MS
+            t0 = index['t0'][i] # start time for this scan 
+            t1 = index['t1'][i] # end time for this scan
+            int0 = int(index['int0'][i]) # start interval number in the full MS
+            int1 = int(index['int1'][i]) # end interval number in the full MS
             dt = (t1-t0) # duration of this scan
             duration = round((dt/60.0),2) # duration in minutes
             n_int = int(dt / exposure) # number of integration times in this scan
@@ -83,24 +83,24 @@ def main():
 
     else:
 
-        subtab = tt.query(query='SCAN_NUMBER=='+str(myscan))
+        tt = table(myms,ack=False)
+        subtab = tt.query(query='SCAN_NUMBER=='+str(myscan),columns='TIME')
         times = numpy.unique(subtab.getcol('TIME'))
         subtab.done()
+        tt.done()
+        intervals = numpy.searchsorted(all_times,times)
 
         mylogger.info('Per-integration time details for scan '+myscan)
         header = 't[iso]                    t[s]                 int'
         mylogger.info('-'*len(header))
         mylogger.info(header)
         mylogger.info('-'*len(header))
-        for t_i in times:
+        for t_i,int_i in zip(times,intervals):
             t_iso = Time(t_i/86400.0,format='mjd').iso
-            int_i = all_times.index(t_i)
             mylogger.info('%-25s %-20f %-7s' %
                 (t_iso,t_i,int_i))
         mylogger.info('-'*len(header))
 
-    tt.done()
-
 
 if __name__ == "__main__":
 
@@ -15,7 +15,15 @@ from oxkat import generate_jobs as gen
 from oxkat import config as cfg
 
 
-def write_slurm(opfile,jobname,logfile,syscall):
+def write_slurm(opfile,jobname,logfile,array):
+
+    # array is a list of (code, syscall) tuples, submitted as a single job
+    # array with one task per interval imaging job
+
+    if cfg.JOB_ARRAY_MAX > 0:
+        slurm_throttle = '%'+str(cfg.JOB_ARRAY_MAX)
+    else:
+        slurm_throttle = ''
 
     f = open(opfile,'w')
     f.writelines(['#!/bin/bash\n',
@@ -29,7 +37,8 @@ def write_slurm(opfile,jobname,logfile,syscall):
         '#SBATCH --mem=115GB\n',
         '#SBATCH --account=b24-thunderkat-ag\n',
         '#SBATCH --output='+logfile+'\n',
-        syscall+'\n'])
+        '#SBATCH --array=0-'+str(len(array)-1)+slurm_throttle+'\n',
+        'SECONDS=0\n']+gen.array_case(array,'$SLURM_ARRAY_TASK_ID'))
     f.close()
 
 
@@ -66,8 +75,7 @@ def main():
 
     runfile = 'submit_interval_jobs.sh'
 
-    f = open(runfile,'w')
-    f.writelines(['#!/bin/bash\n'])
+    array = []
 
     for ss in scan_times:
         targetname = ss[0]
@@ -94,13 +102,20 @@ def main():
                     syscall += '-nwlayers 1 -niter 0 -name '+imgname+' '
                     syscall += '-weight briggs -0.3 -data-column CORRECTED_DATA -padding 1.2 -absmem 110 '+myms
 
-                    slurm_file = 'SCRIPTS/slurm_intervals_'+code+'.sh'
-                    log_file = 'LOGS/slurm_intervals_'+code+'.log'
+                    array.append((code,syscall))
+
+    if len(array) == 0:
+        print('No interval MSs found')
+        return
 
-                    write_slurm(opfile=slurm_file,jobname=code,logfile=log_file,syscall=syscall)
+    slurm_file = 'SCRIPTS/slurm_intervals.sh'
+    log_file = 'LOGS/slurm_intervals_%a.log'
 
-                    f.writelines(['sbatch '+slurm_file+'\n'])
-                    
+    write_slurm(opfile=slurm_file,jobname='intrvl',logfile=log_file,array=array)
+
+    f = open(runfile,'w')
+    f.writelines(['#!/bin/bash\n',
+        'sbatch '+slurm_file+'\n'])
     f.close()
     gen.make_executable(runfile)
     print('Wrote '+runfile+' script')